@@ -4,27 +4,83 @@ import secrets
 import csv
 import click
 import datetime # <--- 添加导入
-from io import StringIO
+import json
+import math
+import base64
+import uuid
+import codecs
+import hashlib
+import hmac
+import pickle
+import threading
+import time
+import heapq
+import itertools
+import logging
+import random
+import socket
+from collections import OrderedDict, namedtuple, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO, TextIOWrapper
+from urllib.parse import urlencode
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    flash, Response, jsonify # 添加 jsonify 用于可能的 AJAX 响应
+    flash, Response, jsonify, # 添加 jsonify 用于可能的 AJAX 响应
+    stream_with_context, make_response, session, g, abort, has_app_context, has_request_context, current_app,
+    before_render_template, template_rendered
 )
+from markupsafe import Markup
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func # 导入 func 用于计算总分
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy import event, func, or_, and_, select, update, insert, delete, cast, case, literal, union_all, text # 导入 func 用于计算总分
 from flask_login import (
     LoginManager, login_user, logout_user,
-    login_required, current_user, UserMixin
+    login_required, current_user, UserMixin, login_url
 )
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_migrate import Migrate
 
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import Pool, QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+try: # 可选依赖：用于姓名拼音首字母搜索
+    from pypinyin import lazy_pinyin, Style as PinyinStyle
+except ImportError:
+    lazy_pinyin = None
+
+try: # 可选依赖：多进程部署时的共享缓存后端
+    import redis
+except ImportError:
+    redis = None
+
+try: # 可选依赖：Parquet / Arrow 格式导出
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try: # 可选依赖：Excel (xlsx) 格式导出
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
 # ─── 加载配置 ────────────────────────────────────────────────────────────────
-def load_config():
-    cfg_file = 'config.yaml'
+def load_config(cfg_file='config.yaml'):
     default_cfg = {
-        'database': {'url': 'sqlite:///students.db'}, # 默认使用 SQLite
-        'app':      {'secret_key': '', 'debug': False}
+        # 默认使用 SQLite；pool_* 为连接池参数（见 ENGINE_OPTION_KEYS），MySQL 等数据库建议保留 pre_ping 和 recycle
+        'database': {'url': 'sqlite:///students.db', 'pool_pre_ping': True, 'pool_recycle': 1800},
+        'app':      {'secret_key': '', 'debug': False},
+        # 查询缓存：backend 为 local（进程内）或 redis（多进程共享，需要安装 redis 包）
+        'cache':    {'backend': 'local', 'ttl': 300, 'max_entries': 1024, 'redis_url': ''}
     }
     if not os.path.exists(cfg_file):
         with open(cfg_file, 'w', encoding='utf-8') as f:
@@ -71,34 +127,555 @@ def load_config():
     if 'database' not in cfg or 'url' not in cfg['database']:
         print("警告：配置中缺少 'database.url'，使用默认 SQLite。")
         cfg['database'] = {'url': 'sqlite:///students.db'}
+    # 环境变量 DATABASE_URL 优先于配置文件（基准测试、容器部署时使用，不写回 config.yaml）
+    if os.environ.get('DATABASE_URL'):
+        cfg['database']['url'] = os.environ['DATABASE_URL']
 
     return cfg
 
-config = load_config()
-
 # ─── Flask 应用 & 扩展 初始化 ────────────────────────────────────────────────
-app = Flask(__name__)
-app.config.update({
-    'SQLALCHEMY_DATABASE_URI':          config['database']['url'],
-    'SECRET_KEY':                       config['app']['secret_key'],
-    'SQLALCHEMY_TRACK_MODIFICATIONS': False,
-    'DEBUG':                            config['app']['debug'],
-    'UPLOAD_FOLDER':                    os.path.join(os.getcwd(), 'uploads'),
-    'ALLOWED_EXTENSIONS':               {'csv'}
-})
-
-# 确保上传目录存在
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
-
-db = SQLAlchemy(app)
-migrate = Migrate(app, db) # 初始化 Flask-Migrate
-login_manager = LoginManager(app)
+def create_app(config_file='config.yaml'):
+    """
+    应用工厂：读取配置（不存在时生成 config.yaml 和 secret_key）、创建上传目录，创建 app 并初始化扩展、
+    注册路由、请求钩子和 CLI 命令。flask 命令行（自动发现 create_app）和 wsgi.py 都通过它创建应用；
+    生产环境的启动检查和预热见 initialize_database() / warm_up()。
+    """
+    global cache, fragment_cache, rate_limiter, replica_router, perf_history, import_executor
+    config = load_config(config_file)
+
+    app = Flask(__name__)
+    app.config.update({
+        'SQLALCHEMY_DATABASE_URI':          config['database']['url'],
+        'SECRET_KEY':                       config['app']['secret_key'],
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'DEBUG':                            config['app']['debug'],
+        'UPLOAD_FOLDER':                    os.path.join(os.getcwd(), 'uploads'),
+        'ALLOWED_EXTENSIONS':               {'csv'},
+        'STUDENTS_PER_PAGE':                50,  # 学生列表每页默认条数
+        'STUDENTS_PER_PAGE_MAX':            500, # per_page 参数上限
+        'EXPORT_CHUNK_SIZE':                1000, # 导出时每批读取的学生数
+        'IMPORT_BATCH_SIZE':                500,  # 导入时每批（每个事务）写入的行数
+        'IMPORT_ASYNC':                     True, # 在后台线程中执行导入，请求立即返回任务 ID
+        'IMPORT_WORKERS':                   2,    # 后台导入线程数
+        'API_BATCH_MAX':                    1000, # JSON API 批量接口每次请求最多处理的记录数
+        'RANK_INCREMENTAL_MAX':             3,    # 一次变更涉及的学生数不超过此值时逐行平移名次，否则按受影响的分组用 RANK() 重算
+        'STATS_PERCENTILES':                (0.25, 0.5, 0.75, 0.9), # 统计页计算的百分位数
+        'STATS_HISTOGRAM_BIN_WIDTH':        10,   # 成绩直方图的分段宽度
+        'STATS_HISTOGRAM_MAX_BINS':         50,   # 直方图最多分段数（超出时自动加宽分段）
+        'LIST_FRAGMENT_CACHE':              True, # 缓存未筛选学生列表第一页渲染好的表格 HTML（按数据版本失效）
+        'LIST_FRAGMENT_CACHE_ENTRIES':      32,   # 表格片段缓存最多保存的条目数（每种排序一条）
+        # 请求性能分析（可在 config.yaml 的 profiling 段开启），见“性能分析”一节
+        'PROFILING_ENABLED':                bool((config.get('profiling') or {}).get('enabled', False)),
+        'PROFILING_SAMPLE_RATE':            float((config.get('profiling') or {}).get('sample_rate', 1.0)), # 被分析的请求比例 0~1
+        'PROFILING_SLOW_QUERIES':           5,    # 每个请求保留的最慢 SQL 条数
+        'PROFILING_HISTORY':                200,  # /debug/perf 保留的最近请求数
+        'PROFILING_HEADERS':                True, # 在响应头中返回 X-Query-Count / Server-Timing 等
+        'METRICS_REQUIRE_AUTH':             True, # /metrics 是否需要登录（Prometheus 可用 basic_auth 抓取）
+        'WARMUP_CONNECTIONS':               2,    # 预热时预先建立的数据库连接数
+        'REPLICA_READ_YOUR_WRITES_SECONDS': 10,   # 用户写入后这段时间内的读请求仍走主库，避免读到从库延迟的旧数据
+        'REPLICA_HEALTH_CHECK_INTERVAL':    10,   # 从库健康检查的间隔（秒），不可用的从库在此期间被跳过
+        # 密码哈希方法（werkzeug 格式，如 scrypt:32768:8:1 或 pbkdf2:sha256:600000），可在 config.yaml 的 security 段修改
+        'PASSWORD_HASH_METHOD':             str((config.get('security') or {}).get('password_hash_method') or 'scrypt'),
+        'PASSWORD_CHECK_CACHE_SECONDS':     300,  # HTTP Basic 认证通过的凭据在进程内缓存的秒数，期间不再重新计算哈希（0 为不缓存）
+        # 密码校验限流：(桶容量, 装满所需秒数)，分别按客户端 IP 和 用户名+客户端 IP 计
+        'LOGIN_RATE_LIMITS':                {'ip': (20, 60), 'user': (5, 60)},
+        # 应用前面可信的反向代理层数（config.yaml 的 security.proxy_hops），大于 0 时按 X-Forwarded-For 等头还原客户端 IP。
+        # 只能填实际的代理层数：填多了客户端可以伪造 X-Forwarded-For 绕过按 IP 的限流
+        'PROXY_FIX_HOPS':                   int((config.get('security') or {}).get('proxy_hops') or 0),
+        # 首个管理员的初始密码（见 initial_admin_password()，环境变量 INITIAL_ADMIN_PASSWORD 优先）
+        'INITIAL_ADMIN_PASSWORD':           config['app'].get('initial_admin_password') or None,
+        # 拥有管理员权限（如查看 /debug/perf）的用户名，可在 config.yaml 的 security.admin_usernames 中修改
+        'ADMIN_USERNAMES':                  frozenset((config.get('security') or {}).get('admin_usernames') or ['admin']),
+    })
+
+    if app.config['PROXY_FIX_HOPS']:
+        hops = app.config['PROXY_FIX_HOPS']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+
+    # 确保上传目录存在
+    if not os.path.exists(app.config['UPLOAD_FOLDER']):
+        os.makedirs(app.config['UPLOAD_FOLDER'])
+
+    # 连接池参数；config.yaml 中 database.replicas 列出的从库作为额外的 bind（replica_0、replica_1 ...，见“主从路由”）
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(config['database'])
+    app.config['SQLALCHEMY_BINDS'] = {
+        f'replica_{i}': {'url': url, **build_engine_options({**config['database'], 'url': url})}
+        for i, url in enumerate(config['database'].get('replicas') or [])
+    }
+
+    db.init_app(app)
+    migrate.init_app(app, db) # 初始化 Flask-Migrate
+    login_manager.init_app(app)
+    setup.init_app(app)
+
+    # 进程内的缓存、限流计数、从库路由、性能记录和导入线程池按本应用的配置创建
+    # （每个进程只创建一个应用；测试中每次创建应用都会替换它们）
+    cache = create_cache(config.get('cache'))
+    rate_limiter = create_rate_limit_store(config.get('cache'))
+    fragment_cache = FragmentCache(max_entries=app.config['LIST_FRAGMENT_CACHE_ENTRIES'])
+    replica_router = ReplicaRouter(list(app.config['SQLALCHEMY_BINDS']))
+    perf_history = deque(maxlen=app.config['PROFILING_HISTORY'])
+    import_executor = ThreadPoolExecutor(max_workers=app.config['IMPORT_WORKERS'], thread_name_prefix='csv-import')
+    return app
+
+class AppSetup:
+    """
+    记录路由、请求钩子、模板上下文处理器、信号和 CLI 命令，create_app() 创建应用时逐一注册到新的 app 上。
+    用法与 Flask 对象相同（@setup.route、@setup.before_request ...，CLI 命令为 @setup.command）；
+    不使用蓝图是为了保持端点名不变（url_for('student_list') 而不是 url_for('main.student_list')）。
+    """
+
+    def __init__(self):
+        self._deferred = [] # 每项为 register(app)，按声明顺序执行
+
+    def _defer(self, register):
+        self._deferred.append(register)
+
+    def route(self, rule, **options):
+        def decorator(view):
+            self._defer(lambda app: app.route(rule, **options)(view))
+            return view
+        return decorator
+
+    def before_request(self, f):
+        self._defer(lambda app: app.before_request(f))
+        return f
+
+    def after_request(self, f):
+        self._defer(lambda app: app.after_request(f))
+        return f
+
+    def context_processor(self, f):
+        self._defer(lambda app: app.context_processor(f))
+        return f
+
+    def connect(self, signal):
+        """只接收本应用发出的信号（等同于 signal.connect_via(app)）"""
+        def decorator(f):
+            self._defer(lambda app: signal.connect(f, app))
+            return f
+        return decorator
+
+    def command(self, *args, **kwargs):
+        """flask 命令行命令；执行时已推入应用上下文"""
+        def decorator(f):
+            self._defer(lambda app: app.cli.command(*args, **kwargs)(f))
+            return f
+        return decorator
+
+    def init_app(self, app):
+        for register in self._deferred:
+            register(app)
+
+setup = AppSetup()
+
+# ─── 监控指标 ────────────────────────────────────────────────────────────────
+# 进程内的 Prometheus 指标，由 /metrics 以文本格式输出（不依赖 prometheus_client）。
+# 以多个 worker 进程部署时，每个进程各自计数。
+METRICS = [] # 全部指标，按注册顺序输出
+METRIC_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_metric_labels(labels):
+    if not labels:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+class Metric:
+    """一个指标族（counter / gauge / histogram），按标签值分别计数（线程安全）"""
+
+    def __init__(self, name, documentation, kind, labelnames=(), buckets=()):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {} # 标签值元组 -> 数值；histogram 为 [各分段累计数, 总和, 次数]
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def expose(self):
+        """文本格式的输出行"""
+        with self._lock:
+            items = sorted((key, [list(value[0]), value[1], value[2]] if self.kind == 'histogram' else value)
+                           for key, value in self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, value in items:
+            labels = dict(zip(self.labelnames, key))
+            if self.kind != 'histogram':
+                lines.append(f'{self.name}{_format_metric_labels(labels)} {value}')
+                continue
+            counts, total, count = value
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_format_metric_labels({**labels, "le": repr(float(bound))})} {bucket_count}')
+            lines.append(f'{self.name}_bucket{_format_metric_labels({**labels, "le": "+Inf"})} {count}')
+            lines.append(f'{self.name}_sum{_format_metric_labels(labels)} {total}')
+            lines.append(f'{self.name}_count{_format_metric_labels(labels)} {count}')
+        return lines
+
+HTTP_REQUESTS = Metric('http_requests_total', '按端点和状态码统计的请求数', 'counter',
+                       ('method', 'endpoint', 'status'))
+HTTP_LATENCY = Metric('http_request_duration_seconds', '请求处理耗时（秒）', 'histogram',
+                      ('method', 'endpoint'), METRIC_LATENCY_BUCKETS)
+POOL_CHECKOUTS = Metric('db_pool_checkouts_total', '从连接池取出连接的次数', 'counter')
+POOL_CONNECTS = Metric('db_pool_connections_created_total', '新建的数据库连接数', 'counter')
+POOL_TIMEOUTS = Metric('db_pool_timeouts_total', '等待连接池超时的次数', 'counter')
+POOL_WAIT = Metric('db_pool_wait_seconds', '从连接池取连接的耗时（含等待空闲连接和新建连接）', 'histogram',
+                   buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+POOL_SIZE = Metric('db_pool_size', '连接池大小', 'gauge')
+POOL_CHECKED_OUT = Metric('db_pool_checked_out', '当前被取出使用中的连接数', 'gauge')
+POOL_OVERFLOW = Metric('db_pool_overflow', '当前溢出连接数（超出 pool_size 的连接；负数表示尚未建满）', 'gauge')
+IMPORT_ROWS = Metric('student_import_rows_total', 'CSV 导入处理的行数（imported / updated / skipped）', 'counter',
+                     ('result',))
+IMPORT_JOBS = Metric('student_import_jobs_total', '结束的 CSV 导入任务数', 'counter', ('status',))
+IMPORT_DURATION = Metric('student_import_duration_seconds', 'CSV 导入任务耗时（秒）', 'histogram',
+                         buckets=(1, 5, 15, 60, 300, 900, 3600))
+
+class MeteredQueuePool(QueuePool):
+    """记录取连接耗时和超时次数的 QueuePool"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - start)
+
+# config.yaml 的 database 段中可以设置的连接池参数（原样传给 create_engine）
+ENGINE_OPTION_KEYS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle', 'pool_pre_ping')
+
+def build_engine_options(db_cfg):
+    """
+    由 config.yaml 的 database 段生成 SQLALCHEMY_ENGINE_OPTIONS：使用 MeteredQueuePool，并带上配置的连接池参数。
+    SQLite 内存数据库不使用连接池，保持默认。
+    """
+    url = make_url(db_cfg['url'])
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}
+    options = {'poolclass': MeteredQueuePool}
+    options.update({key: db_cfg[key] for key in ENGINE_OPTION_KEYS if db_cfg.get(key) is not None})
+    return options
+
+@event.listens_for(Pool, 'checkout')
+def _count_pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    POOL_CHECKOUTS.inc()
+
+@event.listens_for(Pool, 'connect')
+def _count_pool_connect(dbapi_connection, connection_record):
+    POOL_CONNECTS.inc()
+
+READ_ROUTING = Metric('db_read_routing_total', '只读请求使用的数据库（primary 或从库的 bind 名）', 'counter', ('target',))
+
+# ─── 主从路由 ────────────────────────────────────────────────────────────────
+# config.yaml 中 database.replicas 列出的从库作为额外的 bind（replica_0、replica_1 ...），连接池参数与主库相同。
+# 用 @read_replica 标记的视图在 GET 请求中把查询发往从库（轮询，跳过不可用的从库，都不可用时用主库）；
+# 写入语句和 flush 总是使用主库。用户刚写入过数据时，其后 REPLICA_READ_YOUR_WRITES_SECONDS 秒内的读请求也走主库。
+class RoutingSession(FlaskSQLAlchemySession):
+    """请求选择了从库（g.read_engine）时，读查询使用从库；写入语句、flush 和显式指定的 bind 不受影响"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not getattr(clause, 'is_dml', False) and has_request_context():
+            engine = g.get('read_engine')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+class ReplicaRouter:
+    """在从库之间轮询；每个从库最多每 REPLICA_HEALTH_CHECK_INTERVAL 秒用 SELECT 1 检查一次是否可用"""
+
+    def __init__(self, keys):
+        self.keys = keys
+        self._counter = itertools.count()
+        self._health = {} # key -> (检查时间, 是否可用)
+        self._lock = threading.Lock()
+
+    def _healthy(self, key):
+        now = time.monotonic()
+        with self._lock:
+            checked = self._health.get(key)
+        if checked and now - checked[0] < current_app.config['REPLICA_HEALTH_CHECK_INTERVAL']:
+            return checked[1]
+        try:
+            with db.engines[key].connect() as connection:
+                connection.execute(select(literal(1)))
+            ok = True
+        except Exception as e:
+            current_app.logger.warning(f"Read replica {key} unavailable, falling back: {e}")
+            ok = False
+        with self._lock:
+            self._health[key] = (now, ok)
+        return ok
+
+    def choose(self):
+        """下一个可用从库的 (bind 名, engine)；都不可用时返回 (None, None)，即使用主库"""
+        start = next(self._counter)
+        for i in range(len(self.keys)):
+            key = self.keys[(start + i) % len(self.keys)]
+            if self._healthy(key):
+                return key, db.engines[key]
+        return None, None
+
+replica_router = None # create_app() 按配置的从库创建 ReplicaRouter
+
+def read_replica(view):
+    """标记只读视图：其 GET 请求中的查询可以发往从库（放在 @login_required 之下）"""
+    view.use_replica = True
+    return view
+
+@setup.before_request
+def _route_reads():
+    if not replica_router.keys or request.method not in ('GET', 'HEAD'):
+        return
+    if not getattr(current_app.view_functions.get(request.endpoint), 'use_replica', False):
+        return
+    last_write = session.get('last_write')
+    if last_write and time.time() - last_write < current_app.config['REPLICA_READ_YOUR_WRITES_SECONDS']:
+        READ_ROUTING.inc(target='primary')
+        return
+    key, g.read_engine = replica_router.choose()
+    READ_ROUTING.inc(target=key or 'primary')
+
+@setup.after_request
+def _remember_write(response):
+    # 本次请求提交过数据修改（见 _bump_data_version）时记录时间，用于 read-your-writes
+    if g.pop('data_written', False) and replica_router.keys:
+        session['last_write'] = time.time()
+    return response
+
+# 扩展在 create_app() 中通过 init_app 绑定到应用
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+migrate = Migrate()
+login_manager = LoginManager()
 login_manager.login_view = 'login'
 login_manager.login_message = "请先登录以访问此页面。"
 login_manager.login_message_category = "warning"
 
 
+# ─── 缓存 ────────────────────────────────────────────────────────────────────
+class LocalCache:
+    """进程内缓存：条目按 TTL 过期，超过 max_entries 时淘汰最久未使用的条目（线程安全）"""
+
+    def __init__(self, ttl=300, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCache:
+    """Redis 缓存后端：多个 worker 进程共享同一份数据，失效对所有进程立即生效"""
+
+    def __init__(self, url, ttl=300, prefix='student_mgmt:'):
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self._client.set(self.prefix + key, pickle.dumps(value), ex=ttl or self.ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self._client.delete(*(self.prefix + key for key in keys))
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + '*'):
+            self._client.delete(key)
+
+
+def create_cache(cache_cfg):
+    """根据配置创建缓存后端；redis 不可用时回退为进程内缓存"""
+    cache_cfg = cache_cfg or {}
+    ttl = int(cache_cfg.get('ttl') or 300)
+    if cache_cfg.get('backend') == 'redis':
+        if redis is None or not cache_cfg.get('redis_url'):
+            print("警告：缓存后端配置为 redis，但未安装 redis 包或缺少 'cache.redis_url'，改用进程内缓存。")
+        else:
+            return RedisCache(cache_cfg['redis_url'], ttl=ttl)
+    return LocalCache(ttl=ttl, max_entries=int(cache_cfg.get('max_entries') or 1024))
+
+cache = None # create_app() 按 config.yaml 的 cache 段创建
+
+
+class FragmentCache(LocalCache):
+    """
+    渲染好的页面片段缓存（进程内，容量很小）：只保存一个数据版本的条目，遇到更新的版本时清空全部旧条目。
+    与 cache 分开，避免大块 HTML 挤掉科目列表、登录用户等条目。
+    """
+
+    def __init__(self, max_entries):
+        super().__init__(max_entries=max_entries)
+        self.version = None
+
+    def _current(self, version):
+        """version 是否为当前版本；更新的版本到来时清空旧条目（落后的从库读到的旧版本不读也不写）"""
+        with self._lock:
+            if self.version is None or version > self.version:
+                self._data.clear()
+                self.version = version
+            return version == self.version
+
+    def get_fragment(self, version, key):
+        return self.get(key) if self._current(version) else None
+
+    def set_fragment(self, version, key, html):
+        if self._current(version):
+            self.set(key, html)
+
+fragment_cache = None # create_app() 按 LIST_FRAGMENT_CACHE_ENTRIES 创建 FragmentCache
+
+
+# ─── 登录限流 ────────────────────────────────────────────────────────────────
+# 令牌桶：每次校验密码前按客户端 IP 和用户名各取一个令牌，桶空时直接拒绝，不再计算哈希
+# （密码哈希故意很慢，大量错误登录会占满 worker）。存储后端与缓存相同：cache.backend 为 redis 时
+# 各 worker 进程共享计数，否则每个进程各自计数。
+LOGIN_ATTEMPTS = Metric('login_attempts_total', '密码校验次数（success / failure / throttled）', 'counter', ('result',))
+
+class LocalRateLimitStore:
+    """进程内令牌桶（线程安全），超过 max_entries 个键时淘汰最久未使用的"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict() # key -> (剩余令牌数, 更新时间)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, period):
+        """取一个令牌：成功返回 0，桶空时返回还需等待的秒数（桶每 period 秒装满 capacity 个令牌）"""
+        rate = capacity / period
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1 if tokens >= 1 else tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+class RedisRateLimitStore:
+    """Redis 令牌桶：在 Lua 脚本中原子地补充和取用令牌，多个 worker 进程共享同一个桶"""
+
+    SCRIPT = """
+    local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = math.min(capacity, (tonumber(bucket[1]) or capacity) + math.max(0, now - (tonumber(bucket[2]) or now)) * rate)
+    local wait = 0
+    if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url, prefix='student_mgmt:'):
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, capacity, period):
+        # 使用墙上时间：各进程的 monotonic 时钟不可比较
+        return float(self._take(keys=[self.prefix + key], args=[capacity, capacity / period, time.time()]))
+
+    def reset(self, key):
+        self._client.delete(self.prefix + key)
+
+
+def create_rate_limit_store(cache_cfg):
+    """与缓存后端一致：配置为 redis 且可用时使用 Redis，否则使用进程内存储"""
+    cache_cfg = cache_cfg or {}
+    if cache_cfg.get('backend') == 'redis' and redis is not None and cache_cfg.get('redis_url'):
+        return RedisRateLimitStore(cache_cfg['redis_url'])
+    return LocalRateLimitStore()
+
+rate_limiter = None # create_app() 按 config.yaml 的 cache 段创建
+
+def throttle_password_check(username=None):
+    """
+    校验密码前调用：按客户端 IP 和 用户名+客户端 IP（如有用户名）各取一个令牌。
+    用户名的桶带上 IP，同一攻击者反复猜某个用户的密码时不会把该用户从其他地址锁在外面。
+    任一桶已空时返回需要等待的秒数，调用方应拒绝本次请求且不计算哈希；否则返回 0。
+    """
+    limits = current_app.config['LOGIN_RATE_LIMITS']
+    wait = 0
+    for kind, value in (('ip', request.remote_addr), ('user', _user_bucket(username))):
+        if value and kind in limits:
+            capacity, period = limits[kind]
+            wait = max(wait, rate_limiter.take(f'ratelimit:{kind}:{value}', capacity, period))
+    if wait:
+        LOGIN_ATTEMPTS.inc(result='throttled')
+    return wait
+
+def _user_bucket(username):
+    return f'{username.lower()}|{request.remote_addr}' if username else None
+
+def reset_password_throttle(username):
+    """密码校验通过后清空该用户名在当前 IP 上的桶，用户之前输错的次数不影响之后的登录"""
+    rate_limiter.reset(f'ratelimit:user:{_user_bucket(username)}')
+
+
 # ─── 模型 ────────────────────────────────────────────────────────────────────
 class User(db.Model, UserMixin):
     id       = db.Column(db.Integer, primary_key=True)
@@ -118,9 +695,27 @@ class Student(db.Model):
     name       = db.Column(db.String(80), nullable=False)
     class_name = db.Column(db.String(50), nullable=False) # 班级名称可能需要更长
     # 确保这里没有 math_score 等直接的分数列！
+    # 冗余的总分与成绩条数，在每次增删改成绩时同步维护（见 refresh_student_totals），可直接排序/筛选
+    total_score = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    score_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # 物化的名次（按总分降序，并列同名次）；没有任何成绩的学生为 NULL。由 update_rankings / rebuild_rankings 维护
+    overall_rank = db.Column(db.Integer)
+    class_rank   = db.Column(db.Integer)
     scores     = db.relationship('Score', backref='student', lazy='dynamic', cascade="all, delete-orphan") # lazy='dynamic' 方便查询
+    name_tokens = db.relationship('StudentNameToken', lazy='dynamic', cascade="all, delete-orphan") # 姓名搜索索引
+
+    __table_args__ = (
+        db.Index('ix_student_name', 'name'),                                  # 姓名搜索
+        db.Index('ix_student_total_score_id', total_score.desc(), id),        # 按总分排序（与列表页 ORDER BY 方向一致）
+        # 按班级筛选/班内按总分排序；带上 score_count 使统计页的班级百分位定位只读索引
+        db.Index('ix_student_class_total_count', 'class_name', 'total_score', 'score_count'),
+        db.Index('ix_student_overall_rank', 'overall_rank'),                 # 按全校名次筛选
+        db.Index('ix_student_class_rank', 'class_name', 'class_rank'),       # 按班内名次筛选（如 3 班前 50 名）
+    )
 
     # 计算总分的方法
+    # 注意：以下两个方法每次调用都会查询数据库，仅用于单个学生的场景或校验；
+    # 列表页等批量场景请使用 total_score 列和 build_score_matrix() 一次性加载。
     def get_total_score(self):
         # 使用 SQLAlchemy 的聚合函数
         total = db.session.query(func.sum(Score.score))\
@@ -142,9 +737,14 @@ class Score(db.Model):
     score      = db.Column(db.Float, nullable=False)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id', ondelete='CASCADE'), nullable=False) # 添加 ondelete
     subject_id = db.Column(db.Integer, db.ForeignKey('subject.id', ondelete='CASCADE'), nullable=False) # 添加 ondelete
+    subject_rank = db.Column(db.Integer) # 该科目内的名次（按分数降序，并列同名次）
 
-    # 确保一个学生对于一个科目只有一个分数
-    __table_args__ = (db.UniqueConstraint('student_id', 'subject_id', name='_student_subject_uc'),)
+    # 确保一个学生对于一个科目只有一个分数；该唯一索引同时服务按学生取成绩的查询
+    __table_args__ = (
+        db.UniqueConstraint('student_id', 'subject_id', name='_student_subject_uc'),
+        db.Index('ix_score_subject_score', 'subject_id', 'score'), # 按科目排序/统计、删除科目时的级联删除
+        db.Index('ix_score_subject_rank', 'subject_id', 'subject_rank'), # 按科目名次筛选
+    )
 
     def __repr__(self):
         # Avoid potential N+1 problem if backref wasn't used carefully elsewhere
@@ -154,36 +754,989 @@ class Score(db.Model):
         # return f'<Score {self.student.name} - {self.subject.name}: {self.score}>' # Use with caution
 
 
+class StudentNameToken(db.Model):
+    """
+    姓名搜索索引：每个学生姓名拆分出的单字、相邻双字以及拼音首字母前缀（'py:' 开头）。
+    搜索时按 token 精确匹配（走索引），替代无法使用索引的 LIKE '%关键字%'。
+    """
+    id         = db.Column(db.Integer, primary_key=True)
+    token      = db.Column(db.String(40), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id', ondelete='CASCADE'), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_student_name_token_token', 'token', 'student_id'),
+        db.Index('ix_student_name_token_student', 'student_id'),
+    )
+
+    def __repr__(self):
+        return f'<StudentNameToken {self.student_id}: {self.token}>'
+
+
+class ImportJob(db.Model):
+    """后台 CSV 导入任务，进度写入数据库，任意 Web 进程都可以查询"""
+    id             = db.Column(db.String(32), primary_key=True) # uuid4 hex
+    filename       = db.Column(db.String(255), nullable=False)  # 用户上传时的原始文件名
+    mode           = db.Column(db.String(20), nullable=False, default='append')
+    status         = db.Column(db.String(20), nullable=False, default='queued') # queued / running / done / failed
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    imported       = db.Column(db.Integer, nullable=False, default=0)
+    updated        = db.Column(db.Integer, nullable=False, default=0)
+    skipped        = db.Column(db.Integer, nullable=False, default=0)
+    errors         = db.Column(db.Text)        # JSON：前 IMPORT_JOB_MAX_ERRORS 条跳过原因 [[行号, 原因], ...]
+    warning        = db.Column(db.Text)        # 未识别科目等提示
+    message        = db.Column(db.Text)        # 完成/失败时的汇总消息
+    category       = db.Column(db.String(20))  # message 对应的 flash 类别
+    created_by     = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    created_at     = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    finished_at    = db.Column(db.DateTime)
+    worker         = db.Column(db.String(100)) # 执行任务的进程 "主机名:pid"，用于识别进程退出后遗留的任务
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'mode': self.mode,
+            'status': self.status,
+            'rows_processed': self.rows_processed,
+            'imported': self.imported,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'errors': json.loads(self.errors) if self.errors else [],
+            'warning': self.warning,
+            'message': self.message,
+            'category': self.category,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<ImportJob {self.id} {self.status}>'
+
+
+class DataVersion(db.Model):
+    """全局数据版本（单行，id=1）：学生/成绩/科目的任何写入提交时加一，用于生成 ETag 和失效页面片段缓存"""
+    id         = db.Column(db.Integer, primary_key=True)
+    version    = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow) # UTC
+
+    def __repr__(self):
+        return f'<DataVersion {self.version}>'
+
+
+# --- 缓存的查询 ---
+# 科目列表以轻量元组缓存（可序列化，且不绑定数据库会话）
+SubjectInfo = namedtuple('SubjectInfo', ['id', 'name'])
+
+def get_subjects():
+    """按 ID 排序的全部科目（带缓存），元素为 SubjectInfo(id, name)"""
+    subjects = cache.get('subjects')
+    if subjects is None:
+        subjects = [SubjectInfo(sid, name)
+                    for sid, name in db.session.query(Subject.id, Subject.name).order_by(Subject.id)]
+        cache.set('subjects', subjects)
+    return subjects
+
+def invalidate_subjects():
+    """科目增删改提交后调用"""
+    cache.delete('subjects')
+
+def invalidate_user(user_id):
+    """用户信息（如密码）修改提交后调用"""
+    cache.delete(f'user:{user_id}')
+
+
+# --- 密码 ---
+_password_hash_prefixes = {} # 配置的哈希方法 -> 规范化后的方法前缀（如 'scrypt' -> 'scrypt:32768:8:1'）
+verified_credentials = LocalCache(ttl=300, max_entries=1024) # HTTP Basic 认证通过的凭据摘要（只放进程内，不进共享缓存）
+
+def hash_password(password):
+    """按配置的方法（PASSWORD_HASH_METHOD）计算密码哈希"""
+    return generate_password_hash(password, method=current_app.config['PASSWORD_HASH_METHOD'])
+
+def password_needs_rehash(stored_hash):
+    """已存储的哈希所用的方法或参数与当前配置不同时返回 True"""
+    method = current_app.config['PASSWORD_HASH_METHOD']
+    prefix = _password_hash_prefixes.get(method)
+    if prefix is None: # 按配置计算一次哈希，取其中的方法部分，得到带完整参数的前缀
+        prefix = _password_hash_prefixes[method] = hash_password('').split('$', 1)[0]
+    return stored_hash.split('$', 1)[0] != prefix
+
+def verify_password(user, password):
+    """
+    校验用户密码。通过且存储的哈希使用的是旧的方法/参数时，用当前配置重新计算哈希并提交，
+    修改 PASSWORD_HASH_METHOD 后用户下次登录即自动升级，无需重置密码。
+    """
+    ok = check_password_hash(user.password, password or '')
+    LOGIN_ATTEMPTS.inc(result='success' if ok else 'failure')
+    if ok and password_needs_rehash(user.password):
+        user.password = hash_password(password)
+        db.session.commit()
+        invalidate_user(user.id)
+    return ok
+
+def _credentials_key(user, password):
+    # 含存储的哈希：修改密码（或重新计算哈希）后旧的缓存条目自动失效
+    message = f'{user.id}\0{password}\0{user.password}'.encode('utf-8')
+    return hmac.new(current_app.config['SECRET_KEY'].encode('utf-8'), message, hashlib.sha256).hexdigest()
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # 缓存中只保存 id 和用户名；密码哈希等其他字段在真正访问时才从数据库加载
+    key = f'user:{user_id}'
+    data = cache.get(key)
+    if data is None:
+        user = db.session.get(User, int(user_id))
+        if user is not None:
+            cache.set(key, {'id': user.id, 'username': user.username})
+        return user
+    user = User(**data)
+    make_transient_to_detached(user) # 视为已持久化的对象，未缓存的属性在访问时延迟加载
+    return db.session.merge(user, load=False)
+
+@login_manager.request_loader
+def load_user_from_request(req):
+    """没有登录会话时，接受 HTTP Basic 认证（供 /api/v1 的脚本客户端使用）"""
+    auth = req.authorization
+    if auth is None or auth.type != 'basic' or not auth.username:
+        return None
+    user = User.query.filter_by(username=auth.username).first()
+    if user is None:
+        return None
+    # 脚本客户端每个请求都带密码：验证通过的凭据缓存一段时间，避免每个请求都重新计算慢哈希
+    ttl = current_app.config['PASSWORD_CHECK_CACHE_SECONDS']
+    if ttl and verified_credentials.get(_credentials_key(user, auth.password or '')):
+        return user
+    if throttle_password_check(user.username): # 被限流时按未认证处理（401）
+        return None
+    if not verify_password(user, auth.password):
+        return None
+    reset_password_throttle(user.username)
+    if ttl:
+        verified_credentials.set(_credentials_key(user, auth.password or ''), True, ttl)
+    return user
+
+@login_manager.unauthorized_handler
+def unauthorized():
+    """API 和 /metrics 请求返回 JSON 401；页面请求与默认行为一致：提示并跳转到登录页"""
+    if request.path.startswith('/api/') or request.path == '/metrics':
+        response = jsonify({'error': 'authentication required'})
+        response.status_code = 401
+        response.headers['WWW-Authenticate'] = 'Basic realm="student-management"'
+        return response
+    flash(login_manager.login_message, login_manager.login_message_category)
+    return redirect(login_url(login_manager.login_view, next_url=request.url))
+
+# --- 数据版本与条件请求 ---
+# 写入这些表的事务在提交前把 DataVersion 加一（与数据修改在同一事务中）。
+# ORM 对象的增删改在 after_flush 中记录，批量 insert/update/delete 语句在 do_orm_execute 中记录，
+# 因此所有写入路径（页面、导入、API、CLI）都无需显式调用。
+VERSIONED_TABLES = frozenset({'student', 'score', 'subject', 'student_name_token'})
+
+def _mark_data_changed(sess, table_names):
+    if not VERSIONED_TABLES.isdisjoint(table_names):
+        sess.info['data_changed'] = True
+
+@event.listens_for(db.session, 'after_flush')
+def _track_flushed_changes(sess, flush_context):
+    changed = {obj.__table__.name for obj in (*sess.new, *sess.dirty, *sess.deleted)}
+    _mark_data_changed(sess, changed)
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _track_bulk_changes(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None:
+            _mark_data_changed(orm_execute_state.session, {table.name})
+
+@event.listens_for(db.session, 'before_commit')
+def _bump_data_version(sess):
+    sess.flush() # 提交时才 flush 的修改也要计入
+    if not sess.info.pop('data_changed', False):
+        return
+    if has_request_context():
+        g.data_written = True
+    now = datetime.datetime.utcnow()
+    result = sess.execute(update(DataVersion).where(DataVersion.id == 1)
+                          .values(version=DataVersion.version + 1, updated_at=now))
+    if result.rowcount == 0:
+        sess.add(DataVersion(id=1, version=1, updated_at=now))
+        sess.flush()
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_data_changed(sess, previous_transaction):
+    sess.info.pop('data_changed', None)
+
+def get_data_version():
+    """当前数据版本 (version, updated_at)，同一请求内只查询一次；尚未有任何写入时为 (0, None)"""
+    if 'data_version' not in g:
+        row = db.session.query(DataVersion.version, DataVersion.updated_at).filter(DataVersion.id == 1).first()
+        g.data_version = (row.version, row.updated_at) if row else (0, None)
+    return g.data_version
+
+def conditional_validators(*variant):
+    """返回 (etag, last_modified)。ETag 由数据版本、当前用户和 variant（区分同一视图的不同输出）决定"""
+    version, updated_at = get_data_version()
+    key = repr((version, current_user.get_id()) + variant)
+    etag = hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+    last_modified = updated_at.replace(tzinfo=datetime.timezone.utc) if updated_at else None
+    return etag, last_modified
+
+def has_pending_flashes():
+    """会话中有尚未显示的 flash 消息时，页面内容不能由客户端缓存替代"""
+    return '_flashes' in session
+
+def is_not_modified(etag, last_modified):
+    """客户端缓存是否仍然有效；If-None-Match 存在时忽略 If-Modified-Since"""
+    if has_pending_flashes():
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+def set_validators(response, etag, last_modified):
+    """附加 ETag/Last-Modified；private, no-cache 要求浏览器每次都用条件请求重新验证"""
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def not_modified_response(etag, last_modified):
+    return set_validators(Response(status=304), etag, last_modified)
+
+# --- 性能分析 ---
+# 开启后按 PROFILING_SAMPLE_RATE 抽样请求，记录 SQL 条数、数据库耗时、最慢的语句和模板渲染耗时，
+# 通过响应头 (X-Query-Count、Server-Timing 等)、日志和管理员页面 /debug/perf 查看。
+# 未被抽中的请求只有一次 g 查找的开销。流式响应（如 CSV 导出）在发送正文时执行的查询不计入。
+perf_logger = logging.getLogger(__name__).getChild('perf') # 即 app.logger 的子 logger
+perf_logger.setLevel(logging.INFO)
+perf_history = None # 最近请求的统计，供 /debug/perf 展示（create_app() 按 PROFILING_HISTORY 创建 deque）
+perf_history_lock = threading.Lock()
+
+def _current_perf():
+    """当前请求的统计（未开启或未被抽中时为 None）"""
+    return g.get('perf') if has_app_context() else None
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _perf_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_perf() is not None:
+        conn.info.setdefault('perf_query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _perf_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    perf = _current_perf()
+    starts = conn.info.get('perf_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop() # 请求统计已结束（如流式响应）时也要出栈
+    if perf is None:
+        return
+    perf['queries'] += 1
+    perf['db_time'] += elapsed
+    # 小顶堆只保留最慢的 N 条；序号避免耗时相同时比较语句文本
+    entry = (elapsed, perf['queries'], ' '.join(statement.split())[:500])
+    if len(perf['slowest']) < current_app.config['PROFILING_SLOW_QUERIES']:
+        heapq.heappush(perf['slowest'], entry)
+    else:
+        heapq.heappushpop(perf['slowest'], entry)
+
+@event.listens_for(Engine, 'handle_error')
+def _perf_handle_error(exception_context):
+    """语句执行失败时不会触发 after_cursor_execute：弹出对应的开始时间，避免连接归还连接池后计时错位"""
+    connection = exception_context.connection
+    if connection is None or exception_context.execution_context is None: # 不是执行语句时出错
+        return
+    starts = connection.info.get('perf_query_start')
+    if starts:
+        starts.pop()
+
+@setup.connect(before_render_template)
+def _perf_before_render(sender, template, context, **extra):
+    perf = _current_perf()
+    if perf is not None:
+        perf['render_starts'].append(time.perf_counter())
+
+@setup.connect(template_rendered)
+def _perf_template_rendered(sender, template, context, **extra):
+    perf = _current_perf()
+    if perf is not None and perf['render_starts']:
+        start = perf['render_starts'].pop()
+        if not perf['render_starts']: # 嵌套渲染只计最外层
+            perf['render_time'] += time.perf_counter() - start
+
+@setup.before_request
+def _perf_start_request():
+    if not current_app.config['PROFILING_ENABLED'] or request.endpoint == 'static':
+        return
+    if random.random() >= current_app.config['PROFILING_SAMPLE_RATE']:
+        return
+    g.perf = {'start': time.perf_counter(), 'queries': 0, 'db_time': 0.0,
+              'render_time': 0.0, 'render_starts': [], 'slowest': []}
+
+@setup.after_request
+def _perf_finish_request(response):
+    perf = g.pop('perf', None)
+    if perf is None:
+        return response
+    total_ms = (time.perf_counter() - perf['start']) * 1000
+    db_ms, render_ms = perf['db_time'] * 1000, perf['render_time'] * 1000
+    record = {
+        'time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint or '-',
+        'status': response.status_code,
+        'queries': perf['queries'],
+        'db_ms': round(db_ms, 2),
+        'render_ms': round(render_ms, 2),
+        'total_ms': round(total_ms, 2),
+        'slowest': [{'ms': round(elapsed * 1000, 2), 'sql': sql}
+                    for elapsed, _, sql in sorted(perf['slowest'], reverse=True)],
+    }
+    with perf_history_lock:
+        perf_history.append(record)
+    perf_logger.info("%s %s %s queries=%d db=%.1fms render=%.1fms total=%.1fms",
+                     record['method'], record['path'], record['status'],
+                     record['queries'], db_ms, render_ms, total_ms)
+    if current_app.config['PROFILING_HEADERS']:
+        response.headers['X-Query-Count'] = str(perf['queries'])
+        response.headers['X-DB-Time-Ms'] = f"{db_ms:.1f}"
+        response.headers['Server-Timing'] = f"db;dur={db_ms:.1f}, render;dur={render_ms:.1f}, total;dur={total_ms:.1f}"
+    return response
+
+def summarize_perf_history(records):
+    """按端点汇总最近请求：次数、平均/最大耗时、平均 SQL 条数，按总耗时降序"""
+    by_endpoint = {}
+    for record in records:
+        item = by_endpoint.setdefault(record['endpoint'], {'endpoint': record['endpoint'], 'count': 0,
+                                                           'total_ms': 0.0, 'max_ms': 0.0, 'db_ms': 0.0, 'queries': 0})
+        item['count'] += 1
+        item['total_ms'] += record['total_ms']
+        item['max_ms'] = max(item['max_ms'], record['total_ms'])
+        item['db_ms'] += record['db_ms']
+        item['queries'] += record['queries']
+    summary = []
+    for item in by_endpoint.values():
+        count = item['count']
+        summary.append({'endpoint': item['endpoint'], 'count': count,
+                        'avg_ms': round(item['total_ms'] / count, 2), 'max_ms': round(item['max_ms'], 2),
+                        'avg_db_ms': round(item['db_ms'] / count, 2), 'avg_queries': round(item['queries'] / count, 1)})
+    summary.sort(key=lambda item: item['avg_ms'] * item['count'], reverse=True)
+    return summary
+
+@setup.route('/debug/perf')
+@login_required
+def debug_perf():
+    """最近请求的性能统计（仅管理员，见 is_admin()）；format=json 时返回 JSON"""
+    if not is_admin(current_user):
+        abort(403)
+    with perf_history_lock:
+        records = list(perf_history)
+    records.reverse() # 最新的在前
+    summary = summarize_perf_history(records)
+    if request.args.get('format') == 'json':
+        return jsonify({'enabled': current_app.config['PROFILING_ENABLED'],
+                        'sample_rate': current_app.config['PROFILING_SAMPLE_RATE'],
+                        'endpoints': summary, 'requests': records})
+    return render_template('debug_perf.html', records=records, summary=summary)
+
+# --- /metrics ---
+@setup.before_request
+def _metrics_start_request():
+    g.metrics_start = time.perf_counter()
+
+@setup.after_request
+def _metrics_finish_request(response):
+    start = g.pop('metrics_start', None)
+    if start is not None and request.endpoint != 'static':
+        endpoint = request.endpoint or 'unmatched' # 404 等未匹配路由合并为一项，避免标签随 URL 无限增长
+        HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+        HTTP_LATENCY.observe(time.perf_counter() - start, method=request.method, endpoint=endpoint)
+    return response
+
+def collect_pool_metrics():
+    """抓取时读取连接池的当前状态（非 QueuePool 的连接池没有这些统计，跳过）"""
+    pool = db.engine.pool
+    if isinstance(pool, QueuePool):
+        POOL_SIZE.set(pool.size())
+        POOL_CHECKED_OUT.set(pool.checkedout())
+        POOL_OVERFLOW.set(pool.overflow())
+
+@setup.route('/metrics')
+def metrics():
+    """Prometheus 文本格式的监控指标"""
+    if current_app.config['METRICS_REQUIRE_AUTH'] and not current_user.is_authenticated:
+        return login_manager.unauthorized()
+    collect_pool_metrics()
+    lines = [line for metric in METRICS for line in metric.expose()]
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 # --- 上下文处理器 ---
-@app.context_processor
+@setup.context_processor
 def inject_current_year():
     """将当前年份注入所有模板"""
     return {'current_year': datetime.datetime.now().year}
 
+@setup.context_processor
+def inject_is_admin():
+    """模板中用 is_admin(current_user) 判断是否显示管理员菜单"""
+    return {'is_admin': is_admin}
+
 # ─── 辅助函数 ────────────────────────────────────────────────────────────────
 def allowed_file(filename):
     return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+           filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
+
+def is_admin(user):
+    """用户是否为管理员（用户名在 ADMIN_USERNAMES 中）"""
+    return user.is_authenticated and user.username in current_app.config['ADMIN_USERNAMES']
+
+# IN (...) 列表分块大小，避免超出 SQLite 的绑定参数上限
+SQL_IN_CHUNK_SIZE = 500
+
+def chunked(items, size=SQL_IN_CHUNK_SIZE):
+    """将列表按固定大小切块"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def encode_cursor(values):
+    """将 keyset 游标值列表 [sort_value, student_id] 编码为 URL 安全的字符串"""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    """解码 encode_cursor() 生成的游标，无效时返回 None"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != 2 \
+       or not isinstance(values[0], (int, float)) or not isinstance(values[1], int):
+        return None
+    return values
+
+PINYIN_TOKEN_PREFIX = 'py:'
+
+def _has_cjk(text):
+    return any('\u4e00' <= ch <= '\u9fff' for ch in text)
+
+def name_search_tokens(name):
+    """
+    计算姓名的搜索 token：全部单字、相邻双字（小写），
+    若安装了 pypinyin 且姓名含汉字，再加上拼音首字母的各级前缀，如 张三丰 -> py:z, py:zs, py:zsf。
+    """
+    text = name.strip().lower()
+    tokens = set(text)
+    tokens.update(text[i:i + 2] for i in range(len(text) - 1))
+    tokens.discard(' ')
+    if lazy_pinyin is not None and _has_cjk(text):
+        initials = ''.join(part[0] for part in lazy_pinyin(text, style=PinyinStyle.FIRST_LETTER) if part and part[0].isalnum())
+        tokens.update(PINYIN_TOKEN_PREFIX + initials[:i] for i in range(1, min(len(initials), 10) + 1))
+    return tokens
+
+def refresh_name_tokens(student_ids):
+    """按学生当前姓名重建其搜索 token（先删后插，批量执行）。调用方负责 commit"""
+    for id_chunk in chunked(list(student_ids)):
+        db.session.execute(StudentNameToken.__table__.delete().where(StudentNameToken.student_id.in_(id_chunk)))
+        rows = db.session.query(Student.id, Student.name).filter(Student.id.in_(id_chunk)).all()
+        token_rows = [{'student_id': sid, 'token': token}
+                      for sid, name in rows for token in name_search_tokens(name)]
+        if token_rows:
+            db.session.execute(insert(StudentNameToken), token_rows)
+
+def name_search_condition(search_name):
+    """
+    姓名搜索条件：先用 token 索引找出候选学生（查询串的所有双字/单字都命中），
+    再用 LIKE 在候选集上去除误匹配；纯字母的查询串同时按拼音首字母前缀匹配。
+    """
+    text = search_name.strip().lower()
+    grams = {text} if len(text) == 1 else {text[i:i + 2] for i in range(len(text) - 1)}
+    grams.discard(' ')
+    candidates = select(StudentNameToken.student_id)\
+        .where(StudentNameToken.token.in_(grams))\
+        .group_by(StudentNameToken.student_id)\
+        .having(func.count(StudentNameToken.id) >= len(grams))
+    condition = and_(Student.id.in_(candidates), Student.name.like(f"%{search_name}%"))
+    if text.isascii() and text.isalpha() and lazy_pinyin is not None:
+        pinyin_ids = select(StudentNameToken.student_id)\
+            .where(StudentNameToken.token == PINYIN_TOKEN_PREFIX + text)
+        condition = or_(condition, Student.id.in_(pinyin_ids))
+    return condition
+
+def build_student_query(search_name='', student_id=None, sort_by_subject_id=None, sort_by_total=False,
+                        class_name='', top=None):
+    """
+    构造学生列表查询（列表页与 db-audit 共用）。
+    top 按物化名次筛选前 N 名：按科目排序时为该科名次，指定班级时为班内名次，否则为全校名次。
+    返回 (query, sort_expr, descending)：sort_expr 是排序值表达式，同时也是 keyset 游标的第一列。
+    """
+    query = Student.query
+
+    if search_name:
+        query = query.filter(name_search_condition(search_name))
+    if student_id is not None:
+        query = query.filter(Student.id == student_id)
+    if class_name:
+        query = query.filter(Student.class_name == class_name)
+    if top and not sort_by_subject_id:
+        query = query.filter((Student.class_rank if class_name else Student.overall_rank) <= top)
+
+    # Apply sorting
+    descending = True
+    if sort_by_subject_id:
+        query = query.outerjoin(Score, (Student.id == Score.student_id) & (Score.subject_id == sort_by_subject_id))
+        sort_expr = func.coalesce(Score.score, 0) # Sort by score descending, then ID
+        if top:
+            query = query.filter(Score.subject_rank <= top)
+    elif sort_by_total:
+        # 总分已冗余存储在 student.total_score（带索引），直接排序
+        sort_expr = Student.total_score
+    else:
+        # Default sort by ID
+        sort_expr = Student.id
+        descending = False
+    return query, sort_expr, descending
+
+def paginate_students(query, sort_expr, descending, per_page, after=None, before=None, page=1):
+    """
+    对学生查询分页，显示顺序为 sort_expr（descending 指定方向）再按 Student.id 升序。
+    提供 after/before 游标时使用 keyset (seek) 分页，条件为 (sort_value, id) 的行值比较，
+    不随页数增加而变慢；否则按 page 使用 OFFSET 分页。
+    返回 ([(student, sort_value), ...], has_prev, has_next)。
+    """
+    query = query.add_columns(sort_expr)
+
+    def seek(cursor, forward):
+        value, last_id = cursor
+        value_cond = sort_expr < value if forward == descending else sort_expr > value
+        id_cond = Student.id > last_id if forward else Student.id < last_id
+        return or_(value_cond, and_(sort_expr == value, id_cond))
+
+    forward_order = [sort_expr.desc() if descending else sort_expr.asc(), Student.id.asc()]
+    backward_order = [sort_expr.asc() if descending else sort_expr.desc(), Student.id.desc()]
+
+    if before is not None and after is None:
+        rows = query.filter(seek(before, forward=False))\
+                    .order_by(*backward_order)\
+                    .limit(per_page + 1)\
+                    .all()
+        has_prev = len(rows) > per_page
+        rows = list(reversed(rows[:per_page]))
+        return rows, has_prev, True
+
+    query = query.order_by(*forward_order)
+    if after is not None:
+        query = query.filter(seek(after, forward=True))
+        has_prev = True
+    else:
+        query = query.offset((page - 1) * per_page)
+        has_prev = page > 1
+    rows = query.limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    return rows[:per_page], has_prev, has_next
+
+def build_score_matrix(student_ids):
+    """
+    一次性加载指定学生的全部成绩（每 SQL_IN_CHUNK_SIZE 个学生一条查询），
+    返回 {student_id: {subject_id: score}}。
+    用于替代模板中逐格调用 Student.get_score() 造成的 N+1 查询；总分直接读取 Student.total_score。
+    """
+    matrix = {sid: {} for sid in student_ids}
+    for id_chunk in chunked(list(student_ids)):
+        rows = db.session.query(Score.student_id, Score.subject_id, Score.score)\
+                         .filter(Score.student_id.in_(id_chunk))\
+                         .all()
+        for student_id, subject_id, score in rows:
+            matrix[student_id][subject_id] = score
+    return matrix
+
+def refresh_student_totals(student_ids=None):
+    """
+    根据 Score 表重新计算学生的 total_score / score_count（一条关联子查询 UPDATE）。
+    student_ids 为 None 时重算全部学生。调用方负责 commit。
+    """
+    total_sq = select(func.coalesce(func.sum(Score.score), 0.0))\
+        .where(Score.student_id == Student.id)\
+        .scalar_subquery()
+    count_sq = select(func.count(Score.id))\
+        .where(Score.student_id == Student.id)\
+        .scalar_subquery()
+    stmt = update(Student).values(total_score=total_sq, score_count=count_sq)
+    if student_ids is None:
+        db.session.execute(stmt, execution_options={'synchronize_session': False})
+        return
+    for id_chunk in chunked(list(student_ids)):
+        db.session.execute(stmt.where(Student.id.in_(id_chunk)),
+                           execution_options={'synchronize_session': False})
+
+def upsert_scores(score_rows):
+    """
+    按 (student_id, subject_id) 批量写入成绩：已存在则更新分数，否则插入。
+    score_rows 为 [{'student_id', 'subject_id', 'score'}]；依赖 _student_subject_uc 唯一约束，
+    使用数据库原生的 INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE，每块一条 executemany。
+    调用方负责刷新冗余总分和 commit。
+    """
+    if not score_rows:
+        return
+    dialect = db.session.get_bind(mapper=Score).dialect.name
+    table = Score.__table__
+    if dialect == 'sqlite':
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(index_elements=['student_id', 'subject_id'],
+                                          set_={'score': stmt.excluded.score})
+    elif dialect == 'postgresql':
+        stmt = postgresql_insert(table)
+        stmt = stmt.on_conflict_do_update(constraint='_student_subject_uc',
+                                          set_={'score': stmt.excluded.score})
+    elif dialect in ('mysql', 'mariadb'):
+        stmt = mysql_insert(table)
+        stmt = stmt.on_duplicate_key_update(score=stmt.inserted.score)
+    else:
+        # 其他数据库：先批量查出已存在的成绩，再分别批量 UPDATE / INSERT
+        for row_chunk in chunked(score_rows):
+            student_ids = {row['student_id'] for row in row_chunk}
+            existing = {(student_id, subject_id): score_id
+                        for score_id, student_id, subject_id in
+                        db.session.query(Score.id, Score.student_id, Score.subject_id)
+                                  .filter(Score.student_id.in_(student_ids))}
+            updates, inserts = [], []
+            for row in row_chunk:
+                score_id = existing.get((row['student_id'], row['subject_id']))
+                if score_id:
+                    updates.append({'id': score_id, 'score': row['score']})
+                else:
+                    inserts.append(row)
+            if updates:
+                db.session.execute(update(Score), updates)
+            if inserts:
+                db.session.execute(insert(Score), inserts)
+        return
+    for row_chunk in chunked(score_rows):
+        db.session.execute(stmt, row_chunk)
+
+def diff_scores(existing, submitted):
+    """
+    比较一个学生的现有成绩 existing {subject_id: (score_id, score)} 与提交的成绩 submitted {subject_id: score 或 None}，
+    返回 (inserts, updates, deletes)：inserts {subject_id: score}、updates {score_id: score}、deletes {score_id}。
+    None 表示清空该科成绩；submitted 中没有的科目保持不变。
+    """
+    inserts, updates, deletes = {}, {}, set()
+    for subject_id, score in submitted.items():
+        current = existing.get(subject_id)
+        if current is None:
+            if score is not None:
+                inserts[subject_id] = score
+        elif score is None:
+            deletes.add(current[0])
+        elif score != current[1]:
+            updates[current[0]] = score
+    return inserts, updates, deletes
+
+def apply_score_diff(student_id, inserts, updates, deletes):
+    """用批量语句写入 diff_scores() 的结果（插入、按主键更新、删除各至多一条 executemany/语句）。调用方负责刷新总分和 commit"""
+    if inserts:
+        db.session.execute(insert(Score), [{'student_id': student_id, 'subject_id': subject_id, 'score': score}
+                                           for subject_id, score in inserts.items()])
+    if updates:
+        db.session.execute(update(Score), [{'id': score_id, 'score': score} for score_id, score in updates.items()])
+    for id_chunk in chunked(list(deletes)):
+        db.session.execute(delete(Score).where(Score.id.in_(id_chunk)),
+                           execution_options={'synchronize_session': False})
+
+SCORE_DIFF_SUMMARY_MAX = 8 # 提示中每类变更最多列出的科目数（flash 消息保存在会话 cookie 中，不宜过长）
+
+def describe_score_diff(existing, inserts, updates, deletes):
+    """把成绩变更概括为一句提示，如 "成绩变更：新增 语文；修改 数学 (80.0 → 90.0)；删除 英语。" """
+    names = {subject.id: subject.name for subject in get_subjects()}
+    subject_of = {score_id: subject_id for subject_id, (score_id, _) in existing.items()}
+    old_score = {score_id: score for score_id, score in existing.values()}
+    label = lambda subject_id: names.get(subject_id, str(subject_id))
+
+    def summarize(action, items):
+        shown = "、".join(items[:SCORE_DIFF_SUMMARY_MAX])
+        more = f" 等 {len(items)} 科" if len(items) > SCORE_DIFF_SUMMARY_MAX else ""
+        return f"{action} {shown}{more}"
+
+    parts = []
+    if inserts:
+        parts.append(summarize("新增", [label(subject_id) for subject_id in sorted(inserts)]))
+    if updates:
+        parts.append(summarize("修改", [f"{label(subject_of[score_id])} ({old_score[score_id]:.1f} → {updates[score_id]:.1f})"
+                                       for score_id in sorted(updates, key=subject_of.get)]))
+    if deletes:
+        parts.append(summarize("删除", [label(subject_of[score_id]) for score_id in sorted(deletes, key=subject_of.get)]))
+    return f"成绩变更：{'；'.join(parts)}。" if parts else "成绩无变化。"
+
+def subtract_subject_from_totals(subject_id):
+    """在删除科目（级联删除其成绩）之前，从相关学生的 total_score / score_count 中扣除该科目的成绩"""
+    removed_sq = select(Score.score)\
+        .where(Score.student_id == Student.id, Score.subject_id == subject_id)\
+        .scalar_subquery()
+    affected_ids = select(Score.student_id).where(Score.subject_id == subject_id)
+    db.session.execute(
+        update(Student)
+            .where(Student.id.in_(affected_ids))
+            .values(total_score=Student.total_score - removed_sq,
+                    score_count=Student.score_count - 1),
+        execution_options={'synchronize_session': False}
+    )
+
+# --- 名次 ---
+# 三种排名：全校总分、班内总分、单科成绩。均为竞赛排名（1224），名次 = 同组中分数更高的行数 + 1。
+# eligible 为参与排名的行的条件（没有成绩的学生不参与），查询时与 (分组, 分数) 索引配合使用
+RankingSpec = namedtuple('RankingSpec', ['model', 'rank_col', 'value_col', 'group_cols', 'eligible'])
+RANKINGS = {
+    'overall': RankingSpec(Student, Student.overall_rank, Student.total_score, [], [Student.score_count > 0]),
+    'class':   RankingSpec(Student, Student.class_rank, Student.total_score, [Student.class_name],
+                           [Student.score_count > 0]),
+    'subject': RankingSpec(Score, Score.subject_rank, Score.score, [Score.subject_id], []),
+}
+
+def capture_rank_state(student_ids):
+    """
+    读取这些学生当前参与排名的数据，返回 {排名名称: {行 ID: (分组值元组, 分数)}}；
+    没有成绩的学生不参与全校/班内排名。供 update_rankings() 比较变更前后。
+    """
+    state = {name: {} for name in RANKINGS}
+    for id_chunk in chunked(list(student_ids)):
+        rows = db.session.query(Student.id, Student.class_name, Student.total_score, Student.score_count)\
+                         .filter(Student.id.in_(id_chunk))
+        for sid, class_name, total_score, score_count in rows:
+            if score_count > 0:
+                state['overall'][sid] = ((), total_score)
+                state['class'][sid] = ((class_name,), total_score)
+        rows = db.session.query(Score.id, Score.subject_id, Score.score).filter(Score.student_id.in_(id_chunk))
+        for score_id, subject_id, score in rows:
+            state['subject'][score_id] = ((subject_id,), score)
+    return state
+
+def rank_state_of(student_id, class_name, total_score, score_count, scores):
+    """由内存中已知的数据构造一个学生的 capture_rank_state() 格式状态；scores 为 {score_id: (subject_id, score)}"""
+    state = {name: {} for name in RANKINGS}
+    if score_count > 0:
+        state['overall'][student_id] = ((), total_score)
+        state['class'][student_id] = ((class_name,), total_score)
+    for score_id, (subject_id, score) in scores.items():
+        state['subject'][score_id] = ((subject_id,), score)
+    return state
+
+def changed_rank_rows(before, after):
+    """比较变更前后的 capture_rank_state() 结果，返回 {排名名称: [分数、分组或参与状态有变化的行 ID]}"""
+    return {name: [row_id for row_id in before[name].keys() | after[name].keys()
+                   if before[name].get(row_id) != after[name].get(row_id)]
+            for name in RANKINGS}
+
+def changed_rank_groups(before, after):
+    """受变更影响的分组：{排名名称: {分组值元组}}（变更行在变更前后所在的组）"""
+    changed = changed_rank_rows(before, after)
+    return {name: {state[row_id][0] for row_id in changed[name] for state in (before[name], after[name])
+                   if row_id in state}
+            for name in RANKINGS}
+
+def _rank_shift_terms(spec, old, new, changed):
+    """
+    其他行的名次变化量 = 各变更行贡献之和：一行从分数 a 变为 b 只影响同组中分数介于两者之间的行（±1）；
+    换组、新增或删除相当于从原组移出（分数更低的行 -1）再放入新组（+1）。返回 [(条件, 变化量)]。
+    """
+    _, _, value_col, group_cols, _ = spec
+    in_group = lambda group: [col == value for col, value in zip(group_cols, group)]
+    terms = []
+    for row_id in changed:
+        before, after = old.get(row_id), new.get(row_id)
+        if before and after and before[0] == after[0]:
+            (group, old_value), new_value = before, after[1]
+            if new_value > old_value:
+                terms.append((and_(*in_group(group), value_col >= old_value, value_col < new_value), 1))
+            elif new_value < old_value:
+                terms.append((and_(*in_group(group), value_col >= new_value, value_col < old_value), -1))
+            continue
+        if before:
+            terms.append((and_(*in_group(before[0]), value_col < before[1]), -1))
+        if after:
+            terms.append((and_(*in_group(after[0]), value_col < after[1]), 1))
+    return terms
+
+def _apply_rank_changes(before, after):
+    """
+    少量学生变更时逐行增量维护全部三种排名（同一事务内，提交前）。每种排名的语句数固定，与变更的科目数无关：
+    其他行的名次用一条 UPDATE 按各变更行的贡献一次平移；变更行自身的名次由分数相邻的未变更行推出，
+    全部变更行的相邻行用一条 UNION ALL 查询取回，最后每种排名一条 executemany 写入。
+    """
+    changed = changed_rank_rows(before, after)
+    lookups, new_ranks = [], {}
+    for name, spec in RANKINGS.items():
+        rows = changed[name]
+        if not rows:
+            continue
+        model, rank_col, value_col, group_cols, eligible = spec
+        old, new = before[name], after[name]
+        others = [model.id.notin_(rows), *eligible]
+
+        terms = _rank_shift_terms(spec, old, new, rows)
+        if terms:
+            # 受影响的行用 UNION ALL 逐段走 (分组, 分数) 索引找出（直接写成 OR 条件时数据库会扫描全表），
+            # 包一层派生表是因为 MySQL 不允许在 UPDATE 的子查询中直接引用被更新的表
+            targets = union_all(*(select(model.id).where(condition) for condition, _ in terms)).subquery()
+            delta = sum((case((condition, amount), else_=0) for condition, amount in terms), literal(0))
+            db.session.execute(update(model)
+                               .where(*others, model.id.in_(select(targets.c.id)))
+                               .values({rank_col.key: rank_col + delta}),
+                               execution_options={'synchronize_session': False})
+        removed = [row_id for row_id in rows if row_id not in new]
+        if removed:
+            db.session.execute(update(model).where(model.id.in_(removed)).values({rank_col.key: None}),
+                               execution_options={'synchronize_session': False})
+
+        # 变更行 v 的相邻行：同组未变更行中分数 >= v 的最低一档 h，连同该档任一行的名次及该档行数
+        for row_id in rows:
+            if row_id not in new:
+                continue
+            group, value = new[row_id]
+            same_group = [*others, *(col == group_value for col, group_value in zip(group_cols, group))]
+            nearest = select(func.min(value_col)).where(*same_group, value_col >= value)\
+                                                 .correlate(None).scalar_subquery()
+            nearest_rank = select(rank_col).where(*same_group, value_col == nearest).limit(1).scalar_subquery()
+            nearest_count = select(func.count()).select_from(model)\
+                                                .where(*same_group, value_col == nearest).scalar_subquery()
+            lookups.append(select(literal(name), literal(row_id), nearest, nearest_rank, nearest_count))
+        new_ranks[name] = []
+    if not lookups:
+        return
+
+    # 名次 = 1 + 同组中分数更高的行数。同分的未变更行 (h = v) 名次即为所求（平移后已计入变更行）；
+    # 否则 = r_h + (h 档行数) + (变更行中分数在 (v, h] 的行数)；没有更高的未变更行时只数变更行
+    for name, row_id, nearest, nearest_rank, nearest_count in db.session.execute(union_all(*lookups)):
+        group, value = after[name][row_id]
+        changed_values = [after[name][other][1] for other in changed[name]
+                          if other in after[name] and after[name][other][0] == group]
+        if nearest is None:
+            rank = 1 + sum(1 for v in changed_values if v > value)
+        elif nearest == value:
+            rank = nearest_rank
+        else:
+            rank = nearest_rank + nearest_count + sum(1 for v in changed_values if value < v <= nearest)
+        new_ranks[name].append({'id': row_id, RANKINGS[name].rank_col.key: rank})
+    for name, params in new_ranks.items():
+        if params:
+            db.session.execute(update(RANKINGS[name].model), params)
+
+def rerank_groups(groups):
+    """
+    用窗口函数 RANK() 重算指定分组的名次，只写入名次有变化的行；groups 为 changed_rank_groups() 的结果。
+    全校排名只有一个分组，班级和科目排名只扫描受影响的班级/科目。调用方负责 commit。
+    """
+    for name, spec in RANKINGS.items():
+        model, rank_col, value_col, group_cols, eligible = spec
+        if not groups.get(name):
+            continue
+        group_values = sorted({group[0] for group in groups[name] if group})
+        scopes = [[group_cols[0].in_(value_chunk)] for value_chunk in chunked(group_values)] if group_cols else [[]]
+        for scope in scopes:
+            ranks = select(model.id, func.rank().over(partition_by=group_cols or None,
+                                                      order_by=value_col.desc()).label('rank'))\
+                .where(*eligible, *scope).subquery()
+            db.session.execute(update(model)
+                               .where(model.id == ranks.c.id, rank_col.is_distinct_from(ranks.c.rank))
+                               .values({rank_col.key: ranks.c.rank}),
+                               execution_options={'synchronize_session': False})
+
+def update_rankings(before, student_ids, after=None):
+    """
+    学生的成绩、总分或班级变更后（同一事务内，提交前）维护名次。
+    before 为变更前 capture_rank_state(student_ids) 的结果；student_ids 应包含新增和已删除的学生；
+    after 为变更后的状态（省略时重新读取）。涉及的学生不超过 RANK_INCREMENTAL_MAX 时逐行增量平移，
+    否则（导入、API 批量写入、成绩录入等批量操作）按受影响的分组用 RANK() 重算。调用方负责 commit。
+    """
+    if after is None:
+        after = capture_rank_state(student_ids)
+    if len(student_ids) <= current_app.config['RANK_INCREMENTAL_MAX']:
+        _apply_rank_changes(before, after)
+    else:
+        rerank_groups(changed_rank_groups(before, after))
+        # 退出排名的行（如成绩被清空并换班的学生）可能不在任何受影响的分组中，按 ID 清除名次
+        for name, (model, rank_col, *_) in RANKINGS.items():
+            left = [row_id for row_id in before[name] if row_id not in after[name]]
+            for id_chunk in chunked(left):
+                db.session.execute(update(model).where(model.id.in_(id_chunk)).values({rank_col.key: None}),
+                                   execution_options={'synchronize_session': False})
+
+def _expected_rankings():
+    """用窗口函数 RANK() 计算的正确名次：(学生名次子查询, 成绩名次子查询)"""
+    student_ranks = select(Student.id,
+                           func.rank().over(order_by=Student.total_score.desc()).label('overall_rank'),
+                           func.rank().over(partition_by=Student.class_name,
+                                            order_by=Student.total_score.desc()).label('class_rank'))\
+        .where(Student.score_count > 0).subquery()
+    score_ranks = select(Score.id,
+                         func.rank().over(partition_by=Score.subject_id,
+                                          order_by=Score.score.desc()).label('subject_rank'))\
+        .subquery()
+    return student_ranks, score_ranks
+
+def rebuild_rankings():
+    """重算全部名次，只写入名次有变化的行。调用方负责 commit。"""
+    student_ranks, score_ranks = _expected_rankings()
+    db.session.execute(update(Student)
+                       .where(Student.score_count == 0,
+                              or_(Student.overall_rank.isnot(None), Student.class_rank.isnot(None)))
+                       .values(overall_rank=None, class_rank=None),
+                       execution_options={'synchronize_session': False})
+    db.session.execute(update(Student)
+                       .where(Student.id == student_ranks.c.id,
+                              or_(Student.overall_rank.is_distinct_from(student_ranks.c.overall_rank),
+                                  Student.class_rank.is_distinct_from(student_ranks.c.class_rank)))
+                       .values(overall_rank=student_ranks.c.overall_rank, class_rank=student_ranks.c.class_rank),
+                       execution_options={'synchronize_session': False})
+    db.session.execute(update(Score)
+                       .where(Score.id == score_ranks.c.id,
+                              Score.subject_rank.is_distinct_from(score_ranks.c.subject_rank))
+                       .values(subject_rank=score_ranks.c.subject_rank),
+                       execution_options={'synchronize_session': False})
+
+def count_rank_mismatches():
+    """与正确名次不一致的行数：{'overall': n, 'class': n, 'subject': n}"""
+    student_ranks, score_ranks = _expected_rankings()
+    def mismatches(model, ranks, column):
+        return db.session.query(func.count(model.id))\
+                         .outerjoin(ranks, ranks.c.id == model.id)\
+                         .filter(getattr(model, column).is_distinct_from(ranks.c[column]))\
+                         .scalar()
+    return {'overall': mismatches(Student, student_ranks, 'overall_rank'),
+            'class': mismatches(Student, student_ranks, 'class_rank'),
+            'subject': mismatches(Score, score_ranks, 'subject_rank')}
 
 # ─── 路由 ────────────────────────────────────────────────────────────────────
-@app.route('/')
+@setup.route('/')
 @login_required
 def home():
     return redirect(url_for('student_list'))
 
-@app.route('/login', methods=['GET', 'POST'])
+def password_throttled_response(template, wait):
+    """密码校验被限流时：提示稍后再试，返回 429 和 Retry-After"""
+    seconds = math.ceil(wait)
+    flash(f"尝试次数过多，请 {seconds} 秒后再试。", "warning")
+    response = make_response(render_template(template), 429)
+    response.headers['Retry-After'] = str(seconds)
+    return response
+
+@setup.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('home'))
     if request.method == 'POST':
         u = request.form.get('username')
         p = request.form.get('password')
+        wait = throttle_password_check(u)
+        if wait:
+            return password_throttled_response('login.html', wait)
         user = User.query.filter_by(username=u).first()
-        if user and check_password_hash(user.password, p):
+        if user and verify_password(user, p):
+            reset_password_throttle(user.username)
             login_user(user)
             flash("登录成功！", "success")
             next_page = request.args.get('next')
@@ -191,14 +1744,14 @@ def login():
         flash("用户名或密码错误！", "danger")
     return render_template('login.html')
 
-@app.route('/logout')
+@setup.route('/logout')
 @login_required
 def logout():
     logout_user()
     flash("您已成功退出登录。", "info")
     return redirect(url_for('login'))
 
-@app.route('/change_password', methods=['GET', 'POST'])
+@setup.route('/change_password', methods=['GET', 'POST'])
 @login_required
 def change_password():
     if request.method == 'POST':
@@ -206,27 +1759,31 @@ def change_password():
         new_pw = request.form.get('new_password')
         confirm_pw = request.form.get('confirm_password')
 
-        if not check_password_hash(current_user.password, old_pw):
+        wait = throttle_password_check(current_user.username)
+        if wait:
+            return password_throttled_response('change_password.html', wait)
+        if not verify_password(current_user, old_pw):
             flash("旧密码不正确！", "danger")
         elif not new_pw:
              flash("新密码不能为空！", "danger")
         elif new_pw != confirm_pw:
             flash("两次输入的新密码不一致！", "danger")
         else:
-            current_user.password = generate_password_hash(new_pw)
+            current_user.password = hash_password(new_pw)
             db.session.commit()
+            invalidate_user(current_user.id)
             flash("密码修改成功！", "success")
             return redirect(url_for('student_list')) # 或重定向到个人资料页（如果将来有）
     return render_template('change_password.html')
 
 # --- 科目管理 ---
-@app.route('/subjects')
+@setup.route('/subjects')
 @login_required
 def subject_list():
-    subjects = Subject.query.order_by(Subject.id).all()
+    subjects = get_subjects()
     return render_template('subject_list.html', subjects=subjects)
 
-@app.route('/subject/add', methods=['POST'])
+@setup.route('/subject/add', methods=['POST'])
 @login_required
 def add_subject():
     name = request.form.get('name', '').strip()
@@ -239,14 +1796,15 @@ def add_subject():
             new_subject = Subject(name=name)
             db.session.add(new_subject)
             db.session.commit()
+            invalidate_subjects()
             flash(f"科目 '{name}' 添加成功！", "success")
         except Exception as e:
             db.session.rollback()
-            app.logger.error(f"Error adding subject: {e}", exc_info=True)
+            current_app.logger.error(f"Error adding subject: {e}", exc_info=True)
             flash(f"添加科目时出错，请查看日志。", "danger")
     return redirect(url_for('subject_list'))
 
-@app.route('/subject/edit/<int:subject_id>', methods=['POST'])
+@setup.route('/subject/edit/<int:subject_id>', methods=['POST'])
 @login_required
 def edit_subject(subject_id):
     subject = Subject.query.get_or_404(subject_id)
@@ -261,32 +1819,41 @@ def edit_subject(subject_id):
         try:
             subject.name = new_name
             db.session.commit()
+            invalidate_subjects()
             flash("科目名称更新成功！", "success")
         except Exception as e:
             db.session.rollback()
-            app.logger.error(f"Error editing subject {subject_id}: {e}", exc_info=True)
+            current_app.logger.error(f"Error editing subject {subject_id}: {e}", exc_info=True)
             flash(f"更新科目时出错，请查看日志。", "danger")
     return redirect(url_for('subject_list'))
 
 
-@app.route('/subject/delete/<int:subject_id>', methods=['POST'])
+@setup.route('/subject/delete/<int:subject_id>', methods=['POST'])
 @login_required
 def delete_subject(subject_id):
     subject = Subject.query.get_or_404(subject_id)
     try:
+        # 先从学生的冗余总分中扣除该科目成绩，再删除科目（同一事务）
+        subtract_subject_from_totals(subject.id)
         # Deleting subject cascades to Score thanks to relationship and FK constraint (if set correctly)
         db.session.delete(subject)
+        db.session.flush()
+        rebuild_rankings() # 大量学生的总分发生变化，直接重建名次
         db.session.commit()
+        invalidate_subjects()
         flash(f"科目 '{subject.name}' 及其所有相关成绩已删除！", "success")
     except Exception as e:
         db.session.rollback()
-        app.logger.error(f"Error deleting subject {subject_id}: {e}", exc_info=True)
+        current_app.logger.error(f"Error deleting subject {subject_id}: {e}", exc_info=True)
         flash(f"删除科目时出错：{e}", "danger") # Keep original simple message for user
     return redirect(url_for('subject_list'))
 
 # --- 学生管理 ---
-@app.route('/students')
+LIST_FRAGMENT_ARGS = {'sort_by_visual', 'sort_by_subject', 'sort_by_total', 'per_page'} # 可使用片段缓存的查询参数
+
+@setup.route('/students')
 @login_required
+@read_replica
 def student_list():
     search_name = request.args.get('search_name', '').strip()
     search_id = request.args.get('search_id', '').strip()
@@ -305,55 +1872,95 @@ def student_list():
         sort_by_subject_id = None # Ignore invalid input
 
     sort_by_total = sort_by_total_str == 'true'
+    class_name = request.args.get('class_name', '').strip()
+    top = request.args.get('top', type=int)
+    if top is not None and top < 1:
+        top = None
 
-    query = Student.query
+    # 数据未变化时直接返回 304，不再查询和渲染
+    etag, last_modified = conditional_validators('student_list', request.full_path)
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
 
-    if search_name:
-        query = query.filter(Student.name.like(f"%{search_name}%"))
+    student_id = None
     if search_id:
         try:
-            query = query.filter(Student.id == int(search_id))
+            student_id = int(search_id)
         except ValueError:
             flash("请输入有效的学生ID（数字）进行搜索！", "warning")
             search_id = '' # Clear invalid input for display
 
-    # Apply sorting
-    students = [] # Initialize as empty list
-    if sort_by_subject_id:
-        query = query.outerjoin(Score, (Student.id == Score.student_id) & (Score.subject_id == sort_by_subject_id))\
-                     .order_by(func.coalesce(Score.score, 0).desc(), Student.id) # Sort by score descending, then ID
-        students = query.all()
-    elif sort_by_total:
-        # Fetch all students matching search criteria first
-        students_list = query.order_by(Student.id).all() # Fetch with a default order first
-        # Sort in Python using the pre-defined method
-        try:
-            students_list.sort(key=lambda s: s.get_total_score(), reverse=True)
-            students = students_list
-        except Exception as e:
-             app.logger.error(f"Error sorting students by total score: {e}", exc_info=True)
-             flash("按总分排序时发生错误。", "danger")
-             students = query.order_by(Student.id).all() # Fallback to ID sort
-    else:
-        # Default sort by ID
-        query = query.order_by(Student.id)
-        students = query.all()
-
-
-    subjects = Subject.query.order_by(Subject.id).all() # 获取所有科目用于表头和排序选项
-
-    return render_template('student_list.html',
-                           students=students,
-                           subjects=subjects,
-                           search_name=search_name,
-                           search_id=search_id,
-                           sort_by=sort_by_visual) # Pass the visual sort parameter for the dropdown selection
-
-
-@app.route('/student/add', methods=['GET', 'POST'])
+    # --- 分页参数 ---
+    per_page = request.args.get('per_page', current_app.config['STUDENTS_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, current_app.config['STUDENTS_PER_PAGE_MAX']))
+    subjects = get_subjects() # 获取所有科目用于表头和排序选项
+
+    # 未筛选列表的第一页（只有排序参数、默认每页条数）最常用，渲染好的表格按数据版本缓存，数据修改后自动失效；
+    # 翻页、筛选和自定义每页条数的请求不缓存，条目数因此只与排序方式有关。
+    # 搜索表单提交时会带上空的筛选字段（search_name=&class_name=...），空值参数视为未提供
+    fragment_key = None
+    fragment_args = sorted((key, value) for key, value in request.args.items(multi=True) if value)
+    if current_app.config['LIST_FRAGMENT_CACHE'] and {key for key, _ in fragment_args} <= LIST_FRAGMENT_ARGS \
+            and per_page == current_app.config['STUDENTS_PER_PAGE']:
+        data_version = get_data_version()[0]
+        fragment_key = 'student_list:' + urlencode(fragment_args)
+        student_table = fragment_cache.get_fragment(data_version, fragment_key)
+        if student_table is not None:
+            return _render_student_list(student_table, etag, last_modified, subjects=subjects,
+                                        per_page=per_page, search_name=search_name, search_id=search_id,
+                                        class_name=class_name, top=top, sort_by=sort_by_visual)
+
+    query, sort_expr, descending = build_student_query(search_name, student_id,
+                                                       sort_by_subject_id, sort_by_total,
+                                                       class_name=class_name, top=top)
+
+    page = max(1, request.args.get('page', 1, type=int))
+    after = decode_cursor(request.args.get('after', ''))
+    before = decode_cursor(request.args.get('before', ''))
+
+    rows, has_prev, has_next = paginate_students(query, sort_expr, descending, per_page,
+                                                 after=after, before=before, page=page)
+    students = [student for student, _ in rows]
+
+    # 上一页/下一页统一使用 keyset 游标，保留当前的搜索与排序参数
+    link_args = {k: v for k, v in request.args.items() if k not in ('after', 'before', 'page')}
+    prev_url = next_url = None
+    if rows and has_prev:
+        first_student, first_value = rows[0]
+        prev_url = url_for('student_list', before=encode_cursor([first_value, first_student.id]), **link_args)
+    if rows and has_next:
+        last_student, last_value = rows[-1]
+        next_url = url_for('student_list', after=encode_cursor([last_value, last_student.id]), **link_args)
+
+    # 一次性取出当前页所有学生的成绩矩阵，模板中不再逐格查询
+    score_matrix = build_score_matrix([s.id for s in students])
+
+    student_table = render_template('_student_table.html',
+                                    students=students,
+                                    subjects=subjects,
+                                    score_matrix=score_matrix,
+                                    prev_url=prev_url,
+                                    next_url=next_url,
+                                    filtered=bool(search_name or search_id or class_name or top))
+    if fragment_key is not None:
+        fragment_cache.set_fragment(data_version, fragment_key, student_table)
+
+    return _render_student_list(student_table, etag, last_modified, subjects=subjects,
+                                per_page=per_page, search_name=search_name, search_id=search_id,
+                                class_name=class_name, top=top,
+                                sort_by=sort_by_visual) # Pass the visual sort parameter for the dropdown selection
+
+def _render_student_list(student_table, etag, last_modified, **context):
+    """把（可能来自缓存的）表格片段套入完整页面；有 flash 消息的页面不附加缓存校验头"""
+    cacheable = not has_pending_flashes() # 渲染 base.html 时会取走 flash 消息，需在此之前判断
+    response = make_response(render_template('student_list.html', student_table=Markup(student_table), **context))
+    return set_validators(response, etag, last_modified) if cacheable else response
+
+
+@setup.route('/student/add', methods=['GET', 'POST'])
 @login_required
 def add_student():
-    subjects = Subject.query.order_by(Subject.id).all()
+    subjects = get_subjects()
     if request.method == 'POST':
         name = request.form.get('name', '').strip()
         class_name = request.form.get('class_name', '').strip()
@@ -402,6 +2009,10 @@ def add_student():
 
             if scores_data:
                 db.session.add_all(scores_data)
+            new_student.total_score = sum(score.score for score in scores_data)
+            new_student.score_count = len(scores_data)
+            refresh_name_tokens([new_student.id])
+            update_rankings(capture_rank_state([]), [new_student.id])
 
             db.session.commit()
             flash("学生添加成功！", "success")
@@ -409,7 +2020,7 @@ def add_student():
 
         except Exception as e:
             db.session.rollback()
-            app.logger.error(f"Error adding student or scores: {e}", exc_info=True)
+            current_app.logger.error(f"Error adding student or scores: {e}", exc_info=True)
             flash(f"添加学生或成绩时发生数据库错误，请检查日志。", "danger")
             return render_template('edit_student.html', student_data=temp_student_data, student=None, subjects=subjects)
 
@@ -417,11 +2028,11 @@ def add_student():
     return render_template('edit_student.html', student=None, subjects=subjects)
 
 
-@app.route('/student/edit/<int:student_id>', methods=['GET', 'POST'])
+@setup.route('/student/edit/<int:student_id>', methods=['GET', 'POST'])
 @login_required
 def edit_student(student_id):
     student = Student.query.get_or_404(student_id)
-    subjects = Subject.query.order_by(Subject.id).all()
+    subjects = get_subjects()
 
     if request.method == 'POST':
         new_name = request.form.get('name', '').strip()
@@ -437,44 +2048,31 @@ def edit_student(student_id):
             # Pass `student` for ID context, `temp_student_data` for values
             return render_template('edit_student.html', student=student, student_data=temp_student_data, subjects=subjects)
 
+        old_class_name, old_total, old_count = student.class_name, student.total_score, student.score_count
+        name_changed = student.name != new_name
         student.name = new_name
         student.class_name = new_class_name
 
         try:
             validation_error = False # Flag for score validation errors
-            scores_to_add = []    # New Score objects
-            scores_to_delete = [] # Existing Score objects to remove
+            submitted = {} # {subject_id: 分数 或 None(清空)}；格式有误的科目不出现，保持原值
 
             for subject in subjects:
                 score_str = request.form.get(f'score_{subject.id}')
-                # Find existing score using query for clarity, avoid potential lazy-loading issues in loop
-                existing_score_obj = Score.query.filter_by(student_id=student.id, subject_id=subject.id).first()
-
                 if score_str and score_str.strip(): # Score value provided
                     try:
                         score_val = float(score_str.strip())
-                        if score_val < 0:
-                            flash(f"科目 '{subject.name}' 的分数不能为负数！该科目未更新。", "warning")
-                            validation_error = True
-                            continue # Skip this subject
-
-                        if existing_score_obj:
-                            if existing_score_obj.score != score_val: # Update only if changed
-                                existing_score_obj.score = score_val
-                                # Mark as modified (SQLAlchemy usually handles this, but explicit doesn't hurt)
-                                db.session.add(existing_score_obj)
-                        else:
-                            # Create new Score object if it didn't exist
-                            scores_to_add.append(Score(student_id=student.id, subject_id=subject.id, score=score_val))
-
                     except ValueError:
                         flash(f"科目 '{subject.name}' 的分数格式无效 ('{score_str}')！请输入数字。该科目未更新。", "danger")
                         validation_error = True
                         continue # Skip this subject
-
-                elif existing_score_obj and (not score_str or not score_str.strip()):
-                    # Score existed but input is now empty, mark for deletion
-                    scores_to_delete.append(existing_score_obj)
+                    if score_val < 0:
+                        flash(f"科目 '{subject.name}' 的分数不能为负数！该科目未更新。", "warning")
+                        validation_error = True
+                        continue # Skip this subject
+                    submitted[subject.id] = score_val
+                else:
+                    submitted[subject.id] = None
 
             # If strict validation (all or nothing) is needed, uncomment below
             # if validation_error:
@@ -482,28 +2080,52 @@ def edit_student(student_id):
             #     flash("部分成绩格式有误，未保存任何更改。请修正后重新提交。", "danger")
             #     return render_template('edit_student.html', student=student, student_data=temp_student_data, subjects=subjects)
 
+            # 一条查询取出该学生的全部成绩，在内存中比较后用批量语句写入差异
+            existing = {subject_id: (score_id, score) for score_id, subject_id, score in
+                        db.session.query(Score.id, Score.subject_id, Score.score)
+                                  .filter(Score.student_id == student.id)}
+            inserts, updates, deletes = diff_scores(existing, submitted)
+            apply_score_diff(student.id, inserts, updates, deletes)
+
+            # 冗余总分直接由比较结果得出，与姓名/班级的修改一起写入
+            final_scores = dict(inserts)
+            for subject_id, (score_id, score) in existing.items():
+                if score_id not in deletes:
+                    final_scores[subject_id] = updates.get(score_id, score)
+            student.total_score = sum(final_scores.values())
+            student.score_count = len(final_scores)
+            db.session.flush()
 
-            # Add new scores
-            if scores_to_add:
-                db.session.add_all(scores_to_add)
-            # Delete scores marked for deletion
-            if scores_to_delete:
-                for score_obj in scores_to_delete:
-                    db.session.delete(score_obj)
+            # 名次：变更前后的状态都由比较结果在内存中构造（只有新增成绩的 ID 需要查询），
+            # 未修改的科目前后相同，不会产生任何名次语句
+            scores_before = {score_id: (subject_id, score) for subject_id, (score_id, score) in existing.items()}
+            scores_after = {score_id: (subject_id, updates.get(score_id, score))
+                            for score_id, (subject_id, score) in scores_before.items() if score_id not in deletes}
+            if inserts:
+                scores_after.update((score_id, (subject_id, inserts[subject_id])) for score_id, subject_id in
+                                    db.session.query(Score.id, Score.subject_id)
+                                              .filter(Score.student_id == student.id, Score.subject_id.in_(list(inserts))))
+            update_rankings(rank_state_of(student.id, old_class_name, old_total, old_count, scores_before),
+                            [student.id],
+                            after=rank_state_of(student.id, student.class_name, student.total_score,
+                                                student.score_count, scores_after))
+            if name_changed:
+                refresh_name_tokens([student.id])
 
             # Commit all changes (updates to student, updates to existing scores, additions, deletions)
             db.session.commit()
 
+            summary = describe_score_diff(existing, inserts, updates, deletes)
             if not validation_error:
-                 flash("学生信息更新成功！", "success")
+                 flash(f"学生信息更新成功！{summary}", "success")
             else:
-                 flash("学生信息已部分更新，但部分成绩因格式或数值问题未被保存，请检查。", "warning")
+                 flash(f"学生信息已部分更新，但部分成绩因格式或数值问题未被保存，请检查。{summary}", "warning")
 
             return redirect(url_for('student_list'))
 
         except Exception as e:
             db.session.rollback()
-            app.logger.error(f"Error editing student {student_id}: {e}", exc_info=True)
+            current_app.logger.error(f"Error editing student {student_id}: {e}", exc_info=True)
             flash(f"更新学生信息时发生数据库错误：{e}", "danger")
             # Re-render with submitted data
             return render_template('edit_student.html', student=student, student_data=temp_student_data, subjects=subjects)
@@ -515,65 +2137,884 @@ def edit_student(student_id):
     return render_template('edit_student.html', student=student, subjects=subjects, current_scores=existing_scores)
 
 
-@app.route('/student/delete/<int:student_id>', methods=['POST'])
+@setup.route('/student/delete/<int:student_id>', methods=['POST'])
 @login_required
 def delete_student(student_id):
     student = Student.query.get_or_404(student_id)
     try:
+        rank_before = capture_rank_state([student_id])
         # Deleting the student should cascade via relationship/FK if set up correctly
         db.session.delete(student)
+        db.session.flush()
+        update_rankings(rank_before, [student_id]) # 排在其后的学生名次前移
         db.session.commit()
         flash(f"学生 '{student.name}' (ID: {student_id}) 已成功删除！", "success")
     except Exception as e:
         db.session.rollback()
-        app.logger.error(f"Error deleting student {student_id}: {e}", exc_info=True)
+        current_app.logger.error(f"Error deleting student {student_id}: {e}", exc_info=True)
         flash(f"删除学生时出错：{e}", "danger")
     return redirect(url_for('student_list'))
 
 
-@app.route('/export')
+# 导出格式 -> (文件扩展名, MIME 类型, 所需的可选库)。
+# csv 按学生 ID 分批流式输出；其他格式按列载入整张表后由对应的库一次写出。
+EXPORT_FORMATS = {
+    'csv':     ('csv', 'text/csv; charset=utf-8-sig', None),
+    'xlsx':    ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'openpyxl'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet', 'pyarrow'),
+    'arrow':   ('arrow', 'application/vnd.apache.arrow.file', 'pyarrow'),
+}
+
+def export_format_available(fmt):
+    library = EXPORT_FORMATS[fmt][2]
+    return library is None or {'openpyxl': openpyxl, 'pyarrow': pyarrow}[library] is not None
+
+def load_export_columns(subjects):
+    """
+    按列载入导出数据，返回 (表头, 列列表)。学生一条查询、成绩一条查询，成绩按学生所在行透视为每科一列
+    (没有成绩为 None)；总分直接取冗余存储的 total_score。两条查询之间新增的学生的成绩会被忽略。
+    """
+    students = db.session.query(Student.id, Student.name, Student.class_name, Student.total_score)\
+                         .order_by(Student.id)\
+                         .all()
+    ids, names, class_names, totals = (list(column) for column in zip(*students)) if students else ([], [], [], [])
+    row_of = {student_id: row for row, student_id in enumerate(ids)}
+    score_columns = {subject.id: [None] * len(ids) for subject in subjects}
+    for student_id, subject_id, score in db.session.query(Score.student_id, Score.subject_id, Score.score):
+        column, row = score_columns.get(subject_id), row_of.get(student_id)
+        if column is not None and row is not None:
+            column[row] = score
+    header = ['ID', '姓名', '班级'] + [subject.name for subject in subjects] + ['总分']
+    columns = [ids, names, class_names] + [score_columns[subject.id] for subject in subjects] + [totals]
+    return header, columns
+
+def write_export_file(fmt, header, columns):
+    """把按列载入的数据写成 xlsx / parquet / arrow 文件，返回文件内容 (bytes)"""
+    buffer = BytesIO()
+    if fmt == 'xlsx':
+        workbook = openpyxl.Workbook(write_only=True) # 只写模式逐行写入，不在内存中保留单元格对象
+        sheet = workbook.create_sheet('学生成绩')
+        sheet.append(header)
+        for row in zip(*columns):
+            sheet.append(row)
+        workbook.save(buffer)
+        return buffer.getvalue()
+    # 分数列为可空的 float64，ID 为 int64，姓名、班级为字符串
+    types = [pyarrow.int64(), pyarrow.string(), pyarrow.string()] + [pyarrow.float64()] * (len(columns) - 3)
+    table = pyarrow.Table.from_arrays([pyarrow.array(column, type=type_) for column, type_ in zip(columns, types)],
+                                     names=header)
+    if fmt == 'parquet':
+        pyarrow.parquet.write_table(table, buffer, compression='zstd')
+    else:
+        with pyarrow.ipc.new_file(buffer, table.schema) as writer: # Arrow IPC 文件 (Feather v2)
+            writer.write_table(table)
+    return buffer.getvalue()
+
+@setup.route('/export')
 @login_required
+@read_replica
 def export_students():
-    students = Student.query.order_by(Student.id).all()
-    subjects = Subject.query.order_by(Subject.id).all()
-
-    si = StringIO()
-    # Use utf-8-sig for BOM
-    # si.write(u'\ufeff') # Not needed if encoding handled by Response object correctly
-
-    writer = csv.writer(si)
-
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        flash(f"不支持的导出格式：{fmt}", "danger")
+        return redirect(url_for('student_list'))
+    if not export_format_available(fmt):
+        flash(f"导出 {fmt} 格式需要安装 {EXPORT_FORMATS[fmt][2]}。", "warning")
+        return redirect(url_for('student_list'))
+    extension, mimetype, _ = EXPORT_FORMATS[fmt]
+
+    # 导出内容只取决于数据版本和格式：未变化时返回 304
+    etag, last_modified = conditional_validators('export', fmt)
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
+    subjects = get_subjects()
+    if fmt != 'csv':
+        header, columns = load_export_columns(subjects)
+        response = Response(write_export_file(fmt, header, columns), mimetype=mimetype,
+                            headers={"Content-Disposition": f"attachment;filename=students_export.{extension}"})
+        return set_validators(response, etag, last_modified)
+
+    subject_ids = [subject.id for subject in subjects]
     # Dynamic header generation
     header = ['ID', '姓名', '班级'] + [subject.name for subject in subjects] + ['总分']
-    writer.writerow(header)
-
-    # Write data rows
-    for student in students:
-        # Pre-fetch scores into a dictionary for efficient lookup {subject_id: score}
-        scores_dict = {score.subject_id: score.score for score in student.scores.all()} # Use .all() with lazy='dynamic'
-        row = [student.id, student.name, student.class_name]
-        total_score = 0
-        for subject in subjects:
-            score = scores_dict.get(subject.id) # Get score or None
-            row.append(f"{score:.1f}" if isinstance(score, (int, float)) else '') # Format or empty string
-            if isinstance(score, (int, float)):
-                total_score += score
-        row.append(f"{total_score:.1f}") # Add formatted total score
-        writer.writerow(row)
-
-    output = si.getvalue()
-
-    return Response(
-        output, # Keep raw string
+    chunk_size = current_app.config['EXPORT_CHUNK_SIZE']
+
+    def generate():
+        """按学生 ID 窗口分批读取并逐批输出 CSV，内存占用与学生总数无关"""
+        si = StringIO()
+        # Use utf-8-sig for BOM
+        # si.write(u'\ufeff') # Not needed if encoding handled by Response object correctly
+        writer = csv.writer(si)
+        writer.writerow(header)
+
+        last_id = 0
+        while True:
+            # 只取需要的列（不构造 ORM 对象），按 ID 做 keyset 窗口
+            students = db.session.query(Student.id, Student.name, Student.class_name, Student.total_score)\
+                                 .filter(Student.id > last_id)\
+                                 .order_by(Student.id)\
+                                 .limit(chunk_size)\
+                                 .all()
+            if not students:
+                break
+            window_end = students[-1].id
+
+            # 整个窗口的成绩一次查出：{student_id: {subject_id: score}}
+            scores_by_student = {}
+            score_rows = db.session.query(Score.student_id, Score.subject_id, Score.score)\
+                                   .filter(Score.student_id > last_id, Score.student_id <= window_end)\
+                                   .all()
+            for student_id, subject_id, score in score_rows:
+                scores_by_student.setdefault(student_id, {})[subject_id] = score
+
+            # Write data rows
+            for student_id, name, class_name, total_score in students:
+                scores_dict = scores_by_student.get(student_id, {})
+                row = [student_id, name, class_name]
+                for subject_id in subject_ids:
+                    score = scores_dict.get(subject_id) # Get score or None
+                    row.append(f"{score:.1f}" if isinstance(score, (int, float)) else '') # Format or empty string
+                row.append(f"{total_score:.1f}") # 冗余存储的总分
+                writer.writerow(row)
+
+            yield si.getvalue()
+            si.seek(0)
+            si.truncate(0)
+            last_id = window_end
+
+        remaining = si.getvalue() # 没有任何学生时只输出表头
+        if remaining:
+            yield remaining
+
+    response = Response(
+        stream_with_context(generate()), # 流式输出，边查询边发送
         mimetype="text/csv",
         headers={
             "Content-Disposition": "attachment;filename=students_export.csv",
             "Content-Type": "text/csv; charset=utf-8-sig" # Specify encoding with BOM here
             }
     )
+    return set_validators(response, etag, last_modified)
+
+
+# --- 成绩录入 ---
+# 按 班级 + 科目 以表格形式一次录入整班成绩：页面只提交修改过的单元格，
+# 服务端一次查询取出现有成绩，比较后以一次批量 upsert 写入，再统一刷新总分和名次。
+GRADE_ERRORS_SHOWN = 10 # 校验失败时提示中最多列出的单元格数
+
+def get_class_names():
+    """全部班级名（排序后），用于班级下拉框"""
+    return [name for (name,) in db.session.query(Student.class_name).distinct().order_by(Student.class_name)]
+
+def load_grade_grid(class_name, subject_id):
+    """班级全部学生及其该科成绩：[(student_id, name, score_id, score)]，没有成绩时后两项为 None"""
+    return db.session.query(Student.id, Student.name, Score.id, Score.score)\
+                     .outerjoin(Score, and_(Score.student_id == Student.id, Score.subject_id == subject_id))\
+                     .filter(Student.class_name == class_name)\
+                     .order_by(Student.id)\
+                     .all()
+
+def save_grade_grid(subject_id, existing, submitted):
+    """
+    写入一个科目的成绩修改。existing 为 {student_id: (score_id, score)}，submitted 为 {student_id: score 或 None}。
+    新增和修改合并为一次 upsert_scores()，清空的成绩一条 DELETE，然后刷新涉及学生的总分和名次。
+    返回 (新增数, 修改数, 删除数)。调用方负责 commit。
+    """
+    inserts, updates, deletes = diff_scores(existing, submitted)
+    student_of = {score_id: student_id for student_id, (score_id, _) in existing.items()}
+    changed_ids = sorted({*inserts, *(student_of[score_id] for score_id in [*updates, *deletes])})
+    if not changed_ids:
+        return 0, 0, 0
+    rank_before = capture_rank_state(changed_ids)
+    upsert_scores([{'student_id': student_id, 'subject_id': subject_id, 'score': score}
+                   for student_id, score in [*inserts.items(),
+                                             *((student_of[score_id], score) for score_id, score in updates.items())]])
+    for id_chunk in chunked(list(deletes)):
+        db.session.execute(delete(Score).where(Score.id.in_(id_chunk)),
+                           execution_options={'synchronize_session': False})
+    refresh_student_totals(changed_ids)
+    update_rankings(rank_before, changed_ids)
+    return len(inserts), len(updates), len(deletes)
+
+@setup.route('/grades', methods=['GET', 'POST'])
+@login_required
+def grade_entry():
+    subjects = get_subjects()
+    class_name = request.values.get('class_name', '').strip()
+    subject_id = request.values.get('subject_id', type=int)
+    subject = next((s for s in subjects if s.id == subject_id), None)
+    context = {'subjects': subjects, 'class_names': get_class_names(), 'class_name': class_name,
+               'subject': subject, 'rows': None, 'submitted': {}, 'invalid': set()}
+    if not class_name or subject is None:
+        if request.method == 'POST':
+            flash("请选择班级和科目！", "warning")
+        return render_template('grades.html', **context)
+
+    rows = load_grade_grid(class_name, subject.id)
+    context['rows'] = rows
+    if request.method == 'GET':
+        return render_template('grades.html', **context)
+
+    # 只处理提交了且与页面加载时的原值不同的单元格，未修改的单元格不会覆盖他人在此期间的修改
+    existing = {student_id: (score_id, score) for student_id, _, score_id, score in rows if score_id is not None}
+    submitted, errors = {}, []
+    for student_id, name, _, _ in rows:
+        value = request.form.get(f'score_{student_id}')
+        if value is None:
+            continue
+        value = value.strip()
+        context['submitted'][student_id] = value
+        if value == request.form.get(f'orig_{student_id}', '').strip():
+            continue
+        if not value:
+            submitted[student_id] = None
+            continue
+        try:
+            score = float(value)
+            if score < 0:
+                raise ValueError
+        except ValueError:
+            errors.append(f"{name} ('{value}')")
+            context['invalid'].add(student_id)
+            continue
+        submitted[student_id] = score
+
+    if errors:
+        more = f" 等 {len(errors)} 处" if len(errors) > GRADE_ERRORS_SHOWN else ""
+        flash(f"以下成绩无效 (需为非负数字)，未保存任何更改：{'、'.join(errors[:GRADE_ERRORS_SHOWN])}{more}", "danger")
+        return render_template('grades.html', **context)
+
+    try:
+        added, changed, removed = save_grade_grid(subject.id, existing, submitted)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error saving grades for {class_name}/{subject.name}: {e}", exc_info=True)
+        flash(f"保存成绩时发生数据库错误：{e}", "danger")
+        return render_template('grades.html', **context)
+
+    if added or changed or removed:
+        flash(f"已保存 {class_name} {subject.name} 成绩：新增 {added} 条，修改 {changed} 条，清空 {removed} 条。", "success")
+    else:
+        flash("成绩无变化。", "info")
+    return redirect(url_for('grade_entry', class_name=class_name, subject_id=subject.id))
+
+
+# --- 统计分析 ---
+# 统计全部在数据库中分组聚合完成，不加载 ORM 对象：
+#   * 每个数据集先取 min/max 确定直方图分段，再用一条 GROUP BY (分组键, 分段) 查询取回计数、和、平方和与最值，
+#     在 Python 中汇总出每组的均值、标准差和直方图；各科统计由“班级 × 科目”的结果汇总，不再单独扫描成绩表；
+#   * 百分位数在 PostgreSQL 上用 percentile_cont，其他数据库沿 (分组键, 值) 索引用 ORDER BY ... LIMIT/OFFSET 定位名次。
+STATS_SEEKS_PER_QUERY = 100 # 每条 UNION ALL 查询合并的百分位定位子查询数（SQLite 复合查询上限为 500）
+
+def _histogram_edges(low, high, bin_width, max_bins):
+    """从 low 向下取整到分段宽度开始，覆盖到 high；最后一段为闭区间"""
+    bin_width = max(bin_width, math.ceil((high - low) / max_bins) or 1)
+    start = math.floor(low / bin_width) * bin_width
+    bins = max(1, math.ceil((high - start) / bin_width))
+    return [start + i * bin_width for i in range(bins + 1)]
+
+def _bucket_expr(value, start, width):
+    """value 所在直方图分段的序号（value >= start）"""
+    offset = (value - start) / width
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return cast(offset, db.Integer) # SQLite 没有 FLOOR，非负数 CAST 即向下取整
+    return func.floor(offset)
+
+def _new_accumulator(bins):
+    return {'count': 0, 'total': 0.0, 'total_sq': 0.0, 'min': None, 'max': None, 'counts': [0] * bins}
+
+def _merge_accumulator(acc, count, total, total_sq, low, high):
+    acc['count'] += count
+    acc['total'] += float(total)
+    acc['total_sq'] += float(total_sq)
+    acc['min'] = low if acc['min'] is None else min(acc['min'], low)
+    acc['max'] = high if acc['max'] is None else max(acc['max'], high)
+
+def _accumulate_stats(value, keys, from_obj, conditions, bin_width):
+    """
+    按 keys 分组累加 value，返回 ({分组键元组: 累加器}, 直方图分段 edges)。
+    累加器保存计数、和、平方和与最值（可继续向上汇总），由 _finalize_stats 转换为输出格式。
+    """
+    low, high = db.session.execute(select(func.min(value), func.max(value))
+                                   .select_from(from_obj).where(*conditions)).one()
+    if low is None:
+        return {}, []
+    edges = _histogram_edges(low, high, bin_width, current_app.config['STATS_HISTOGRAM_MAX_BINS'])
+    bins = len(edges) - 1
+
+    n_keys = len(keys)
+    inner = select(*[k.label(f'k{i}') for i, k in enumerate(keys)],
+                   value.label('v'),
+                   _bucket_expr(value, edges[0], edges[1] - edges[0]).label('bucket'))\
+        .select_from(from_obj).where(*conditions).subquery()
+    group_cols = [inner.c[f'k{i}'] for i in range(n_keys)] + [inner.c.bucket]
+    stmt = select(*group_cols, func.count(), func.sum(inner.c.v), func.sum(inner.c.v * inner.c.v),
+                  func.min(inner.c.v), func.max(inner.c.v))\
+        .group_by(*group_cols)
+
+    groups = {}
+    for row in db.session.execute(stmt):
+        count, total, total_sq, group_low, group_high = row[n_keys + 1:]
+        acc = groups.setdefault(tuple(row[:n_keys]), _new_accumulator(bins))
+        _merge_accumulator(acc, count, total, total_sq, group_low, group_high)
+        acc['counts'][min(int(row.bucket), bins - 1)] += count # 等于上界的值归入最后一段
+    return dict(sorted(groups.items())), edges
+
+def _rollup_stats(groups, key_index):
+    """把多列分组的累加器按其中一列汇总"""
+    result = {}
+    for key, acc in groups.items():
+        target = result.setdefault((key[key_index],), _new_accumulator(len(acc['counts'])))
+        _merge_accumulator(target, acc['count'], acc['total'], acc['total_sq'], acc['min'], acc['max'])
+        target['counts'] = [a + b for a, b in zip(target['counts'], acc['counts'])]
+    return dict(sorted(result.items()))
+
+def _finalize_stats(acc, edges=None):
+    """累加器 -> count / mean / min / max / std（总体标准差），可附带直方图"""
+    mean = acc['total'] / acc['count']
+    variance = max(acc['total_sq'] / acc['count'] - mean * mean, 0.0) # 浮点误差可能使其略小于 0
+    item = {'count': acc['count'], 'mean': round(mean, 2), 'min': acc['min'], 'max': acc['max'],
+            'std': round(math.sqrt(variance), 2)}
+    if edges:
+        item['histogram'] = {'edges': edges, 'counts': acc['counts']}
+    return item
+
+def _percentile_positions(n, p):
+    """线性插值（与 percentile_cont 一致）下第 p 分位所需的两个名次（从 1 开始）和插值权重"""
+    h = (n - 1) * p
+    lo = int(h)
+    return lo + 1, min(lo + 2, n), h - lo
+
+def grouped_percentiles(value, keys, from_obj, conditions, counts, percentiles):
+    """
+    各组 value 的百分位数，返回 {分组键元组: {'p25': ..., ...}}。
+    counts 为 {分组键元组: 组内条数}（取自聚合结果），用于计算所需名次。
+    """
+    labels = [f'p{round(p * 100)}' for p in percentiles]
+    n_keys = len(keys)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        stmt = select(*keys, *[func.percentile_cont(p).within_group(value) for p in percentiles])\
+            .select_from(from_obj).where(*conditions).group_by(*keys)
+        return {tuple(row[:n_keys]): {label: round(float(v), 2) for label, v in zip(labels, row[n_keys:])}
+                for row in db.session.execute(stmt)}
+
+    # 每组每个百分位只需相邻的 1~2 个值：走索引有序扫描并 OFFSET 到该名次，多个定位合并为 UNION ALL
+    seeks = []   # (分组键, 百分位标签, 插值权重)
+    parts = []
+    for key, n in counts.items():
+        group_filter = [k == v for k, v in zip(keys, key)]
+        for label, p in zip(labels, percentiles):
+            lo, hi, frac = _percentile_positions(n, p)
+            sub = select(value.label('v')).select_from(from_obj).where(*conditions, *group_filter)\
+                .order_by(value).limit(hi - lo + 1).offset(lo - 1).subquery()
+            parts.append(select(literal(len(seeks)).label('seek'), sub.c.v))
+            seeks.append((key, label, frac))
+    picked = {}
+    for chunk in chunked(parts, STATS_SEEKS_PER_QUERY):
+        for row in db.session.execute(union_all(*chunk)):
+            picked.setdefault(row.seek, []).append(row.v)
+
+    # counts 与定位查询不在同一快照中：期间有删除时名次可能越界，该百分位留空（页面显示 "-"），不报错
+    result = {key: {} for key in counts}
+    for i, (key, label, frac) in enumerate(seeks):
+        values = picked.get(i)
+        if not values:
+            continue
+        v_lo, v_hi = min(values), max(values)
+        result[key][label] = round(v_lo + (v_hi - v_lo) * frac, 2)
+    return result
+
+def compute_statistics(bin_width=None):
+    """统计页数据：各科成绩与各班总分的完整统计（含百分位数和直方图），以及各班各科的基本统计"""
+    bin_width = bin_width or current_app.config['STATS_HISTOGRAM_BIN_WIDTH']
+    percentiles = current_app.config['STATS_PERCENTILES']
+    subject_names = {subject.id: subject.name for subject in get_subjects()}
+
+    by_class_subject, score_edges = _accumulate_stats(Score.score, [Student.class_name, Score.subject_id],
+                                                      Score.__table__.join(Student.__table__), [], bin_width)
+    by_subject = _rollup_stats(by_class_subject, 1)
+    subject_percentiles = grouped_percentiles(Score.score, [Score.subject_id], Score, [],
+                                              {key: acc['count'] for key, acc in by_subject.items()}, percentiles)
+
+    class_conditions = [Student.score_count > 0] # 没有任何成绩的学生不计入班级总分统计
+    by_class, total_edges = _accumulate_stats(Student.total_score, [Student.class_name], Student,
+                                              class_conditions, bin_width)
+    class_percentiles = grouped_percentiles(Student.total_score, [Student.class_name], Student, class_conditions,
+                                            {key: acc['count'] for key, acc in by_class.items()}, percentiles)
+
+    class_subjects = {}
+    for (class_name, subject_id), acc in by_class_subject.items():
+        class_subjects.setdefault(class_name, []).append(
+            dict(_finalize_stats(acc), subject_id=subject_id, subject=subject_names.get(subject_id)))
+    return {
+        'percentiles': list(percentiles),
+        'subjects': [dict(_finalize_stats(acc, score_edges), subject_id=subject_id,
+                          subject=subject_names.get(subject_id), percentiles=subject_percentiles.get((subject_id,), {}))
+                     for (subject_id,), acc in by_subject.items()],
+        'classes': [dict(_finalize_stats(acc, total_edges), class_name=class_name,
+                         percentiles=class_percentiles.get((class_name,), {}), subjects=class_subjects.get(class_name, []))
+                    for (class_name,), acc in by_class.items()],
+    }
+
+@setup.route('/stats')
+@login_required
+@read_replica
+def stats():
+    bin_width = request.args.get('bin_width', type=float)
+    data = compute_statistics(bin_width if bin_width and bin_width > 0 else None)
+    return render_template('stats.html', stats=data)
+
+@setup.route('/stats/data')
+@login_required
+@read_replica
+def stats_data():
+    """统计数据（JSON），可用 bin_width 参数调整直方图分段宽度"""
+    bin_width = request.args.get('bin_width', type=float)
+    if bin_width is not None and bin_width <= 0:
+        return jsonify({'error': 'bin_width must be positive'}), 400
+    return jsonify(compute_statistics(bin_width))
+
+
+# --- CSV 导入 ---
+# 导入模式：append 只新增；upsert 按 (姓名, 班级) 匹配已有学生并合并成绩；upsert_id 按 CSV 中的 ID 列匹配
+IMPORT_MODES = ('append', 'upsert', 'upsert_id')
+
+def import_csv_rows(reader, mode='append', batch_size=None, progress=None):
+    """
+    批量导入引擎：从 csv.reader 读取表头和数据行，逐行校验后按批写入数据库。
+    每批学生一次 flush 批量插入，成绩用一次 executemany 插入，整批一个事务提交。
+    mode 为 upsert / upsert_id 时，每批只用一次查询匹配已有学生，并以原生 upsert 合并成绩
+    （CSV 中为空的单元格不会清除已有成绩）。
+    每写完一批调用 progress(rows_processed, result)（可选）。
+    表头不合法时抛出 ValueError（消息可直接展示给用户）。
+    返回 {'imported', 'updated', 'skipped': [(line_num, reason)], 'unknown_subjects'}。
+    """
+    batch_size = batch_size or current_app.config['IMPORT_BATCH_SIZE']
+
+    # --- Header Validation ---
+    header = next(reader, None)
+    if not header:
+        raise ValueError("CSV 文件为空或无法读取表头！")
+
+    # Normalize header names
+    normalized_header = [h.strip().lower() for h in header]
+    try:
+        # Case-insensitive check for required columns
+        name_index = next(i for i, h in enumerate(normalized_header) if h == '姓名')
+        class_index = next(i for i, h in enumerate(normalized_header) if h == '班级')
+    except StopIteration:
+        raise ValueError("CSV 文件格式错误！表头必须包含 '姓名' 和 '班级' 列（大小写不敏感）。")
+    # 导出文件中的 ID 列：upsert_id 模式必需，其他模式忽略
+    id_index = next((i for i, h in enumerate(normalized_header) if h in ('id', '学生id')), None)
+    if mode == 'upsert_id' and id_index is None:
+        raise ValueError("按 ID 更新需要 CSV 表头包含 'ID' 列（可直接使用本系统导出的文件）。")
+
+    # --- Subject Mapping ---
+    all_subjects = get_subjects()
+    subject_name_to_id = {subject.name.strip().lower(): subject.id for subject in all_subjects} # Lowercase and strip for mapping
+    csv_col_index_to_subject_id = {} # Map CSV column index to subject_id
+    unknown_subjects_in_csv = []
+    processed_indices = {name_index, class_index}
+    if id_index is not None:
+        processed_indices.add(id_index)
+
+    for index, col_name in enumerate(header):
+        if index in processed_indices:
+            continue
+        normalized_col_name = col_name.strip().lower()
+        if not normalized_col_name: # Skip empty column headers
+            continue
+
+        subject_id = subject_name_to_id.get(normalized_col_name)
+        if subject_id:
+            csv_col_index_to_subject_id[index] = subject_id
+            processed_indices.add(index)
+        elif normalized_col_name == '总分': # 导出文件中的总分列由各科成绩得出，导入时忽略
+            processed_indices.add(index)
+        elif col_name.strip(): # Report only non-empty unknown columns
+            unknown_subjects_in_csv.append(col_name.strip())
+
+    # --- Data Processing ---
+    result = {
+        'imported': 0,
+        'updated': 0,
+        'skipped': [], # Store tuples (line_num, reason)
+        'unknown_subjects': unknown_subjects_in_csv,
+    }
+    write_batch = _write_import_batch if mode == 'append' else _write_upsert_batch
+    batch = [] # 已校验、待写入的行 [(line_num, student_id, name, class_name, {subject_id: score})]
+    line_num = 1 # Header is line 1
+
+    for row in reader:
+        line_num += 1
+        if not row or len(row) <= max(name_index, class_index): # Skip empty or short rows
+            continue
+
+        # Check if row is entirely empty cells
+        if all(not cell or cell.isspace() for cell in row):
+            continue
+
+        name = row[name_index].strip()
+        class_name = row[class_index].strip()
+
+        if not name or not class_name:
+            result['skipped'].append((line_num, f"姓名 ('{name}') 或班级 ('{class_name}') 为空"))
+            continue
+
+        student_id = None
+        if mode == 'upsert_id':
+            id_str = row[id_index].strip() if id_index < len(row) else ''
+            try:
+                student_id = int(id_str)
+            except ValueError:
+                result['skipped'].append((line_num, f"姓名'{name}', 学生ID无效('{id_str}')"))
+                continue
+
+        row_scores = {} # {subject_id: score}，同一科目出现多列时保留第一列
+        score_error_in_row = False
+        for col_index, subject_id in csv_col_index_to_subject_id.items():
+            if col_index < len(row) and row[col_index] and row[col_index].strip(): # Check index and if cell has non-whitespace content
+                score_str = row[col_index].strip()
+                try:
+                    score_val = float(score_str)
+                    if score_val < 0:
+                         result['skipped'].append((line_num, f"姓名'{name}', 科目'{header[col_index]}'分数无效(负数: {score_str})"))
+                         score_error_in_row = True
+                         break # Stop processing scores for this row on error
+                    row_scores.setdefault(subject_id, score_val)
+                except ValueError:
+                    result['skipped'].append((line_num, f"姓名'{name}', 科目'{header[col_index]}'分数格式无效('{score_str}')"))
+                    score_error_in_row = True
+                    break # Stop processing scores for this row on error
+
+        if score_error_in_row:
+            continue # Move to the next row in CSV
+
+        batch.append((line_num, student_id, name, class_name, row_scores))
+        if len(batch) >= batch_size:
+            write_batch(batch, result, mode)
+            batch = []
+            if progress:
+                progress(line_num - 1, result)
+
+    if batch:
+        write_batch(batch, result, mode)
+    if progress:
+        progress(line_num - 1, result)
+    return result
+
+def _insert_student_rows(rows):
+    """
+    批量插入学生行（Core executemany，不经过 ORM 的逐行 flush），返回与 rows 顺序一致的新 ID 列表。
+    同一条 INSERT 插入的多行按 VALUES 顺序分配递增的自增 ID，因此把取回的 ID 排序即可与参数一一对应。
+    """
+    if db.session.get_bind(mapper=Student).dialect.insert_executemany_returning:
+        # SQLite / PostgreSQL / MariaDB：insertmanyvalues 把整批合并为多行 INSERT ... RETURNING。
+        # 不使用 sort_by_parameter_order：自增主键没有可用的排序哨兵，SQLite 会因此退化为逐行插入
+        return sorted(db.session.scalars(insert(Student).returning(Student.id), rows))
+    # MySQL 不支持 RETURNING：插入前记下最大 ID，插入后按 ID 顺序取回本批的行。
+    # 同一事务的一致性读看不到其他事务之后提交的行；仍按 (姓名, 班级) 逐一认领，防止误认
+    max_before = db.session.query(func.max(Student.id)).scalar() or 0
+    db.session.execute(insert(Student), rows)
+    pending = {}
+    for index, row in enumerate(rows):
+        pending.setdefault((row['name'], row['class_name']), deque()).append(index)
+    ids = [None] * len(rows)
+    for student_id, name, class_name in db.session.query(Student.id, Student.name, Student.class_name)\
+                                                  .filter(Student.id > max_before).order_by(Student.id):
+        waiting = pending.get((name, class_name))
+        if waiting:
+            ids[waiting.popleft()] = student_id
+    if None in ids:
+        raise RuntimeError("无法取回新插入学生的 ID")
+    return ids
+
+def _insert_new_students(entries):
+    """
+    批量插入新学生及其成绩（不提交），返回新学生的 ID 列表（与 entries 顺序一致）。
+    entries 为 [(name, class_name, {subject_id: score})]；学生、成绩、姓名索引各为一条批量语句。
+    """
+    student_ids = _insert_student_rows([{'name': name, 'class_name': class_name,
+                                         'total_score': sum(row_scores.values()), 'score_count': len(row_scores)}
+                                        for name, class_name, row_scores in entries])
+
+    score_rows = [{'student_id': student_id, 'subject_id': subject_id, 'score': score_val}
+                  for student_id, (_, _, row_scores) in zip(student_ids, entries)
+                  for subject_id, score_val in row_scores.items()]
+    if score_rows:
+        db.session.execute(insert(Score), score_rows) # executemany
+    token_rows = [{'student_id': student_id, 'token': token}
+                  for student_id, (name, _, _) in zip(student_ids, entries) for token in name_search_tokens(name)]
+    if token_rows:
+        db.session.execute(insert(StudentNameToken), token_rows)
+    return student_ids
+
+def _fail_import_batch(batch, result, ex):
+    """整批回滚，批内每行记入跳过列表"""
+    db.session.rollback() # Rollback this batch
+    current_app.logger.error(f"CSV import batch failed (lines {batch[0][0]}-{batch[-1][0]}): {ex}", exc_info=True)
+    for line_num, _, name, _, _ in batch:
+        result['skipped'].append((line_num, f"姓名'{name}', 数据库错误: {ex}"))
+
+def _write_import_batch(batch, result, mode='append'):
+    """append 模式：将一批已校验的行作为新学生写入并提交"""
+    try:
+        student_ids = _insert_new_students([(name, class_name, row_scores)
+                                            for _, _, name, class_name, row_scores in batch])
+        update_rankings(capture_rank_state([]), student_ids) # 按受影响的班级/科目重算
+        db.session.commit()
+        result['imported'] += len(batch)
+    except Exception as ex:
+        _fail_import_batch(batch, result, ex)
+
+def _write_upsert_batch(batch, result, mode):
+    """
+    upsert 模式：一次查询匹配本批中已存在的学生，新学生批量插入，
+    已有学生的成绩用原生 upsert 合并，然后只为这些学生刷新冗余总分，整批一次提交。
+    """
+    # 批内同一学生出现多次时合并为一条：后出现的行覆盖姓名/班级和对应科目成绩
+    merged = {} # key -> [student_id, name, class_name, {subject_id: score}]
+    for _, student_id, name, class_name, row_scores in batch:
+        key = student_id if mode == 'upsert_id' else (name, class_name)
+        entry = merged.get(key)
+        if entry is None:
+            merged[key] = [student_id, name, class_name, dict(row_scores)]
+        else:
+            entry[1], entry[2] = name, class_name
+            entry[3].update(row_scores)
+
+    try:
+        # --- 批量匹配已有学生 ---
+        existing_ids = {} # key -> student.id
+        if mode == 'upsert_id':
+            for id_chunk in chunked(list(merged)):
+                for (sid,) in db.session.query(Student.id).filter(Student.id.in_(id_chunk)):
+                    existing_ids[sid] = sid
+        else:
+            names = list({name for name, _ in merged})
+            classes = list({class_name for _, class_name in merged})
+            # 两个 IN 列表各取半块，单条查询的绑定参数总数不超过 SQL_IN_CHUNK_SIZE
+            for name_chunk in chunked(names, SQL_IN_CHUNK_SIZE // 2):
+                for class_chunk in chunked(classes, SQL_IN_CHUNK_SIZE // 2):
+                    rows = db.session.query(Student.id, Student.name, Student.class_name)\
+                                     .filter(Student.name.in_(name_chunk), Student.class_name.in_(class_chunk))\
+                                     .order_by(Student.id)
+                    for sid, name, class_name in rows:
+                        if (name, class_name) not in merged: # 姓名和班级分别匹配的组合中，只保留本批实际出现的
+                            continue
+                        known = existing_ids.get((name, class_name))
+                        existing_ids[(name, class_name)] = sid if known is None else min(known, sid) # 重名时取 ID 最小的学生
+
+        rank_before = capture_rank_state(set(existing_ids.values()))
+
+        # --- 新学生：批量插入 ---
+        new_entries = []
+        for key, (student_id, name, class_name, row_scores) in merged.items():
+            if key in existing_ids:
+                continue
+            if mode == 'upsert_id':
+                line_num = next(line for line, sid, *_ in batch if sid == student_id)
+                result['skipped'].append((line_num, f"姓名'{name}', 学生ID不存在: {student_id}"))
+                continue
+            new_entries.append((name, class_name, row_scores))
+        new_ids = _insert_new_students(new_entries) if new_entries else []
+
+        # --- 已有学生：更新姓名/班级，合并成绩 ---
+        matched = [(existing_ids[key], entry) for key, entry in merged.items() if key in existing_ids]
+        if matched:
+            if mode == 'upsert_id':
+                db.session.execute(update(Student), [{'id': sid, 'name': name, 'class_name': class_name}
+                                                     for sid, (_, name, class_name, _) in matched])
+            upsert_scores([{'student_id': sid, 'subject_id': subject_id, 'score': score_val}
+                           for sid, (_, _, _, row_scores) in matched
+                           for subject_id, score_val in row_scores.items()])
+            refresh_student_totals([sid for sid, _ in matched])
+            if mode == 'upsert_id':
+                refresh_name_tokens([sid for sid, _ in matched])
+        update_rankings(rank_before, [sid for sid, _ in matched] + new_ids)
+
+        db.session.commit()
+        result['imported'] += len(new_entries)
+        result['updated'] += len(matched)
+    except Exception as ex:
+        _fail_import_batch(batch, result, ex)
+
+def summarize_import(result):
+    """根据 import_csv_rows() 的结果生成 (提示消息, flash 类别)"""
+    imported_count = result['imported']
+    updated_count = result['updated']
+    skipped_rows_info = result['skipped']
+
+    success_msg = "导入完成！"
+    if imported_count > 0:
+        success_msg += f" 成功添加 {imported_count} 名新学生记录。"
+    if updated_count > 0:
+        success_msg += f" 更新了 {updated_count} 名已有学生。"
+    if imported_count == 0 and updated_count == 0:
+         if not skipped_rows_info: # And no rows were skipped
+             success_msg = "未导入任何新学生数据。CSV 文件可能为空。"
+         else: # Nothing imported, but rows were skipped
+              success_msg = "未导入任何新学生数据。"
+
+    if skipped_rows_info:
+         # Summarize skipped rows concisely
+         reasons = {}
+         max_reasons_to_show = 3
+         for _, reason in skipped_rows_info:
+             simple_reason = reason.split(',')[1] if ',' in reason else reason # Simplify reason text
+             simple_reason = simple_reason.split(':')[0].strip() # Further simplify
+             reasons[simple_reason] = reasons.get(simple_reason, 0) + 1
+
+         summary_parts = [f"{count} 行因 '{reason}'" for reason, count in list(reasons.items())[:max_reasons_to_show]]
+         if len(reasons) > max_reasons_to_show:
+             summary_parts.append("及其他原因")
+         summary = ", ".join(summary_parts)
+
+         success_msg += f" 跳过了 {len(skipped_rows_info)} 行 ({summary})。"
+         return success_msg, "warning" # Use warning if skips occurred
+    elif imported_count > 0 or updated_count > 0:
+         return success_msg, "success" # Use success only if no skips
+    return success_msg, "info" # Use info if nothing imported and no skips
+
+
+# 后台导入线程池：进程内执行，无需外部消息队列
+import_executor = None # create_app() 按 IMPORT_WORKERS 创建 ThreadPoolExecutor
+IMPORT_JOB_MAX_ERRORS = 50 # 任务中最多保存的跳过原因条数
+
+CSV_ENCODINGS = ['utf-8-sig', 'utf-8', 'gbk', 'gb2312'] # 按顺序尝试的编码
+CSV_SNIFF_BYTES = 64 * 1024 # 用于检测编码的文件开头字节数
+
+def detect_csv_encoding(sample, at_eof):
+    """
+    用文件开头的一段字节检测编码。使用增量解码器，末尾被截断的多字节字符不会误判为解码失败。
+    CSV 表头必须包含中文列名，因此样本中总会有非 ASCII 字符可供区分。无法识别时返回 None。
+    """
+    for enc in CSV_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(enc)().decode(sample, final=at_eof)
+            return enc
+        except UnicodeDecodeError:
+            continue
+    return None
+
+@contextmanager
+def open_csv_reader(path):
+    """
+    以流的方式打开上传的 CSV 文件：只读取开头 CSV_SNIFF_BYTES 字节检测编码，
+    随后通过 TextIOWrapper 边读边解码，内存占用与文件大小无关。无法识别编码时抛出 ValueError。
+    """
+    with open(path, 'rb') as raw:
+        sample = raw.read(CSV_SNIFF_BYTES)
+        encoding = detect_csv_encoding(sample, at_eof=len(sample) < CSV_SNIFF_BYTES)
+        if encoding is None:
+            raise ValueError("无法解码文件内容，请确保文件使用 UTF-8 或 GBK/GB2312 编码。")
+        current_app.logger.info(f"CSV file {os.path.basename(path)} detected encoding: {encoding}")
+        raw.seek(0)
+        with TextIOWrapper(raw, encoding=encoding, newline='') as text:
+            yield csv.reader(text)
+
+def import_worker_id():
+    """当前进程的标识 "主机名:pid"（fork 出的 worker 进程各不相同，因此在调用时计算）"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def import_job_orphaned(job):
+    """
+    未结束的任务所属的进程是否已经退出。任务只在创建它的进程的线程池中执行，该进程退出后不会再有线程处理它。
+    只能判断本机的其他进程：其他主机上的、本进程的和未记录进程的任务都视为仍在执行。
+    """
+    if job.status not in ('queued', 'running') or not job.worker or os.name != 'posix':
+        return False
+    host, _, pid = job.worker.rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0) # 信号 0 只检查进程是否存在
+    except ProcessLookupError:
+        return True
+    except OSError: # 进程存在，但属于其他用户
+        return False
+    return False
+
+def fail_orphaned_import_job(job):
+    """把进程已退出的任务标记为失败（由调用者提交）"""
+    job.status, job.category = 'failed', 'danger'
+    job.message = "执行导入的进程已退出 (服务重启)，任务已中止。已处理的批次已保存，请检查数据后重新导入剩余部分。"
+    job.finished_at = datetime.datetime.utcnow()
+    IMPORT_JOBS.inc(status='failed')
+
+def fail_orphaned_import_jobs():
+    """
+    把本机上所属进程已退出的未完成任务标记为失败，返回标记的任务数。只看进程是否存在，
+    因此每个 worker 启动时都可以调用，不会误判其他仍在运行的 worker 或其他主机上的任务。
+    """
+    jobs = ImportJob.query.filter(ImportJob.status.in_(('queued', 'running')),
+                                  ImportJob.worker.like(f"{socket.gethostname()}:%")).all()
+    orphaned = [job for job in jobs if import_job_orphaned(job)]
+    for job in orphaned:
+        fail_orphaned_import_job(job)
+    db.session.commit()
+    return len(orphaned)
+
+def run_import_job(app, job_id, path):
+    """
+    执行一个导入任务（在后台线程或当前请求中），进度和结果写回 ImportJob。同步模式在请求中调用时沿用请求的
+    应用上下文：g.data_written 等标记留在请求上（read-your-writes 依赖它），导入也使用请求的数据库会话。
+    """
+    in_request_app = has_app_context() and current_app._get_current_object() is app
+    with nullcontext() if in_request_app else app.app_context():
+        job = db.session.get(ImportJob, job_id)
+        if job is None:
+            current_app.logger.error(f"Import job {job_id} not found")
+            return
+        job.status = 'running'
+        db.session.commit()
+        started = time.perf_counter()
+
+        def record(rows_processed, result):
+            # 每批写入后按增量累加导入行数指标，长时间运行的任务也能看到实时吞吐
+            IMPORT_ROWS.inc(result['imported'] - job.imported, result='imported')
+            IMPORT_ROWS.inc(result['updated'] - job.updated, result='updated')
+            IMPORT_ROWS.inc(len(result['skipped']) - job.skipped, result='skipped')
+            job.rows_processed = rows_processed
+            job.imported = result['imported']
+            job.updated = result['updated']
+            job.skipped = len(result['skipped'])
+            job.errors = json.dumps(result['skipped'][:IMPORT_JOB_MAX_ERRORS], ensure_ascii=False)
+            db.session.commit()
 
+        try:
+            with open_csv_reader(path) as reader:
+                result = import_csv_rows(reader, mode=job.mode, progress=record)
+            if result['unknown_subjects']:
+                job.warning = f"警告：CSV 文件中的以下科目在系统中不存在或名称不完全匹配，对应列将被忽略：{', '.join(result['unknown_subjects'])}"
+            job.message, job.category = summarize_import(result)
+            job.status = 'done'
+        except UnicodeDecodeError as e: # 文件后半部分的编码与开头不一致
+            db.session.rollback()
+            job.status, job.category = 'failed', 'danger'
+            job.message = (f"文件中包含无法按 {e.encoding} 解码的内容，导入已在第 {job.rows_processed} 行之后中止，"
+                           f"此前的数据已保存。请将整个文件统一保存为 UTF-8 或 GBK 编码。")
+        except ValueError as e: # 编码或表头不合法
+            db.session.rollback()
+            job.status, job.message, job.category = 'failed', str(e), 'danger'
+        except Exception as e:
+            db.session.rollback() # Rollback any partial changes on major error
+            current_app.logger.error(f"CSV import job {job_id} failed: {e}", exc_info=True)
+            job.status, job.message, job.category = 'failed', f"处理 CSV 文件时发生严重错误：{e}", 'danger'
+        finally:
+            job.finished_at = datetime.datetime.utcnow()
+            db.session.commit()
+            IMPORT_JOBS.inc(status=job.status)
+            IMPORT_DURATION.observe(time.perf_counter() - started)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
-@app.route('/import', methods=['GET', 'POST'])
+
+@setup.route('/import', methods=['GET', 'POST'])
 @login_required
 def import_students():
     if request.method == 'POST':
@@ -584,241 +3025,754 @@ def import_students():
         if not allowed_file(f.filename):
             flash("不允许的文件类型，请上传 CSV 文件！", "danger")
             return redirect(request.url)
+        mode = request.form.get('mode', 'append')
+        if mode not in IMPORT_MODES:
+            flash("无效的导入模式！", "danger")
+            return redirect(request.url)
 
+        # 先把上传内容分块写入磁盘，再交给后台任务处理
+        job_id = uuid.uuid4().hex
+        path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"{job_id}_{secure_filename(f.filename)}")
         try:
-            # Attempt to decode with common encodings
-            content = f.stream.read()
-            decoded_content = None
-            encodings_to_try = ['utf-8-sig', 'utf-8', 'gbk', 'gb2312']
-            detected_encoding = None
-            for enc in encodings_to_try:
-                try:
-                    decoded_content = content.decode(enc)
-                    detected_encoding = enc
-                    app.logger.info(f"CSV file decoded successfully using encoding: {enc}")
-                    break
-                except UnicodeDecodeError:
-                    continue
-
-            if decoded_content is None:
-                 flash("无法解码文件内容，请确保文件使用 UTF-8 或 GBK/GB2312 编码。", "danger")
-                 return redirect(request.url)
-
-            stream = StringIO(decoded_content) # Use default newline handling of StringIO
-            reader = csv.reader(stream)
+            f.save(path)
+            job = ImportJob(id=job_id, filename=f.filename[:255], mode=mode, created_by=current_user.id,
+                            worker=import_worker_id())
+            db.session.add(job)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Failed to queue CSV import: {e}", exc_info=True)
+            flash(f"保存上传文件时出错：{e}", "danger")
+            return redirect(request.url)
 
-            # --- Header Validation ---
-            header = next(reader, None)
-            if not header:
-                flash("CSV 文件为空或无法读取表头！", "danger")
+        if not current_app.config['IMPORT_ASYNC']:
+            # 同步模式：在当前请求中完成导入，直接显示结果
+            run_import_job(current_app._get_current_object(), job_id, path)
+            job = db.session.get(ImportJob, job_id)
+            if job.warning:
+                flash(job.warning, "warning")
+            flash(job.message, job.category)
+            if job.status == 'failed':
                 return redirect(request.url)
+            return redirect(url_for('student_list'))
 
-            # Normalize header names
-            normalized_header = [h.strip().lower() for h in header]
-            try:
-                # Case-insensitive check for required columns
-                name_index = next(i for i, h in enumerate(normalized_header) if h == '姓名')
-                class_index = next(i for i, h in enumerate(normalized_header) if h == '班级')
-            except StopIteration:
-                 flash("CSV 文件格式错误！表头必须包含 '姓名' 和 '班级' 列（大小写不敏感）。", "danger")
-                 return redirect(request.url)
-
-            # --- Subject Mapping ---
-            all_subjects = Subject.query.all()
-            subject_name_to_id = {subject.name.strip().lower(): subject.id for subject in all_subjects} # Lowercase and strip for mapping
-            csv_col_index_to_subject_id = {} # Map CSV column index to subject_id
-            unknown_subjects_in_csv = []
-            processed_indices = {name_index, class_index}
-
-            for index, col_name in enumerate(header):
-                if index in processed_indices:
-                    continue
-                normalized_col_name = col_name.strip().lower()
-                if not normalized_col_name: # Skip empty column headers
-                    continue
-
-                subject_id = subject_name_to_id.get(normalized_col_name)
-                if subject_id:
-                    csv_col_index_to_subject_id[index] = subject_id
-                    processed_indices.add(index)
-                elif col_name.strip(): # Report only non-empty unknown columns
-                    unknown_subjects_in_csv.append(col_name.strip())
-
-            if unknown_subjects_in_csv:
-                 flash(f"警告：CSV 文件中的以下科目在系统中不存在或名称不完全匹配，对应列将被忽略：{', '.join(unknown_subjects_in_csv)}", "warning")
-
-            # --- Data Processing ---
-            imported_count = 0
-            updated_count = 0 # If implementing update logic later
-            skipped_rows_info = [] # Store tuples (line_num, reason)
-            line_num = 1 # Header is line 1
-
-            # Process rows
-            for row in reader:
-                line_num += 1
-                if not row or len(row) <= max(name_index, class_index): # Skip empty or short rows
-                    # Optionally log short rows if needed
-                    # skipped_rows_info.append((line_num, "行数据不完整"))
-                    continue
-
-                # Check if row is entirely empty cells
-                if all(not cell or cell.isspace() for cell in row):
-                    continue
-
-                name = row[name_index].strip()
-                class_name = row[class_index].strip()
-
-                if not name or not class_name:
-                    skipped_rows_info.append((line_num, f"姓名 ('{name}') 或班级 ('{class_name}') 为空"))
-                    continue
+        import_executor.submit(run_import_job, current_app._get_current_object(), job_id, path)
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'job_id': job_id,
+                            'status_url': url_for('import_job_status', job_id=job_id)}), 202
+        return redirect(url_for('import_students', job=job_id))
 
-                # --- Find or Create Student ---
-                # Simple: Add new student. Assumes unique names/classes aren't strictly enforced or handled manually.
-                # TODO: Add logic here to check if student exists and update instead?
-                student = Student(name=name, class_name=class_name)
-                db.session.add(student) # Add student tentatively
-
-                current_student_scores_valid = []
-                score_error_in_row = False
-                for col_index, subject_id in csv_col_index_to_subject_id.items():
-                    if col_index < len(row) and row[col_index] and row[col_index].strip(): # Check index and if cell has non-whitespace content
-                        score_str = row[col_index].strip()
-                        try:
-                            score_val = float(score_str)
-                            if score_val < 0:
-                                 skipped_rows_info.append((line_num, f"姓名'{name}', 科目'{header[col_index]}'分数无效(负数: {score_str})"))
-                                 score_error_in_row = True
-                                 break # Stop processing scores for this row on error
-                            # Store valid score info temporarily
-                            current_student_scores_valid.append({'subject_id': subject_id, 'score': score_val})
-                        except ValueError:
-                            skipped_rows_info.append((line_num, f"姓名'{name}', 科目'{header[col_index]}'分数格式无效('{score_str}')"))
-                            score_error_in_row = True
-                            break # Stop processing scores for this row on error
-
-                if score_error_in_row:
-                    db.session.rollback() # Rollback the student add for this row
-                    continue # Move to the next row in CSV
-                else:
-                    # No score errors, proceed to associate scores after flushing student
-                    try:
-                        db.session.flush() # Flush to get student.id
-                        for score_info in current_student_scores_valid:
-                             # Check for existing score before adding (important if update logic is added)
-                             # For pure add, this isn't strictly needed but good practice
-                             existing = Score.query.filter_by(student_id=student.id, subject_id=score_info['subject_id']).first()
-                             if not existing:
-                                 db.session.add(Score(student_id=student.id, subject_id=score_info['subject_id'], score=score_info['score']))
-                             # else: handle update if needed
-                        # Commit per student (safer for large files, prevents one error stopping all)
-                        db.session.commit()
-                        imported_count += 1
-                    except Exception as ex:
-                         db.session.rollback() # Rollback this student's transaction
-                         skipped_rows_info.append((line_num, f"姓名'{name}', 数据库错误: {ex}"))
-
-
-            # --- Final Report ---
-            success_msg = "导入完成！"
-            if imported_count > 0:
-                success_msg += f" 成功添加 {imported_count} 名新学生记录。"
-            else: # If nothing was imported (and no updates implemented)
-                 if not skipped_rows_info: # And no rows were skipped
-                     success_msg = "未导入任何新学生数据。CSV 文件可能为空或所有学生已存在（如果实现更新逻辑）。"
-                 else: # Nothing imported, but rows were skipped
-                      success_msg = "未导入任何新学生数据。"
-
-
-            if skipped_rows_info:
-                 # Summarize skipped rows concisely
-                 reasons = {}
-                 max_reasons_to_show = 3
-                 for _, reason in skipped_rows_info:
-                     simple_reason = reason.split(',')[1] if ',' in reason else reason # Simplify reason text
-                     simple_reason = simple_reason.split(':')[0].strip() # Further simplify
-                     reasons[simple_reason] = reasons.get(simple_reason, 0) + 1
-
-                 summary_parts = [f"{count} 行因 '{reason}'" for reason, count in list(reasons.items())[:max_reasons_to_show]]
-                 if len(reasons) > max_reasons_to_show:
-                     summary_parts.append("及其他原因")
-                 summary = ", ".join(summary_parts)
-
-                 success_msg += f" 跳过了 {len(skipped_rows_info)} 行 ({summary})。"
-                 flash(success_msg, "warning") # Use warning if skips occurred
-            elif imported_count > 0: # or updated_count > 0:
-                 flash(success_msg, "success") # Use success only if no skips
-            else:
-                 flash(success_msg, "info") # Use info if nothing imported and no skips
+    # GET request：带 job 参数时显示该任务的进度
+    job = None
+    job_id = request.args.get('job')
+    if job_id:
+        job = db.session.get(ImportJob, job_id)
+        if job is None:
+            flash("导入任务不存在！", "warning")
+    return render_template('import.html', job=job)
 
 
-            return redirect(url_for('student_list'))
+@setup.route('/import/jobs/<job_id>')
+@login_required
+def import_job_status(job_id):
+    """导入任务进度（JSON），供 import.html 轮询"""
+    job = db.session.get(ImportJob, job_id)
+    if job is None:
+        # 返回终止状态（failed），轮询的页面据此停止，而不是一直等待一个不存在的任务
+        return jsonify({'id': job_id, 'status': 'failed', 'rows_processed': 0, 'imported': 0, 'updated': 0,
+                        'skipped': 0, 'errors': [], 'warning': None, 'message': "导入任务不存在！",
+                        'category': 'danger', 'error': 'not found'}), 404
+    if import_job_orphaned(job): # 执行任务的进程已退出：结束轮询，而不是一直显示“进行中”
+        fail_orphaned_import_job(job)
+        db.session.commit()
+    return jsonify(job.to_dict())
+
+
+# ─── JSON API (/api/v1) ──────────────────────────────────────────────────────
+# 供脚本集成使用，可用登录会话或 HTTP Basic 认证。批量写接口每次最多 API_BATCH_MAX 条记录，
+# 先校验全部记录，任何一条有误则返回 400 且不写入；通过后整批在一个事务中写入。
+API_STUDENT_FIELDS = ('id', 'name', 'class_name', 'total_score', 'score_count',
+                      'overall_rank', 'class_rank', 'scores')
+
+def api_error(message, status=400, details=None):
+    body = {'error': message}
+    if details:
+        body['details'] = details
+    return jsonify(body), status
+
+def _api_fields():
+    """解析 fields 参数（逗号分隔），返回字段元组；包含未知字段时返回 None"""
+    raw = request.args.get('fields', '').strip()
+    if not raw:
+        return API_STUDENT_FIELDS
+    fields = tuple(dict.fromkeys(field.strip() for field in raw.split(',') if field.strip()))
+    return fields if set(fields) <= set(API_STUDENT_FIELDS) else None
+
+def _student_to_dict(student, fields, scores=None):
+    item = {field: getattr(student, field) for field in fields if field != 'scores'}
+    if 'scores' in fields:
+        item['scores'] = {str(subject_id): score for subject_id, score in (scores or {}).items()}
+    return item
+
+def _api_records(key):
+    """取出请求体中的记录列表 body[key]，返回 (records, error_response)"""
+    body = request.get_json(silent=True)
+    records = body.get(key) if isinstance(body, dict) else None
+    if not isinstance(records, list) or not records:
+        return None, api_error(f"request body must be a JSON object with a non-empty '{key}' list")
+    if len(records) > current_app.config['API_BATCH_MAX']:
+        return None, api_error(f"at most {current_app.config['API_BATCH_MAX']} records per request")
+    return records, None
+
+def _api_score(value, allow_null=False):
+    """校验单个分数，返回 (score, error)"""
+    if value is None and allow_null:
+        return None, None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None, "score must be a number"
+    if value < 0:
+        return None, "score must not be negative"
+    return float(value), None
+
+def _api_subject_id(value, subject_ids):
+    """校验科目 ID（JSON 对象的键为字符串），返回 (subject_id, error)"""
+    try:
+        subject_id = int(value)
+    except (TypeError, ValueError):
+        return None, f"invalid subject id {value!r}"
+    if subject_id not in subject_ids:
+        return None, f"unknown subject id {subject_id}"
+    return subject_id, None
+
+def _api_student_record(record, subject_ids, partial=False):
+    """
+    校验一条学生记录 {name, class_name, scores: {subject_id: score}}。
+    partial 为 True 时（批量更新）各字段均可省略，scores 中的 null 表示删除该科成绩。
+    返回 (clean_record, errors)。
+    """
+    if not isinstance(record, dict):
+        return None, ["record must be an object"]
+    clean, errors = {}, []
+    for field in ('name', 'class_name'):
+        if field not in record and partial:
+            continue
+        value = record.get(field)
+        if not isinstance(value, str) or not value.strip():
+            errors.append(f"'{field}' must be a non-empty string")
+        else:
+            clean[field] = value.strip()
+    scores = record.get('scores', {})
+    if not isinstance(scores, dict):
+        errors.append("'scores' must be an object mapping subject id to score")
+        scores = {}
+    clean_scores = {}
+    for key, value in scores.items():
+        subject_id, error = _api_subject_id(key, subject_ids)
+        if error is None:
+            clean_scores[subject_id], error = _api_score(value, allow_null=partial)
+        if error:
+            errors.append(f"scores[{key}]: {error}")
+    if 'scores' in record or not partial:
+        clean['scores'] = clean_scores
+    return clean, errors
+
+def _existing_student_ids(student_ids):
+    found = set()
+    for id_chunk in chunked(list(set(student_ids))):
+        found.update(sid for (sid,) in db.session.query(Student.id).filter(Student.id.in_(id_chunk)))
+    return found
+
+def _delete_score_pairs(pairs):
+    """按 (student_id, subject_id) 删除成绩，返回删除的行数。调用方负责刷新总分和 commit"""
+    deleted = 0
+    for pair_chunk in chunked(list(pairs), SQL_IN_CHUNK_SIZE // 2): # 每对占两个绑定参数
+        result = db.session.execute(delete(Score).where(or_(*[
+            and_(Score.student_id == student_id, Score.subject_id == subject_id)
+            for student_id, subject_id in pair_chunk])))
+        deleted += result.rowcount
+    return deleted
+
+def _api_commit(action):
+    """在一个事务中执行写操作 action()（返回响应），出错时回滚并返回 JSON 500"""
+    try:
+        response = action()
+        db.session.commit()
+        return response
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"API write failed ({request.method} {request.path}): {e}", exc_info=True)
+        return api_error("database error", 500)
 
-        except Exception as e:
-            db.session.rollback() # Rollback any partial changes on major error
-            flash(f"处理 CSV 文件时发生严重错误：{e}", "danger")
-            app.logger.error(f"CSV import failed: {e}", exc_info=True)
-            return redirect(request.url)
+@setup.route('/api/v1/subjects')
+@login_required
+def api_subjects():
+    return jsonify({'items': [{'id': subject.id, 'name': subject.name} for subject in get_subjects()]})
 
-    # GET request
-    return render_template('import.html')
+@setup.route('/api/v1/students')
+@login_required
+def api_students():
+    """
+    学生列表，keyset 分页：响应中的 next_cursor 作为下一次请求的 cursor 参数。
+    参数：limit、cursor、fields、search_name、class_name、top、sort（id / total / subject:<科目ID>）。
+    """
+    fields = _api_fields()
+    if fields is None:
+        return api_error(f"unknown field; available fields: {', '.join(API_STUDENT_FIELDS)}")
+    limit = request.args.get('limit', current_app.config['STUDENTS_PER_PAGE'], type=int)
+    limit = max(1, min(limit, current_app.config['STUDENTS_PER_PAGE_MAX']))
+    cursor = request.args.get('cursor', '')
+    after = decode_cursor(cursor)
+    if cursor and after is None:
+        return api_error("invalid cursor")
+
+    sort = request.args.get('sort', 'id')
+    sort_by_subject_id = None
+    if sort.startswith('subject:'):
+        sort_by_subject_id = sort.partition(':')[2]
+        if not sort_by_subject_id.isdigit():
+            return api_error("sort must be 'id', 'total' or 'subject:<subject id>'")
+        sort_by_subject_id = int(sort_by_subject_id)
+    elif sort not in ('id', 'total'):
+        return api_error("sort must be 'id', 'total' or 'subject:<subject id>'")
+    top = request.args.get('top', type=int)
+
+    query, sort_expr, descending = build_student_query(request.args.get('search_name', '').strip(),
+                                                       sort_by_subject_id=sort_by_subject_id,
+                                                       sort_by_total=sort == 'total',
+                                                       class_name=request.args.get('class_name', '').strip(),
+                                                       top=top if top and top > 0 else None)
+    rows, _, has_next = paginate_students(query, sort_expr, descending, limit, after=after)
+    scores = build_score_matrix([student.id for student, _ in rows]) if 'scores' in fields else {}
+    next_cursor = None
+    if has_next:
+        last_student, last_value = rows[-1]
+        next_cursor = encode_cursor([last_value, last_student.id])
+    return jsonify({'items': [_student_to_dict(student, fields, scores.get(student.id)) for student, _ in rows],
+                    'next_cursor': next_cursor})
+
+@setup.route('/api/v1/students/<int:student_id>')
+@login_required
+def api_student(student_id):
+    fields = _api_fields()
+    if fields is None:
+        return api_error(f"unknown field; available fields: {', '.join(API_STUDENT_FIELDS)}")
+    student = db.session.get(Student, student_id)
+    if student is None:
+        return api_error("student not found", 404)
+    scores = build_score_matrix([student_id]) if 'scores' in fields else {}
+    return jsonify(_student_to_dict(student, fields, scores.get(student_id)))
+
+@setup.route('/api/v1/students', methods=['POST'])
+@login_required
+def api_create_students():
+    """批量新增：{"students": [{"name", "class_name", "scores": {"<科目ID>": 分数}}]}"""
+    records, error = _api_records('students')
+    if error:
+        return error
+    subject_ids = {subject.id for subject in get_subjects()}
+    entries, details = [], []
+    for index, record in enumerate(records):
+        clean, errors = _api_student_record(record, subject_ids)
+        details.extend({'index': index, 'error': e} for e in errors)
+        if not errors:
+            entries.append((clean['name'], clean['class_name'], clean['scores']))
+    if details:
+        return api_error("validation failed", details=details)
+
+    def create():
+        student_ids = _insert_new_students(entries)
+        update_rankings(capture_rank_state([]), student_ids)
+        return jsonify({'created': student_ids}), 201
+    return _api_commit(create)
+
+@setup.route('/api/v1/students', methods=['PATCH'])
+@login_required
+def api_update_students():
+    """
+    批量更新：{"students": [{"id", "name"?, "class_name"?, "scores"?: {"<科目ID>": 分数或 null}}]}。
+    只修改提供的字段；scores 中未出现的科目保持不变，null 表示删除该科成绩。
+    """
+    records, error = _api_records('students')
+    if error:
+        return error
+    subject_ids = {subject.id for subject in get_subjects()}
+    changes, details = {}, []
+    for index, record in enumerate(records):
+        clean, errors = _api_student_record(record, subject_ids, partial=True)
+        student_id = record.get('id') if isinstance(record, dict) else None
+        if isinstance(student_id, bool) or not isinstance(student_id, int):
+            errors.append("'id' must be an integer")
+        elif student_id in changes:
+            errors.append(f"duplicate id {student_id}")
+        details.extend({'index': index, 'error': e} for e in errors)
+        if not errors:
+            changes[student_id] = clean
+    if not details:
+        missing = set(changes) - _existing_student_ids(changes)
+        details = [{'index': index, 'error': f"student {record['id']} not found"}
+                   for index, record in enumerate(records) if record['id'] in missing]
+    if details:
+        return api_error("validation failed", details=details)
+
+    def apply_updates():
+        student_ids = list(changes)
+        rank_before = capture_rank_state(student_ids)
+        renamed = []
+        for id_chunk in chunked(student_ids):
+            for student in Student.query.filter(Student.id.in_(id_chunk)):
+                change = changes[student.id]
+                if change.get('name', student.name) != student.name:
+                    renamed.append(student.id)
+                student.name = change.get('name', student.name)
+                student.class_name = change.get('class_name', student.class_name)
+        scores = [(sid, subject_id, score) for sid, change in changes.items()
+                  for subject_id, score in change.get('scores', {}).items()]
+        upsert_scores([{'student_id': sid, 'subject_id': subject_id, 'score': score}
+                       for sid, subject_id, score in scores if score is not None])
+        _delete_score_pairs((sid, subject_id) for sid, subject_id, score in scores if score is None)
+        db.session.flush()
+        refresh_student_totals(student_ids)
+        if renamed:
+            refresh_name_tokens(renamed)
+        update_rankings(rank_before, student_ids)
+        return jsonify({'updated': len(student_ids)})
+    return _api_commit(apply_updates)
+
+@setup.route('/api/v1/students', methods=['DELETE'])
+@login_required
+def api_delete_students():
+    """批量删除：{"ids": [学生ID, ...]}，任一 ID 不存在时返回 404 且不删除"""
+    student_ids, error = _api_records('ids')
+    if error:
+        return error
+    if not all(isinstance(sid, int) and not isinstance(sid, bool) for sid in student_ids):
+        return api_error("'ids' must be a list of integers")
+    student_ids = list(dict.fromkeys(student_ids))
+    missing = set(student_ids) - _existing_student_ids(student_ids)
+    if missing:
+        return api_error("students not found", 404, details=sorted(missing))
+
+    def remove():
+        rank_before = capture_rank_state(student_ids)
+        for id_chunk in chunked(student_ids):
+            # 批量 DELETE 不经过 ORM 级联，先删除关联的成绩和姓名索引
+            db.session.execute(delete(Score).where(Score.student_id.in_(id_chunk)))
+            db.session.execute(delete(StudentNameToken).where(StudentNameToken.student_id.in_(id_chunk)))
+            db.session.execute(delete(Student).where(Student.id.in_(id_chunk)))
+        update_rankings(rank_before, student_ids)
+        return jsonify({'deleted': len(student_ids)})
+    return _api_commit(remove)
+
+def _api_score_records(records, with_score):
+    """校验成绩记录 [{"student_id", "subject_id", "score"}]，返回 ({(student_id, subject_id): score}, details)"""
+    subject_ids = {subject.id for subject in get_subjects()}
+    pairs, details = {}, []
+    for index, record in enumerate(records):
+        errors = []
+        if not isinstance(record, dict):
+            details.append({'index': index, 'error': "record must be an object"})
+            continue
+        student_id = record.get('student_id')
+        if isinstance(student_id, bool) or not isinstance(student_id, int):
+            errors.append("'student_id' must be an integer")
+        subject_id, error = _api_subject_id(record.get('subject_id'), subject_ids)
+        if error:
+            errors.append(error)
+        score = None
+        if with_score:
+            score, error = _api_score(record.get('score'))
+            if error:
+                errors.append(error)
+        if not errors and (student_id, subject_id) in pairs:
+            errors.append(f"duplicate record for student {student_id}, subject {subject_id}")
+        details.extend({'index': index, 'error': e} for e in errors)
+        if not errors:
+            pairs[student_id, subject_id] = score
+    if not details:
+        missing = {sid for sid, _ in pairs} - _existing_student_ids([sid for sid, _ in pairs])
+        details = [{'index': index, 'error': f"student {record['student_id']} not found"}
+                   for index, record in enumerate(records) if record['student_id'] in missing]
+    return pairs, details
+
+@setup.route('/api/v1/scores', methods=['PUT'])
+@login_required
+def api_upsert_scores():
+    """批量写入成绩：{"scores": [{"student_id", "subject_id", "score"}]}，已存在则更新"""
+    records, error = _api_records('scores')
+    if error:
+        return error
+    pairs, details = _api_score_records(records, with_score=True)
+    if details:
+        return api_error("validation failed", details=details)
+
+    def write():
+        student_ids = list({sid for sid, _ in pairs})
+        rank_before = capture_rank_state(student_ids)
+        upsert_scores([{'student_id': sid, 'subject_id': subject_id, 'score': score}
+                       for (sid, subject_id), score in pairs.items()])
+        refresh_student_totals(student_ids)
+        update_rankings(rank_before, student_ids)
+        return jsonify({'written': len(pairs)})
+    return _api_commit(write)
+
+@setup.route('/api/v1/scores', methods=['DELETE'])
+@login_required
+def api_delete_scores():
+    """批量删除成绩：{"scores": [{"student_id", "subject_id"}]}，不存在的成绩忽略"""
+    records, error = _api_records('scores')
+    if error:
+        return error
+    pairs, details = _api_score_records(records, with_score=False)
+    if details:
+        return api_error("validation failed", details=details)
+
+    def remove():
+        student_ids = list({sid for sid, _ in pairs})
+        rank_before = capture_rank_state(student_ids)
+        deleted = _delete_score_pairs(pairs)
+        refresh_student_totals(student_ids)
+        update_rankings(rank_before, student_ids)
+        return jsonify({'deleted': deleted})
+    return _api_commit(remove)
 
 
 # ─── CLI：数据库管理 ───────────────────────────────────────────────
-@app.cli.command("init-db")
+def initial_admin_password():
+    """首个管理员的初始密码：环境变量 INITIAL_ADMIN_PASSWORD 优先于 config.yaml 中的 app.initial_admin_password"""
+    return os.environ.get('INITIAL_ADMIN_PASSWORD') or current_app.config['INITIAL_ADMIN_PASSWORD']
+
+@setup.command("init-db")
 @click.option('--drop', is_flag=True, help='删除所有表后再创建。')
 def init_db(drop):
     """初始化数据库：创建所有表并添加默认管理员 admin/admin。"""
-    with app.app_context():
-        if drop:
-            click.confirm('确定要删除所有数据库表吗？此操作不可逆！', abort=True)
-            db.drop_all()
-            click.echo("已删除所有表。")
+    if drop:
+        click.confirm('确定要删除所有数据库表吗？此操作不可逆！', abort=True)
+        db.drop_all(bind_key=None) # 只操作主库：从库的表结构由数据库复制同步，不能在从库上建表或删表
+        cache.clear()
+        click.echo("已删除所有表。")
+
+    try:
+        db.create_all(bind_key=None)
+        click.echo("已创建所有数据库表。")
+    except Exception as e:
+         click.echo(f"创建数据库表时出错: {e}", err=True)
+         return # Stop if tables can't be created
 
+
+    if not User.query.filter_by(username="admin").first():
+        admin_password = initial_admin_password() or "admin" # 未配置初始密码时使用默认密码
         try:
-            db.create_all()
-            click.echo("已创建所有数据库表。")
+            admin = User(
+                username="admin",
+                password=hash_password(admin_password)
+            )
+            db.session.add(admin)
+            db.session.commit()
+            click.echo(f"已创建默认管理员账户：admin / {admin_password}")
         except Exception as e:
-             click.echo(f"创建数据库表时出错: {e}", err=True)
-             return # Stop if tables can't be created
+             db.session.rollback()
+             click.echo(f"创建默认管理员时出错: {e}", err=True)
+    else:
+        click.echo("管理员账户 'admin' 已存在。")
 
+    # 可以选择在这里添加默认科目
+    default_subjects = ["语文", "数学", "英语", "科学", "物理"] # Added Physics
+    added_subjects = []
+    try:
+        for subj_name in default_subjects:
+             # Case-insensitive check
+             if not Subject.query.filter(func.lower(Subject.name) == func.lower(subj_name)).first():
+                 db.session.add(Subject(name=subj_name))
+                 added_subjects.append(subj_name)
+        if added_subjects:
+             db.session.commit()
+             invalidate_subjects()
+             click.echo(f"已添加默认科目：{', '.join(added_subjects)}")
+        else:
+             click.echo("默认科目已存在或添加失败。")
+    except Exception as e:
+         db.session.rollback()
+         click.echo(f"添加默认科目时出错: {e}", err=True)
+
+
+@setup.command("rebuild-totals")
+@click.option('--verify', is_flag=True, help='只检查冗余总分是否与成绩表一致，不做修改。')
+def rebuild_totals(verify):
+    """重建（或校验）所有学生的冗余总分 total_score 和成绩条数 score_count。"""
+    if verify:
+        total_sq = db.session.query(Score.student_id,
+                                    func.sum(Score.score).label('total'),
+                                    func.count(Score.id).label('cnt'))\
+                             .group_by(Score.student_id)\
+                             .subquery()
+        expected_total = func.coalesce(total_sq.c.total, 0.0)
+        expected_count = func.coalesce(total_sq.c.cnt, 0)
+        mismatches = db.session.query(Student.id, Student.total_score, expected_total,
+                                      Student.score_count, expected_count)\
+                               .outerjoin(total_sq, total_sq.c.student_id == Student.id)\
+                               .filter(or_(func.abs(Student.total_score - expected_total) > 1e-6,
+                                           Student.score_count != expected_count))\
+                               .order_by(Student.id)\
+                               .all()
+        if not mismatches:
+            click.echo("所有学生的冗余总分均与成绩表一致。")
+            return
+        click.echo(f"发现 {len(mismatches)} 名学生的冗余总分不一致：", err=True)
+        for sid, stored_total, real_total, stored_count, real_count in mismatches[:20]:
+            click.echo(f"  学生 {sid}: total_score={stored_total} (应为 {real_total}), "
+                       f"score_count={stored_count} (应为 {real_count})", err=True)
+        if len(mismatches) > 20:
+            click.echo("  ...", err=True)
+        click.echo("可运行 'flask rebuild-totals' 进行修复。", err=True)
+        raise SystemExit(1)
 
-        if not User.query.filter_by(username="admin").first():
-            admin_password = "admin" # 默认密码
+    try:
+        refresh_student_totals()
+        rebuild_rankings()
+        db.session.commit()
+        click.echo("已重建所有学生的冗余总分和名次。")
+    except Exception as e:
+        db.session.rollback()
+        click.echo(f"重建冗余总分时出错: {e}", err=True)
+
+
+@setup.command("rebuild-rankings")
+@click.option('--verify', is_flag=True, help='只检查物化名次是否正确，不做修改。')
+def rebuild_rankings_command(verify):
+    """重建（或校验）全校、班内和单科名次。"""
+    if verify:
+        labels = {'overall': '全校名次', 'class': '班内名次', 'subject': '单科名次'}
+        wrong = {name: n for name, n in count_rank_mismatches().items() if n}
+        if not wrong:
+            click.echo("所有名次均正确。")
+            return
+        for name, n in wrong.items():
+            click.echo(f"  {labels[name]}：{n} 行不正确", err=True)
+        click.echo("可运行 'flask rebuild-rankings' 进行修复。", err=True)
+        raise SystemExit(1)
+
+    try:
+        rebuild_rankings()
+        db.session.commit()
+        click.echo("已重建全部名次。")
+    except Exception as e:
+        db.session.rollback()
+        click.echo(f"重建名次时出错: {e}", err=True)
+
+def _audit_queries():
+    """db-audit 检查的热点查询：(名称, SQLAlchemy 语句)，与各路由使用的查询一致"""
+    subject_id = db.session.query(func.min(Subject.id)).scalar() or 1
+    class_name = db.session.query(Student.class_name).limit(1).scalar() or '1班'
+    per_page = current_app.config['STUDENTS_PER_PAGE']
+    export_chunk = current_app.config['EXPORT_CHUNK_SIZE']
+
+    def list_page(**kwargs):
+        query, sort_expr, descending = build_student_query(**kwargs)
+        order = sort_expr.desc() if descending else sort_expr.asc()
+        return query.add_columns(sort_expr).order_by(order, Student.id).limit(per_page + 1).statement
+
+    return [
+        ("学生列表 (按 ID)", list_page()),
+        ("学生列表 (按科目排序)", list_page(sort_by_subject_id=subject_id)),
+        ("学生列表 (按总分排序)", list_page(sort_by_total=True)),
+        ("学生列表 (姓名搜索)", list_page(search_name='张')),
+        ("列表页成绩矩阵", select(Score.student_id, Score.subject_id, Score.score)
+                              .where(Score.student_id.in_([1, 2, 3]))),
+        ("按班级筛选", select(Student.id).where(Student.class_name == class_name)
+                                         .order_by(Student.total_score.desc())),
+        ("班内前 N 名", list_page(class_name=class_name, top=50)),
+        ("单科前 N 名", select(Score.student_id).where(Score.subject_id == subject_id, Score.subject_rank <= 50)),
+        ("导出 (学生窗口)", select(Student.id, Student.name, Student.class_name, Student.total_score)
+                               .where(Student.id > 0).order_by(Student.id).limit(export_chunk)),
+        ("导出 (窗口成绩)", select(Score.student_id, Score.subject_id, Score.score)
+                               .where(Score.student_id > 0, Score.student_id <= export_chunk)),
+        ("删除科目 (级联成绩)", select(Score.id).where(Score.subject_id == subject_id)),
+        ("统计 (班级总分百分位)", select(Student.total_score)
+                                    .where(Student.score_count > 0, Student.class_name == class_name)
+                                    .order_by(Student.total_score).limit(2).offset(per_page)),
+    ]
+
+def _explain(connection, dialect, sql, has_filter):
+    """执行 EXPLAIN，返回 (计划文本行, 全表扫描的表, 额外排序提示)"""
+    plan_lines, full_scans, sorts = [], [], []
+    if dialect == 'sqlite':
+        for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"):
+            detail = row[-1]
+            plan_lines.append(detail)
+            # 无过滤条件时按主键顺序 SCAN + LIMIT 会提前结束，不算全表扫描
+            if detail.startswith('SCAN ') and 'INDEX' not in detail and has_filter:
+                full_scans.append(detail.split()[1])
+            if 'TEMP B-TREE' in detail:
+                sorts.append(detail)
+    elif dialect in ('mysql', 'mariadb'):
+        result = connection.exec_driver_sql(f"EXPLAIN {sql}")
+        for row in result.mappings():
+            plan_lines.append(f"table={row['table']} type={row['type']} key={row['key']} "
+                              f"rows={row['rows']} extra={row['Extra']}")
+            if row['type'] == 'ALL':
+                full_scans.append(row['table'])
+            if row['Extra'] and 'filesort' in row['Extra']:
+                sorts.append(f"{row['table']}: {row['Extra']}")
+    else:
+        for row in connection.exec_driver_sql(f"EXPLAIN {sql}"):
+            plan_lines.append(' '.join(str(col) for col in row))
+    return plan_lines, full_scans, sorts
+
+def rebuild_name_tokens():
+    """按学生 ID 分块重建全部姓名搜索 token。调用方负责 commit。"""
+    db.session.execute(StudentNameToken.__table__.delete())
+    last_id = 0
+    while True:
+        ids = [sid for (sid,) in db.session.query(Student.id)
+                                           .filter(Student.id > last_id)
+                                           .order_by(Student.id)
+                                           .limit(SQL_IN_CHUNK_SIZE)]
+        if not ids:
+            break
+        refresh_name_tokens(ids)
+        last_id = ids[-1]
+
+@setup.command("rebuild-search-index")
+def rebuild_search_index():
+    """根据当前学生姓名重建姓名搜索索引（单字/双字/拼音首字母 token）。"""
+    if lazy_pinyin is None:
+        click.echo("提示：未安装 pypinyin，将不生成拼音首字母索引。")
+    try:
+        rebuild_name_tokens()
+        db.session.commit()
+        click.echo(f"已重建姓名搜索索引，共 {StudentNameToken.query.count()} 个 token。")
+    except Exception as e:
+        db.session.rollback()
+        click.echo(f"重建姓名搜索索引时出错: {e}", err=True)
+
+
+def missing_indexes(inspector):
+    """模型中声明、但数据库中已存在的表上缺失的索引（唯一约束也算作已存在的索引）"""
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        existing |= {uc['name'] for uc in inspector.get_unique_constraints(table.name)}
+        missing.extend(ix for ix in table.indexes if ix.name not in existing)
+    return missing
+
+@setup.command("db-audit")
+@click.option('--create-indexes', is_flag=True, help='创建模型中声明但数据库中缺失的索引。')
+@click.option('--verbose', '-v', is_flag=True, help='输出每条查询的 SQL 和完整执行计划。')
+def db_audit(create_indexes, verbose):
+    """检查数据库索引是否齐全，并对热点查询执行 EXPLAIN，报告全表扫描。"""
+    engine = db.engine
+    dialect = engine.dialect.name
+    click.echo(f"数据库类型: {dialect}")
+
+    # --- 索引检查 ---
+    inspector = db.inspect(engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            click.echo(f"  表 '{table.name}' 不存在，请先执行 'flask upgrade-schema'、'flask db upgrade' 或 'flask init-db'。",
+                       err=True)
+    missing = missing_indexes(inspector)
+    if not missing:
+        click.echo("索引检查：模型中声明的索引均已存在。")
+    for index in missing:
+        columns = ', '.join(col.name for col in index.columns)
+        if create_indexes:
             try:
-                admin = User(
-                    username="admin",
-                    password=generate_password_hash(admin_password)
-                )
-                db.session.add(admin)
-                db.session.commit()
-                click.echo(f"已创建默认管理员账户：admin / {admin_password}")
+                index.create(bind=engine, checkfirst=True)
+                click.echo(f"  已创建索引 {index.name} ON {index.table.name} ({columns})")
             except Exception as e:
-                 db.session.rollback()
-                 click.echo(f"创建默认管理员时出错: {e}", err=True)
+                click.echo(f"  创建索引 {index.name} 失败: {e}", err=True)
         else:
-            click.echo("管理员账户 'admin' 已存在。")
-
-        # 可以选择在这里添加默认科目
-        default_subjects = ["语文", "数学", "英语", "科学", "物理"] # Added Physics
-        added_subjects = []
-        try:
-            for subj_name in default_subjects:
-                 # Case-insensitive check
-                 if not Subject.query.filter(func.lower(Subject.name) == func.lower(subj_name)).first():
-                     db.session.add(Subject(name=subj_name))
-                     added_subjects.append(subj_name)
-            if added_subjects:
-                 db.session.commit()
-                 click.echo(f"已添加默认科目：{', '.join(added_subjects)}")
+            click.echo(f"  缺少索引 {index.name} ON {index.table.name} ({columns})")
+    if missing and not create_indexes:
+        click.echo("可使用 'flask db migrate' + 'flask db upgrade' 或 'flask db-audit --create-indexes' 创建缺失的索引。")
+
+    # --- 热点查询执行计划 ---
+    click.echo("\n热点查询执行计划：")
+    problem_count = 0
+    with engine.connect() as connection:
+        for name, stmt in _audit_queries():
+            sql = str(stmt.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+            try:
+                plan_lines, full_scans, sorts = _explain(connection, dialect, sql,
+                                                         has_filter=stmt.whereclause is not None)
+            except Exception as e:
+                click.echo(f"  [?] {name}: EXPLAIN 失败: {e}", err=True)
+                continue
+            if full_scans:
+                problem_count += 1
+                click.echo(f"  [全表扫描] {name}: {', '.join(full_scans)}")
+            elif sorts:
+                click.echo(f"  [额外排序] {name}")
             else:
-                 click.echo("默认科目已存在或添加失败。")
-        except Exception as e:
-             db.session.rollback()
-             click.echo(f"添加默认科目时出错: {e}", err=True)
+                click.echo(f"  [OK] {name}")
+            if verbose:
+                click.echo(f"      SQL: {' '.join(sql.split())}")
+            for line in (plan_lines if verbose else sorts):
+                click.echo(f"      {line}")
+    click.echo(f"\n共 {problem_count} 条热点查询存在全表扫描。")
+
+
+# 旧版本创建的表中可能缺少的列：(模型, 列名)。新增的表 (data_version、student_name_token、import_job) 整表创建
+UPGRADE_COLUMNS = [
+    (Student, 'total_score'), (Student, 'score_count'), (Student, 'overall_rank'), (Student, 'class_rank'),
+    (Score, 'subject_rank'), (ImportJob, 'worker'),
+]
+
+@setup.command("upgrade-schema")
+def upgrade_schema():
+    """
+    把旧版本创建的数据库升级到当前结构（可重复执行）：创建缺失的表、列和索引，
+    再重建冗余总分、名次和姓名搜索索引。用 Flask-Migrate 管理表结构的数据库请使用 'flask db upgrade'。
+    """
+    engine = db.engine
+    preparer = engine.dialect.identifier_preparer
+    inspector = db.inspect(engine)
+    changes = 0
+    try:
+        # 只操作主库，与 init-db 相同
+        new_tables = [table for table in db.metadata.sorted_tables if not inspector.has_table(table.name)]
+        db.metadata.create_all(engine, tables=new_tables) # 连同表上的索引一起创建
+        for table in new_tables:
+            click.echo(f"已创建表 {table.name}")
+        changes += len(new_tables)
+
+        with engine.begin() as connection:
+            for model, column_name in UPGRADE_COLUMNS:
+                table = model.__table__
+                if table in new_tables:
+                    continue
+                if column_name in {column['name'] for column in inspector.get_columns(table.name)}:
+                    continue
+                column_ddl = CreateColumn(table.c[column_name]).compile(dialect=engine.dialect)
+                connection.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {column_ddl}"))
+                click.echo(f"已添加列 {table.name}.{column_name}")
+                changes += 1
+
+        for index in missing_indexes(db.inspect(engine)): # 重新检查：上面可能刚添加了索引用到的列
+            index.create(bind=engine, checkfirst=True)
+            click.echo(f"已创建索引 {index.name} ON {index.table.name} ({', '.join(col.name for col in index.columns)})")
+            changes += 1
+    except Exception as e:
+        click.echo(f"升级表结构时出错: {e}", err=True)
+        raise SystemExit(1)
+    click.echo("表结构已是最新。" if not changes else f"表结构升级完成，共 {changes} 处修改。")
+
+    try:
+        refresh_student_totals()
+        rebuild_rankings()
+        rebuild_name_tokens()
+        db.session.commit()
+        click.echo("已重建冗余总分、名次和姓名搜索索引。")
+    except Exception as e:
+        db.session.rollback()
+        click.echo(f"重建冗余总分、名次和姓名搜索索引时出错: {e}", err=True)
+        raise SystemExit(1)
 
 
 # ─── 启动检查与运行 ───────────────────────────────────────────────────────────────────
-def initialize_database():
+def initialize_database(app):
      """确保数据库和必要的数据存在 (在应用启动时检查)"""
      # This runs *before* the first request, but *after* the app object is created.
      # It's good for initial checks but less ideal for complex setup than CLI commands.
@@ -833,17 +3787,26 @@ def initialize_database():
              # Optionally exit if DB is mandatory for startup
              # exit(1)
 
-        # Ensure default admin exists (moved logic here from original position)
+        try:
+            orphaned = fail_orphaned_import_jobs()
+            if orphaned:
+                print(f"已将 {orphaned} 个执行进程已退出的导入任务标记为失败 (服务重启)。")
+        except Exception as e:
+            print(f"检查未完成的导入任务时出错: {e}")
+            db.session.rollback()
+
+        # 启动检查不创建 admin/admin：只有配置了初始密码时才创建管理员，否则请运行 flask init-db
         try:
             if not User.query.filter_by(username="admin").first():
-                print("未找到管理员 'admin'，正在创建默认管理员 admin/admin...")
-                admin = User(
-                    username="admin",
-                    password=generate_password_hash("admin") # Use same default password
-                )
-                db.session.add(admin)
-                db.session.commit()
-                print("默认管理员创建成功。")
+                admin_password = initial_admin_password()
+                if admin_password:
+                    print("未找到管理员 'admin'，正在用配置的初始密码创建...")
+                    db.session.add(User(username="admin", password=hash_password(admin_password)))
+                    db.session.commit()
+                    print("管理员创建成功。")
+                else:
+                    print("未找到管理员 'admin'：请设置环境变量 INITIAL_ADMIN_PASSWORD (或 config.yaml 中的 "
+                          "app.initial_admin_password) 后重启，或运行 'flask init-db' 创建。")
         except Exception as e:
              print(f"检查或创建默认管理员时出错: {e}")
              db.session.rollback() # Rollback potentially failed commit
@@ -859,18 +3822,53 @@ def initialize_database():
                      added_subjects.append(subj_name)
             if added_subjects:
                  db.session.commit()
+                 invalidate_subjects()
                  print(f"已添加默认科目：{', '.join(added_subjects)}")
         except Exception as e:
              print(f"检查或创建默认科目时出错: {e}")
              db.session.rollback()
 
 
+def warm_up(app):
+    """
+    预热：预先建立数据库连接、载入科目缓存和拼音词典、编译全部模板，
+    使 worker 在接收第一个请求前就处于热状态。失败只记录日志，不影响启动。
+    """
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            connections = []
+            try:
+                for _ in range(app.config['WARMUP_CONNECTIONS']):
+                    connection = db.engine.connect()
+                    connections.append(connection)
+                    connection.execute(select(literal(1)))
+            finally:
+                for connection in connections:
+                    connection.close() # 归还连接池，保持打开
+            get_subjects()
+            name_search_tokens('预热') # 首次调用 pypinyin 时才加载词典
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)
+    except Exception as e:
+        print(f"预热失败 (pid {os.getpid()}): {e}")
+        return
+    print(f"预热完成 (pid {os.getpid()})，用时 {(time.perf_counter() - started) * 1000:.0f}ms")
+
+def dispose_engine(app, close=True):
+    """
+    丢弃连接池中的连接。多进程服务器在 fork 前以 close=True 调用（主进程不再持有连接），
+    fork 后在子进程中以 close=False 调用：继承来的连接只丢弃不关闭，以免影响其他进程，子进程按需重建。
+    """
+    with app.app_context():
+        db.engine.dispose(close=close)
+
+
 if __name__ == '__main__':
     # Initialize database schema and default data CHECK before running
     # initialize_database() # Call the check function
     # Use flask run instead of app.run for development
     pass # Standard practice is to use `flask run` command
 else:
-     # Perform initialization checks when imported (e.g., by Gunicorn/uWSGI)
-     # initialize_database() # Uncomment if needed for production deployment initialization
+     # WSGI 服务器请使用 wsgi.py（创建应用并完成启动检查和预热）
      pass
\ No newline at end of file
@@ -0,0 +1,335 @@
+"""
+基准测试：生成一所虚拟学校的数据（临时 SQLite 数据库），用 Flask 测试客户端反复请求热点页面，
+输出各场景的耗时百分位、SQL 条数和内存峰值（JSON），并可与保存的基线比较。
+
+    python bench.py                                   # 默认规模，结果写入 bench_result.json
+    python bench.py --students 50000 --subjects 20    # 调整数据规模
+    python bench.py --baseline baseline.json          # 与基线比较，有回退时以非零状态退出
+
+不会触碰 config.yaml 中配置的数据库：运行时切换到临时目录，并通过 DATABASE_URL 指向临时数据库。
+"""
+import argparse
+import csv
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try: # 仅类 Unix 系统可用，用于报告进程最大常驻内存
+    import resource
+except ImportError:
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈"
+GIVEN_CHARS = "伟芳娜秀英敏静丽强磊军洋勇艳杰娟涛明超秀兰霞平刚桂英华玉萍红娥玲芬燕彬鹏辉晨宇浩然子涵欣怡梓轩雨"
+CORE_SUBJECTS = ["语文", "数学", "英语", "物理", "化学", "生物", "历史", "地理", "政治"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="学生成绩管理系统基准测试")
+    parser.add_argument('--students', type=int, default=20000, help='学生数 (默认 20000)')
+    parser.add_argument('--classes', type=int, default=40, help='班级数 (默认 40)')
+    parser.add_argument('--subjects', type=int, default=9, help='科目数 (默认 9)')
+    parser.add_argument('--requests', type=int, default=30, help='每个场景计时的请求数；导出/导入等重场景为其 1/10 (至少 3)')
+    parser.add_argument('--warmup', type=int, default=2, help='每个场景计时前的预热请求数')
+    parser.add_argument('--import-rows', type=int, default=1000, help='导入场景每次上传的 CSV 行数')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子，相同参数生成相同数据')
+    parser.add_argument('--fragment-cache', action='store_true',
+                        help='所有列表场景都启用页面片段缓存（默认只在 list_default_cached 中启用，其余场景测的是真实查询）')
+    parser.add_argument('--only', default='', help='只运行这些场景 (逗号分隔)')
+    parser.add_argument('--output', default='bench_result.json', help='结果 JSON 文件 (默认 bench_result.json)')
+    parser.add_argument('--baseline', help='与此基线结果比较')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='p50 耗时允许的回退比例 (默认 0.2 即 20%%)')
+    parser.add_argument('--keep-db', action='store_true', help='保留生成的临时数据库并输出其路径')
+    return parser.parse_args()
+
+
+def percentile(sorted_values, q):
+    """线性插值百分位数（与统计页的算法一致）"""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * q
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (pos - lower)
+
+
+class Bench:
+    def __init__(self, args, workdir):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        # 在创建应用之前设置：数据库、config.yaml 和上传目录都放在临时目录中
+        os.chdir(workdir)
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        sys.path.insert(0, REPO_DIR)
+        import app as app_module
+        self.m = app_module
+        self.app, self.db = app_module.create_app(), app_module.db
+        self.app.config.update({
+            'IMPORT_ASYNC': False, # 导入在请求内完成，耗时才可比较
+            'PROFILING_ENABLED': False,
+            # 同一 URL 反复请求时，预热之后每次都会命中片段缓存（只剩一条查询），测不出列表查询本身的回退；
+            # 缓存命中单独由 list_default_cached 场景衡量
+            'LIST_FRAGMENT_CACHE': args.fragment_cache,
+        })
+        self.query_count = 0
+        self.fragment_hits = 0
+        get_fragment = app_module.fragment_cache.get_fragment
+        def counting_get_fragment(version, key):
+            html = get_fragment(version, key)
+            if html is not None:
+                self.fragment_hits += 1
+            return html
+        app_module.fragment_cache.get_fragment = counting_get_fragment
+
+    # --- 生成数据 ---
+    def random_name(self):
+        return self.rng.choice(SURNAMES) + ''.join(self.rng.choice(GIVEN_CHARS) for _ in range(self.rng.choice((1, 2))))
+
+    def random_score(self, class_mean):
+        return round(min(100.0, max(0.0, self.rng.gauss(class_mean, 12))) * 2) / 2 # 0.5 分精度
+
+    def seed(self):
+        args, m, db = self.args, self.m, self.db
+        started = time.perf_counter()
+        subject_names = (CORE_SUBJECTS + [f"选修{i}" for i in range(1, args.subjects)])[:args.subjects]
+        self.class_names = [f"{i}班" for i in range(1, args.classes + 1)]
+        class_means = {name: self.rng.uniform(60, 85) for name in self.class_names}
+        with self.app.app_context():
+            db.drop_all()
+            db.create_all()
+            m.cache.clear()
+            db.session.add(m.User(username='admin', password=m.generate_password_hash('admin')))
+            db.session.add_all([m.Subject(name=name) for name in subject_names])
+            db.session.commit()
+            self.subject_ids = [sid for (sid,) in db.session.query(m.Subject.id).order_by(m.Subject.id)]
+
+            student_rows = [{'name': self.random_name(), 'class_name': self.rng.choice(self.class_names)}
+                            for _ in range(args.students)]
+            for chunk in m.chunked(student_rows, 5000):
+                db.session.execute(m.insert(m.Student), chunk)
+            students = db.session.query(m.Student.id, m.Student.class_name).order_by(m.Student.id).all()
+            self.student_ids = [sid for sid, _ in students]
+            score_rows = [{'student_id': sid, 'subject_id': subject_id, 'score': self.random_score(class_means[class_name])}
+                          for sid, class_name in students for subject_id in self.subject_ids
+                          if self.rng.random() > 0.05] # 约 5% 缺考
+            for chunk in m.chunked(score_rows, 5000):
+                db.session.execute(m.insert(m.Score), chunk)
+            m.refresh_student_totals()
+            m.refresh_name_tokens(self.student_ids)
+            m.rebuild_rankings()
+            db.session.commit()
+        self.search_fragments = sorted({self.random_name()[:2] for _ in range(50)})
+        return {'seconds': round(time.perf_counter() - started, 2), 'students': len(student_rows),
+                'scores': len(score_rows), 'classes': len(self.class_names), 'subjects': len(subject_names)}
+
+    # --- 场景 ---
+    def csv_upload(self):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(['姓名', '班级'] + self.subject_names())
+        for _ in range(self.args.import_rows):
+            writer.writerow([self.random_name(), self.rng.choice(self.class_names)]
+                            + [self.random_score(75) for _ in self.subject_ids])
+        return io.BytesIO(out.getvalue().encode('utf-8'))
+
+    def subject_names(self):
+        with self.app.app_context():
+            return [subject.name for subject in self.m.get_subjects()]
+
+    def edit_form(self):
+        student_id = self.rng.choice(self.student_ids)
+        form = {'name': self.random_name(), 'class_name': self.rng.choice(self.class_names)}
+        for subject_id in self.subject_ids:
+            form[f'score_{subject_id}'] = str(self.random_score(75)) if self.rng.random() > 0.05 else ''
+        return {'path': f'/student/edit/{student_id}', 'data': form}
+
+    def grade_form(self):
+        class_name, subject_id = self.rng.choice(self.class_names), self.rng.choice(self.subject_ids)
+        with self.app.app_context():
+            rows = self.m.load_grade_grid(class_name, subject_id)
+        form = {'class_name': class_name, 'subject_id': str(subject_id)}
+        for student_id, _, _, score in self.rng.sample(rows, min(10, len(rows))): # 每次修改约 10 格
+            form[f'orig_{student_id}'] = '%g' % score if score is not None else ''
+            form[f'score_{student_id}'] = str(self.random_score(75))
+        return form
+
+    def scenarios(self, client):
+        """(名称, 是否为重场景, 发出一次请求的函数)"""
+        sort_subject = self.subject_ids[0]
+        deep_page = max(1, len(self.student_ids) // 50 // 2) # 默认每页 50 条，取中间一页
+        return [
+            ('list_default', False, lambda: client.get('/students')),
+            ('list_default_cached', False, lambda: self.with_fragment_cache(lambda: client.get('/students'))),
+            ('list_sort_total', False, lambda: client.get('/students?sort_by_total=true&sort_by_visual=total')),
+            ('list_sort_subject', False, lambda: client.get(
+                f'/students?sort_by_subject={sort_subject}&sort_by_visual=subject_{sort_subject}')),
+            ('list_deep_page', False, lambda: client.get(f'/students?sort_by_total=true&page={deep_page}')),
+            ('list_search_name', False, lambda: client.get(
+                '/students', query_string={'search_name': self.rng.choice(self.search_fragments)})),
+            ('list_class_top', False, lambda: client.get(
+                '/students', query_string={'class_name': self.rng.choice(self.class_names), 'top': 10})),
+            ('api_students', False, lambda: client.get('/api/v1/students?limit=500&sort=total')),
+            ('edit_student', False, lambda: client.post(**self.edit_form())),
+            ('grade_grid_save', False, lambda: client.post('/grades', data=self.grade_form())),
+            ('stats', True, lambda: client.get('/stats')),
+            ('export', True, lambda: client.get('/export')),
+            ('import_csv', True, lambda: client.post('/import', content_type='multipart/form-data', data={
+                'file': (self.csv_upload(), 'bench.csv'), 'mode': 'append'})),
+        ]
+
+    def with_fragment_cache(self, call):
+        """在启用页面片段缓存的情况下发出一次请求"""
+        enabled = self.app.config['LIST_FRAGMENT_CACHE']
+        self.app.config['LIST_FRAGMENT_CACHE'] = True
+        try:
+            return call()
+        finally:
+            self.app.config['LIST_FRAGMENT_CACHE'] = enabled
+
+    def run(self):
+        from sqlalchemy import event
+        with self.app.app_context():
+            event.listen(self.db.engine, 'before_cursor_execute', self._count_query)
+        client = self.app.test_client()
+        response = client.post('/login', data={'username': 'admin', 'password': 'admin'})
+        assert response.status_code == 302, "登录失败"
+        only = {name for name in self.args.only.split(',') if name}
+        results = {}
+        for name, heavy, call in self.scenarios(client):
+            if only and name not in only:
+                continue
+            n = max(3, self.args.requests // 10) if heavy else self.args.requests
+            results[name] = self.measure(name, call, n)
+            print(f"  {name:<20} p50={results[name]['p50_ms']:>9.2f}ms  p90={results[name]['p90_ms']:>9.2f}ms  "
+                  f"queries={results[name]['queries']:>6.1f}  peak={results[name]['peak_kb']:>8.0f}KB"
+                  + (f"  cache_hits={results[name]['fragment_hits']}" if results[name]['fragment_hits'] else ''), flush=True)
+        return results
+
+    def _count_query(self, *args):
+        self.query_count += 1
+
+    def request(self, call):
+        response = call()
+        response.get_data() # 流式响应（导出）在读取正文时才真正执行
+        if response.status_code >= 400:
+            raise RuntimeError(f"请求失败：{response.status_code} {response.get_data(as_text=True)[:500]}")
+        return response
+
+    def measure(self, name, call, n):
+        for _ in range(self.args.warmup):
+            self.request(call)
+        timings, queries = [], []
+        hits_before = self.fragment_hits
+        for _ in range(n):
+            before = self.query_count
+            started = time.perf_counter()
+            self.request(call)
+            timings.append((time.perf_counter() - started) * 1000)
+            queries.append(self.query_count - before)
+        # 内存峰值单独跑一次：tracemalloc 会明显拖慢执行，不能与计时混在一起
+        fragment_hits = self.fragment_hits - hits_before
+        tracemalloc.start()
+        try:
+            self.request(call)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        timings.sort()
+        return {
+            'requests': n,
+            'min_ms': round(timings[0], 3),
+            'p50_ms': round(percentile(timings, 0.5), 3),
+            'p90_ms': round(percentile(timings, 0.9), 3),
+            'p99_ms': round(percentile(timings, 0.99), 3),
+            'max_ms': round(timings[-1], 3),
+            'mean_ms': round(statistics.mean(timings), 3),
+            'queries': round(statistics.mean(queries), 1),
+            'peak_kb': round(peak / 1024, 1),
+            'fragment_hits': fragment_hits, # 计时请求中命中页面片段缓存的次数
+        }
+
+
+def compare(results, baseline, tolerance):
+    """与基线比较 p50 耗时和平均 SQL 条数，返回回退的场景列表"""
+    regressions = []
+    print(f"\n与基线比较 (允许 p50 回退 {tolerance:.0%})：")
+    for name, current in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            print(f"  {name:<20} (基线中没有此场景)")
+            continue
+        ratio = current['p50_ms'] / base['p50_ms'] if base['p50_ms'] else 1.0
+        # 不足 1ms 的差异视为噪声
+        slower = ratio > 1 + tolerance and current['p50_ms'] - base['p50_ms'] > 1.0
+        more_queries = current['queries'] > base['queries']
+        flag = ' <-- 回退' if slower or more_queries else ''
+        print(f"  {name:<20} p50 {base['p50_ms']:>9.2f} -> {current['p50_ms']:>9.2f}ms ({ratio:>5.2f}x)  "
+              f"queries {base['queries']:>6.1f} -> {current['queries']:>6.1f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    args = parse_args()
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = tempfile.mkdtemp(prefix='student_bench_')
+    bench = Bench(args, workdir)
+
+    print(f"生成数据：{args.students} 名学生，{args.classes} 个班级，{args.subjects} 个科目 ...", flush=True)
+    seed_info = bench.seed()
+    print(f"  完成，用时 {seed_info['seconds']}s ({seed_info['scores']} 条成绩)")
+    print("运行场景：", flush=True)
+    scenario_results = bench.run()
+
+    from importlib.metadata import version
+    results = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'flask': version('flask'),
+            'sqlalchemy': version('sqlalchemy'),
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        },
+        'seed': seed_info,
+        'scenarios': scenario_results,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入 {output}")
+
+    if args.keep_db:
+        print(f"数据库保留在 {os.path.join(workdir, 'bench.db')}")
+    else:
+        with bench.app.app_context():
+            bench.db.engine.dispose()
+        import shutil
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('args', {}).get('students') != args.students:
+            print("警告：基线的数据规模与本次不同，比较结果仅供参考。")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} 个场景出现回退：{', '.join(regressions)}")
+            sys.exit(1)
+        print("\n没有发现回退。")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""
+gunicorn 配置：gunicorn -c gunicorn.conf.py wsgi:application
+
+可用环境变量覆盖：BIND、WEB_CONCURRENCY (worker 进程数)、GUNICORN_THREADS (每个 worker 的线程数)。
+数据库连接总数上限约为 worker 数 × (pool_size + max_overflow)，请与数据库的最大连接数相匹配。
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+timeout = 120 # 同步导入较大的 CSV 时可能超过默认的 30 秒
+
+# 在主进程中只加载一次应用：config.yaml 只读取一次（首次运行时生成的 secret_key 对所有 worker 一致），
+# 启动检查只执行一次，模板和拼音词典在 fork 前载入，worker 以写时复制方式共享
+preload_app = True
+
+
+def pre_fork(server, worker):
+    # 主进程预热时建立的连接不能被多个子进程共用：fork 前关闭
+    from app import dispose_engine
+    from wsgi import application
+    dispose_engine(application, close=True)
+
+
+def post_fork(server, worker):
+    # 保险起见丢弃可能继承的连接（不关闭），再为本 worker 建立连接、载入缓存
+    from app import dispose_engine, warm_up
+    from wsgi import application # preload_app：主进程中已加载，fork 后直接取到同一个应用
+    dispose_engine(application, close=False)
+    warm_up(application)
@@ -0,0 +1,94 @@
+"""
+测试夹具：每个测试用 create_app() 创建新的应用，使用内存 SQLite（Flask-SQLAlchemy 对内存库使用 StaticPool，
+所有连接共享同一个库），缓存与限流计数也随应用重新创建。
+"""
+import os
+import random
+import sys
+import tempfile
+
+import pytest
+
+# create_app() 读取当前目录的 config.yaml（不存在时创建）并在当前目录下创建上传目录：配置写在临时目录中，创建应用时切换过去
+CONFIG_DIR = tempfile.mkdtemp(prefix='student_tests_')
+with open(os.path.join(CONFIG_DIR, 'config.yaml'), 'w', encoding='utf-8') as f:
+    f.write("app:\n  secret_key: test\n  debug: false\ndatabase:\n  url: 'sqlite://'\n")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app as app_module
+
+from sqlalchemy import func, insert
+
+SUBJECTS = ['语文', '数学', '英语']
+CLASSES = ['1班', '2班', '3班']
+
+
+@pytest.fixture
+def app(monkeypatch):
+    with monkeypatch.context() as patch:
+        patch.chdir(CONFIG_DIR)
+        flask_app = app_module.create_app()
+    db = app_module.db
+    flask_app.config.update({
+        'TESTING': True,
+        'IMPORT_ASYNC': False, # 导入在请求内完成
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000', # 测试中不需要慢哈希
+    })
+    app_module.verified_credentials.clear()
+    with flask_app.app_context():
+        db.create_all()
+        db.session.add(app_module.User(username='admin', password=app_module.hash_password('admin')))
+        db.session.add_all([app_module.Subject(name=name) for name in SUBJECTS])
+        db.session.commit()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    """已登录为 admin 的测试客户端"""
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    assert response.status_code == 302
+    client.get(response.location) # 显示并取走“登录成功”的 flash 消息
+    return client
+
+
+@pytest.fixture
+def subject_ids(app):
+    with app.app_context():
+        return [subject.id for subject in app_module.get_subjects()]
+
+
+@pytest.fixture
+def school(app, subject_ids):
+    """
+    直接写入数据库生成一批学生（分数取值范围很小，总分和单科都有大量并列），并刷新冗余总分、重建名次。
+    返回生成函数：school(n, seed=0) -> 学生 ID 列表。
+    """
+    def make(n, seed=0):
+        rng = random.Random(seed)
+        db = app_module.db
+        with app.app_context():
+            students = [{'name': f'学生{i}', 'class_name': rng.choice(CLASSES)} for i in range(n)]
+            db.session.execute(insert(app_module.Student), students)
+            student_ids = [sid for (sid,) in db.session.query(app_module.Student.id).order_by(app_module.Student.id)]
+            scores = [{'student_id': sid, 'subject_id': subject_id, 'score': rng.choice((60, 70, 80, 90))}
+                      for sid in student_ids for subject_id in subject_ids if rng.random() > 0.2]
+            db.session.execute(insert(app_module.Score), scores)
+            app_module.refresh_student_totals()
+            app_module.rebuild_rankings()
+            db.session.commit()
+            return student_ids
+    return make
+
+
+def assert_consistent():
+    """冗余的总分/成绩条数与成绩表一致，物化名次与 RANK() 全量重算的结果一致（需在应用上下文中调用）"""
+    Student, Score, db = app_module.Student, app_module.Score, app_module.db
+    sums = dict(db.session.query(Score.student_id, func.coalesce(func.sum(Score.score), 0)).group_by(Score.student_id))
+    counts = dict(db.session.query(Score.student_id, func.count(Score.id)).group_by(Score.student_id))
+    for sid, total, count in db.session.query(Student.id, Student.total_score, Student.score_count):
+        assert (total, count) == (pytest.approx(sums.get(sid, 0.0)), counts.get(sid, 0)), f"student {sid}"
+    assert app_module.count_rank_mismatches() == {'overall': 0, 'class': 0, 'subject': 0}
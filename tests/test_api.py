@@ -0,0 +1,79 @@
+"""JSON API：单个学生读取、批量增删改，校验失败时整批不写入"""
+import base64
+
+import app as app_module
+
+
+def basic_auth(username, password):
+    return {'Authorization': 'Basic ' + base64.b64encode(f'{username}:{password}'.encode()).decode()}
+
+
+def test_requires_authentication(app):
+    client = app.test_client()
+    assert client.get('/api/v1/students').status_code == 401
+    assert client.get('/api/v1/subjects', headers=basic_auth('admin', 'admin')).status_code == 200
+    assert client.get('/api/v1/subjects', headers=basic_auth('admin', 'wrong')).status_code == 401
+
+
+def test_student_crud(client, subject_ids):
+    created = client.post('/api/v1/students', json={'students': [
+        {'name': '张三', 'class_name': '1班', 'scores': {str(subject_ids[0]): 80, str(subject_ids[1]): 90}},
+        {'name': '李四', 'class_name': '1班', 'scores': {str(subject_ids[0]): 85}},
+    ]})
+    assert created.status_code == 201
+    zhang, li = created.json['created']
+
+    student = client.get(f'/api/v1/students/{zhang}').json
+    assert (student['name'], student['total_score'], student['overall_rank'], student['class_rank']) == ('张三', 170, 1, 1)
+    assert student['scores'] == {str(subject_ids[0]): 80, str(subject_ids[1]): 90}
+    assert client.get(f'/api/v1/students/{li}?fields=id,name').json == {'id': li, 'name': '李四'}
+
+    assert client.patch('/api/v1/students', json={'students': [
+        {'id': zhang, 'scores': {str(subject_ids[1]): None}}, # null 删除该科成绩
+        {'id': li, 'name': '李四四', 'class_name': '2班'},
+    ]}).json == {'updated': 2}
+    student = client.get(f'/api/v1/students/{zhang}').json
+    assert (student['total_score'], student['overall_rank']) == (80, 2)
+    assert client.get(f'/api/v1/students/{li}').json['class_name'] == '2班'
+    assert client.get('/api/v1/students?search_name=四四&fields=id').json['items'] == [{'id': li}]
+
+    assert client.put('/api/v1/scores', json={'scores': [
+        {'student_id': zhang, 'subject_id': subject_ids[2], 'score': 10}]}).json == {'written': 1}
+    assert client.get(f'/api/v1/students/{zhang}').json['total_score'] == 90
+    assert client.delete('/api/v1/scores', json={'scores': [
+        {'student_id': zhang, 'subject_id': subject_ids[2]}]}).json == {'deleted': 1}
+
+    assert client.delete('/api/v1/students', json={'ids': [zhang]}).json == {'deleted': 1}
+    assert client.get(f'/api/v1/students/{zhang}').status_code == 404
+    assert client.get(f'/api/v1/students/{li}').json['overall_rank'] == 1
+
+
+def test_batch_is_all_or_nothing(app, client, subject_ids):
+    response = client.post('/api/v1/students', json={'students': [
+        {'name': '张三', 'class_name': '1班'},
+        {'name': '', 'class_name': '1班'},
+        {'name': '王五', 'class_name': '1班', 'scores': {str(subject_ids[0]): -1}},
+    ]})
+    assert response.status_code == 400
+    assert sorted(detail['index'] for detail in response.json['details']) == [1, 2]
+    with app.app_context():
+        assert app_module.Student.query.count() == 0
+
+    created = client.post('/api/v1/students', json={'students': [{'name': '张三', 'class_name': '1班'}]}).json['created']
+    response = client.patch('/api/v1/students', json={'students': [
+        {'id': created[0], 'name': '改名'}, {'id': 999999, 'name': '不存在'}]})
+    assert response.status_code == 400
+    assert client.get(f'/api/v1/students/{created[0]}').json['name'] == '张三'
+
+    response = client.delete('/api/v1/students', json={'ids': [created[0], 999999]})
+    assert response.status_code == 404
+    assert client.get(f'/api/v1/students/{created[0]}').status_code == 200
+
+
+def test_batch_size_limit(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'API_BATCH_MAX', 2)
+    response = client.post('/api/v1/students', json={'students': [
+        {'name': f'学生{i}', 'class_name': '1班'} for i in range(3)]})
+    assert response.status_code == 400
+    with app.app_context():
+        assert app_module.Student.query.count() == 0
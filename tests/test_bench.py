@@ -0,0 +1,31 @@
+"""bench.py 小规模跑通：输出结果 JSON，与 SQL 条数更少的基线比较时以非零状态退出"""
+import json
+import os
+import subprocess
+import sys
+
+BENCH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench.py')
+SMALL = ['--students', '60', '--classes', '3', '--subjects', '3', '--requests', '3', '--warmup', '0',
+         '--import-rows', '5']
+
+
+def run_bench(tmp_path, *extra):
+    env = {key: value for key, value in os.environ.items() if key != 'DATABASE_URL'}
+    return subprocess.run([sys.executable, BENCH, *SMALL, *extra], cwd=tmp_path, env=env,
+                          capture_output=True, text=True, timeout=120)
+
+
+def test_bench_writes_results_and_detects_regressions(tmp_path):
+    done = run_bench(tmp_path, '--output', 'base.json')
+    assert done.returncode == 0, done.stderr
+    assert not (tmp_path / 'config.yaml').exists() # 在自己的临时目录中运行，不碰当前目录的配置和数据库
+    results = json.loads((tmp_path / 'base.json').read_text(encoding='utf-8'))
+    assert {'list_default', 'list_default_cached', 'import_csv'} <= set(results['scenarios'])
+    assert results['scenarios']['list_default_cached']['fragment_hits'] > 0
+    assert results['scenarios']['list_default']['fragment_hits'] == 0
+
+    results['scenarios']['list_default']['queries'] -= 1
+    (tmp_path / 'base.json').write_text(json.dumps(results), encoding='utf-8')
+    done = run_bench(tmp_path, '--output', 'new.json', '--baseline', 'base.json', '--only', 'list_default')
+    assert done.returncode == 1
+    assert 'list_default' in done.stdout.splitlines()[-1]
@@ -0,0 +1,28 @@
+"""科目列表与登录用户的缓存：修改提交后立即失效"""
+import app as app_module
+
+
+def subject_names(app):
+    with app.app_context():
+        return [subject.name for subject in app_module.get_subjects()]
+
+
+def test_subject_changes_invalidate_cache(app, client, subject_ids):
+    assert subject_names(app) == ['语文', '数学', '英语']
+    assert client.post('/subject/add', data={'name': '物理'}).status_code == 302
+    assert subject_names(app) == ['语文', '数学', '英语', '物理']
+    assert client.post(f'/subject/edit/{subject_ids[0]}', data={'name': '国文'}).status_code == 302
+    assert subject_names(app)[0] == '国文'
+    assert client.post(f'/subject/delete/{subject_ids[1]}').status_code == 302
+    assert subject_names(app) == ['国文', '英语', '物理']
+    assert '国文' in client.get('/students').get_data(as_text=True)
+
+
+def test_password_change_takes_effect(app, client):
+    client.get('/students') # 登录用户已进入缓存
+    response = client.post('/change_password', data={'old_password': 'admin', 'new_password': 'secret',
+                                                     'confirm_password': 'secret'})
+    assert response.status_code == 302
+    client.get('/logout')
+    assert client.post('/login', data={'username': 'admin', 'password': 'admin'}).status_code == 200
+    assert client.post('/login', data={'username': 'admin', 'password': 'secret'}).status_code == 302
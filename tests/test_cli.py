@@ -0,0 +1,62 @@
+"""命令行维护命令"""
+from sqlalchemy import text
+
+import app as app_module
+from conftest import assert_consistent
+
+
+def test_db_audit_reports_and_creates_missing_indexes(app):
+    index = next(ix for ix in app_module.Score.__table__.indexes)
+    with app.app_context():
+        app_module.db.session.execute(text(f'DROP INDEX {index.name}'))
+        app_module.db.session.commit()
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['db-audit'])
+    assert result.exit_code == 0
+    assert f'缺少索引 {index.name}' in result.output
+
+    result = runner.invoke(args=['db-audit', '--create-indexes'])
+    assert f'已创建索引 {index.name}' in result.output
+    result = runner.invoke(args=['db-audit'])
+    assert '模型中声明的索引均已存在' in result.output
+
+
+LEGACY_SCHEMA = [
+    'CREATE TABLE user (id INTEGER PRIMARY KEY, username VARCHAR(80) NOT NULL UNIQUE, password TEXT NOT NULL)',
+    'CREATE TABLE subject (id INTEGER PRIMARY KEY, name VARCHAR(50) NOT NULL UNIQUE)',
+    'CREATE TABLE student (id INTEGER PRIMARY KEY, name VARCHAR(80) NOT NULL, class_name VARCHAR(50) NOT NULL)',
+    'CREATE TABLE score (id INTEGER PRIMARY KEY, score FLOAT NOT NULL,'
+    ' student_id INTEGER NOT NULL REFERENCES student (id) ON DELETE CASCADE,'
+    ' subject_id INTEGER NOT NULL REFERENCES subject (id) ON DELETE CASCADE,'
+    ' CONSTRAINT _student_subject_uc UNIQUE (student_id, subject_id))',
+    "INSERT INTO subject (id, name) VALUES (1, '语文'), (2, '数学')",
+    "INSERT INTO student (id, name, class_name) VALUES (1, '张三', '1班'), (2, '李四', '1班'), (3, '王五', '2班')",
+    'INSERT INTO score (score, student_id, subject_id) VALUES (90, 1, 1), (80, 1, 2), (95, 2, 1), (70, 3, 2)',
+]
+
+
+def test_upgrade_schema_upgrades_a_legacy_database(app):
+    db = app_module.db
+    with app.app_context():
+        db.drop_all()
+        with db.engine.begin() as connection:
+            for statement in LEGACY_SCHEMA:
+                connection.execute(text(statement))
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['upgrade-schema'])
+    assert result.exit_code == 0, result.output
+    assert '已添加列 student.total_score' in result.output
+    assert '已创建表 import_job' in result.output
+
+    result = runner.invoke(args=['upgrade-schema']) # 可重复执行
+    assert result.exit_code == 0, result.output
+    assert '表结构已是最新' in result.output
+    assert '模型中声明的索引均已存在' in runner.invoke(args=['db-audit']).output
+
+    with app.app_context():
+        assert_consistent()
+        zhang = db.session.get(app_module.Student, 1)
+        assert (zhang.total_score, zhang.overall_rank, zhang.class_rank) == (170, 1, 1)
+        assert app_module.Student.query.filter(app_module.name_search_condition('张')).all() == [zhang]
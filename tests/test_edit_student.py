@@ -0,0 +1,34 @@
+"""编辑学生：成绩在内存中比较后批量写入，提示中概括变更内容"""
+import app as app_module
+from conftest import assert_consistent
+
+
+def test_edit_applies_diff_and_summarizes_it(app, client, subject_ids):
+    chinese, math, english = subject_ids
+    assert client.post('/student/add', data={'name': '张三', 'class_name': '1班', f'score_{chinese}': '80',
+                                             f'score_{math}': '70'}).status_code == 302
+    with app.app_context():
+        student_id = app_module.Student.query.one().id
+
+    response = client.post(f'/student/edit/{student_id}', data={
+        'name': '张三', 'class_name': '1班', f'score_{chinese}': '80', f'score_{math}': '', f'score_{english}': '95'},
+        follow_redirects=True)
+    body = response.get_data(as_text=True)
+    assert '成绩变更：新增 英语；删除 数学。' in body
+
+    response = client.post(f'/student/edit/{student_id}', data={
+        'name': '张三', 'class_name': '1班', f'score_{chinese}': '85', f'score_{english}': '95'}, follow_redirects=True)
+    assert '成绩变更：修改 语文 (80.0 → 85.0)。' in response.get_data(as_text=True)
+
+    with app.app_context():
+        assert app_module.build_score_matrix([student_id])[student_id] == {chinese: 85, english: 95}
+        assert_consistent()
+
+
+def test_unchanged_scores(app, client, subject_ids):
+    form = {'name': '李四', 'class_name': '2班', f'score_{subject_ids[0]}': '60'}
+    client.post('/student/add', data=form)
+    with app.app_context():
+        student_id = app_module.Student.query.one().id
+    response = client.post(f'/student/edit/{student_id}', data=form, follow_redirects=True)
+    assert '成绩无变化。' in response.get_data(as_text=True)
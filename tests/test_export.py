@@ -0,0 +1,51 @@
+"""导出：xlsx / parquet / arrow 与流式 CSV 的内容一致；缺少可选库时提示而不是报错"""
+import csv
+import io
+
+import pytest
+
+import app as app_module
+
+
+def as_rows(header, rows):
+    """统一为 (表头, [(ID, 姓名, 班级, 分数...)])，分数统一为 float，空值为 None"""
+    def value(cell):
+        return None if cell in (None, '') else float(cell)
+    return list(header), [(int(row[0]), row[1], row[2], *map(value, row[3:])) for row in rows]
+
+
+def read_export(client, fmt):
+    response = client.get(f'/export?format={fmt}')
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'].endswith(f'.{fmt}')
+    data = response.get_data()
+    if fmt == 'csv':
+        header, *rows = csv.reader(io.StringIO(data.decode('utf-8-sig')))
+        return as_rows(header, rows)
+    if fmt == 'xlsx':
+        openpyxl = pytest.importorskip('openpyxl')
+        header, *rows = openpyxl.load_workbook(io.BytesIO(data)).active.iter_rows(values_only=True)
+        return as_rows(header, rows)
+    pyarrow = pytest.importorskip('pyarrow')
+    if fmt == 'parquet':
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(io.BytesIO(data))
+    else:
+        table = pyarrow.ipc.open_file(pyarrow.BufferReader(data)).read_all()
+    return as_rows(table.column_names, zip(*table.to_pydict().values()))
+
+
+@pytest.mark.parametrize('fmt', ['xlsx', 'parquet', 'arrow'])
+def test_formats_match_csv(client, school, fmt):
+    school(30)
+    expected = read_export(client, 'csv')
+    assert len(expected[1]) == 30 and any(None in row for row in expected[1])
+    assert read_export(client, fmt) == expected
+
+
+def test_unknown_or_unavailable_format(client, monkeypatch):
+    response = client.get('/export?format=pdf', follow_redirects=True)
+    assert '不支持的导出格式' in response.get_data(as_text=True)
+    monkeypatch.setattr(app_module, 'openpyxl', None)
+    response = client.get('/export?format=xlsx', follow_redirects=True)
+    assert '需要安装 openpyxl' in response.get_data(as_text=True)
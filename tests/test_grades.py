@@ -0,0 +1,44 @@
+"""成绩录入表格：只提交修改过的单元格，任何单元格无效时整批不保存"""
+import app as app_module
+from conftest import assert_consistent
+
+
+def grid_form(app, class_name, subject_id, changes):
+    """按页面的方式构造表单：每个学生带原值，changes 为 {学生 ID: 新值}"""
+    with app.app_context():
+        rows = app_module.load_grade_grid(class_name, subject_id)
+    form = {'class_name': class_name, 'subject_id': subject_id}
+    for student_id, _, _, score in rows:
+        form[f'orig_{student_id}'] = '' if score is None else f'{score:g}'
+        form[f'score_{student_id}'] = changes.get(student_id, form[f'orig_{student_id}'])
+    return form
+
+
+def scores(app, student_ids, subject_id):
+    with app.app_context():
+        matrix = app_module.build_score_matrix(student_ids)
+        return [matrix[sid].get(subject_id) for sid in student_ids]
+
+
+def test_save_changed_cells(app, client, subject_ids):
+    for name in ('甲', '乙', '丙'):
+        client.post('/student/add', data={'name': name, 'class_name': '1班', f'score_{subject_ids[0]}': '60'})
+    with app.app_context():
+        student_ids = [s.id for s in app_module.Student.query.order_by(app_module.Student.id)]
+    form = grid_form(app, '1班', subject_ids[0], {student_ids[0]: '75', student_ids[1]: ''})
+    response = client.post('/grades', data=form, follow_redirects=True)
+    assert '新增 0 条，修改 1 条，清空 1 条' in response.get_data(as_text=True)
+    assert scores(app, student_ids, subject_ids[0]) == [75, None, 60]
+    with app.app_context():
+        assert_consistent()
+
+
+def test_invalid_cell_saves_nothing(app, client, subject_ids):
+    for name in ('甲', '乙'):
+        client.post('/student/add', data={'name': name, 'class_name': '1班'})
+    with app.app_context():
+        student_ids = [s.id for s in app_module.Student.query.order_by(app_module.Student.id)]
+    form = grid_form(app, '1班', subject_ids[1], {student_ids[0]: '88', student_ids[1]: '-3'})
+    response = client.post('/grades', data=form, follow_redirects=True)
+    assert '未保存任何更改' in response.get_data(as_text=True)
+    assert scores(app, student_ids, subject_ids[1]) == [None, None]
@@ -0,0 +1,68 @@
+"""学生列表与导出的条件请求：数据未变化时返回 304，任何写入之后 ETag 改变"""
+import pytest
+from werkzeug.security import generate_password_hash
+
+import app as app_module
+
+
+@pytest.mark.parametrize('url', ['/students', '/students?sort_by_total=true', '/export'])
+def test_not_modified_until_write(client, school, subject_ids, url):
+    student_ids = school(10)
+    first = client.get(url)
+    first.get_data() # 导出为流式响应，读完正文才结束请求
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+
+    again = client.get(url, headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+    assert again.get_data() == b''
+    assert client.get(url, headers={'If-Modified-Since': first.headers['Last-Modified']}).status_code == 304
+
+    assert client.put('/api/v1/scores', json={'scores': [
+        {'student_id': student_ids[0], 'subject_id': subject_ids[0], 'score': 100}]}).status_code == 200
+    changed = client.get(url, headers={'If-None-Match': etag})
+    changed.get_data()
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_first_page_fragment_cache_reflects_writes(app, client, school):
+    """未筛选列表第一页的片段缓存随数据版本失效，写入后看到的是新数据"""
+    student_ids = school(5)
+    assert '改名后的学生' not in client.get('/students').get_data(as_text=True)
+    assert client.patch('/api/v1/students', json={'students': [
+        {'id': student_ids[0], 'name': '改名后的学生'}]}).status_code == 200
+    assert '改名后的学生' in client.get('/students').get_data(as_text=True)
+
+
+def test_etag_differs_per_user(app, client, school):
+    school(3)
+    with app.app_context():
+        app_module.db.session.add(app_module.User(username='teacher', password=generate_password_hash('pw', 'pbkdf2:sha256:1000')))
+        app_module.db.session.commit()
+    other = app.test_client()
+    assert other.post('/login', data={'username': 'teacher', 'password': 'pw'}).status_code == 302
+    etag = client.get('/students').headers['ETag']
+    assert other.get('/students', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_form_url_with_empty_filters_uses_fragment_cache(client, school, monkeypatch):
+    """搜索表单提交的 URL 带有空的筛选字段，仍视为未筛选的第一页，与不带参数的 URL 共用缓存条目"""
+    school(5)
+    hits = []
+    get_fragment = app_module.fragment_cache.get_fragment
+    def counting_get_fragment(version, key):
+        html = get_fragment(version, key)
+        hits.append(html is not None)
+        return html
+    monkeypatch.setattr(app_module.fragment_cache, 'get_fragment', counting_get_fragment)
+
+    form_url = ('/students?search_name=&search_id=&class_name=&top=&sort_by_visual=id'
+                '&per_page={}&sort_by_subject=&sort_by_total=').format(client.application.config['STUDENTS_PER_PAGE'])
+    first = client.get(form_url).get_data(as_text=True)
+    assert client.get(form_url).get_data(as_text=True) == first
+    assert hits == [False, True]
+    client.get('/students?search_name=学生1&sort_by_total=')
+    assert hits == [False, True] # 有非空筛选条件时不使用缓存
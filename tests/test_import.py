@@ -0,0 +1,154 @@
+"""CSV 导入：仅新增、按 姓名+班级 更新、按 ID 更新；按批写入，无效行整行跳过"""
+import io
+import os
+import socket
+import subprocess
+import sys
+
+import app as app_module
+from conftest import assert_consistent
+
+
+def upload(client, text, mode='append', encoding='utf-8'):
+    response = client.post('/import', data={'file': (io.BytesIO(text.encode(encoding)), 'import.csv'), 'mode': mode},
+                           content_type='multipart/form-data')
+    assert response.status_code == 302
+    return response
+
+
+def students(app):
+    """{(姓名, 班级): {科目名: 分数}}"""
+    with app.app_context():
+        names = {subject.id: subject.name for subject in app_module.get_subjects()}
+        result = {}
+        for student in app_module.Student.query.order_by(app_module.Student.id):
+            scores = app_module.build_score_matrix([student.id]).get(student.id, {})
+            result[student.name, student.class_name] = {names[sid]: score for sid, score in scores.items()}
+        return result
+
+
+def test_append_creates_students_and_skips_invalid_rows(app, client):
+    upload(client, '姓名,班级,语文,数学,未知科目\n张三,1班,80,90,1\n李四,2班,-5,70,1\n,3班,60,60,1\n')
+    assert students(app) == {('张三', '1班'): {'语文': 80, '数学': 90}} # 有负分或缺姓名的行整行跳过
+    upload(client, '姓名,班级,语文\n张三,1班,85\n')
+    with app.app_context():
+        assert app_module.Student.query.count() == 2 # 仅新增模式不匹配已有学生
+        assert_consistent()
+
+
+def test_rows_span_several_batches(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'IMPORT_BATCH_SIZE', 4)
+    rows = ''.join(f'学生{i},{i % 3 + 1}班,{60 + i},{90 - i}\n' for i in range(10))
+    upload(client, '姓名,班级,语文,数学\n' + rows)
+    imported = students(app)
+    assert len(imported) == 10
+    assert imported['学生9', '1班'] == {'语文': 69, '数学': 81} # 新学生 ID 与本批的行一一对应
+    with app.app_context():
+        assert_consistent()
+
+
+def test_encodings(app, client, monkeypatch):
+    """按文件开头检测编码后流式解码；多字节字符跨过检测窗口时也能正确识别"""
+    monkeypatch.setattr(app_module, 'CSV_SNIFF_BYTES', 16)
+    upload(client, '姓名,班级,语文\n张三,1班,80\n', encoding='utf-8-sig')
+    upload(client, '姓名,班级,语文\n李四,2班,70\n', encoding='gbk')
+    assert students(app) == {('张三', '1班'): {'语文': 80}, ('李四', '2班'): {'语文': 70}}
+
+
+def test_upsert_updates_by_name_and_class(app, client):
+    upload(client, '姓名,班级,语文,数学\n张三,1班,80,90\n张三,2班,70,\n', 'append')
+    upload(client, '姓名,班级,数学,英语\n张三,1班,95,60\n王五,3班,,88\n', 'upsert')
+    assert students(app) == {
+        ('张三', '1班'): {'语文': 80, '数学': 95, '英语': 60}, # 文件中没有的科目保持不变
+        ('张三', '2班'): {'语文': 70},
+        ('王五', '3班'): {'英语': 88},
+    }
+    upload(client, '姓名,班级,数学,英语\n张三,1班,95,60\n王五,3班,,88\n', 'upsert')
+    with app.app_context():
+        assert app_module.Student.query.count() == 3 # 重复执行不产生重复学生
+        assert_consistent()
+
+
+def test_upsert_by_id_round_trips_export(app, client):
+    upload(client, '姓名,班级,语文\n张三,1班,80\n', 'append')
+    with app.app_context():
+        student_id = app_module.Student.query.one().id
+    upload(client, f'ID,姓名,班级,语文\n{student_id},张三丰,2班,99\n', 'upsert_id')
+    assert students(app) == {('张三丰', '2班'): {'语文': 99}}
+
+
+def test_upsert_matches_name_and_class_as_a_pair(app, client):
+    upload(client, '姓名,班级,语文\n张三,1班,80\n李四,2班,70\n', 'append')
+    upload(client, '姓名,班级,语文\n张三,2班,60\n李四,1班,50\n', 'upsert') # 姓名和班级各自存在，但组合是新的
+    assert students(app) == {
+        ('张三', '1班'): {'语文': 80},
+        ('李四', '2班'): {'语文': 70},
+        ('张三', '2班'): {'语文': 60},
+        ('李四', '1班'): {'语文': 50},
+    }
+
+
+def test_upsert_matches_in_chunks(app, client, monkeypatch):
+    """姓名和班级的 IN 列表都按块查询；跨块重名时仍匹配 ID 最小的学生"""
+    upload(client, ''.join(['姓名,班级,语文\n'] + [f'学生{i},{i % 7}班,60\n' for i in range(20)] + ['学生0,0班,61\n']))
+    monkeypatch.setattr(app_module, 'SQL_IN_CHUNK_SIZE', 4)
+    upload(client, ''.join(['姓名,班级,数学\n'] + [f'学生{i},{i % 7}班,{i}\n' for i in range(20)]), 'upsert')
+    with app.app_context():
+        assert app_module.Student.query.count() == 21
+        first, duplicate = app_module.Student.query.filter_by(name='学生0').order_by(app_module.Student.id)
+        assert (first.score_count, duplicate.score_count) == (2, 1)
+        assert_consistent()
+
+
+def test_reimporting_export_ignores_total_column(app, client):
+    upload(client, '姓名,班级,语文,数学\n张三,1班,80,90\n')
+    exported = client.get('/export?format=csv').get_data(as_text=True)
+    assert '总分' in exported.splitlines()[0]
+    upload(client, exported, 'upsert_id')
+    with app.app_context():
+        job = app_module.ImportJob.query.order_by(app_module.ImportJob.created_at.desc()).first()
+        assert (job.status, job.updated, job.warning) == ('done', 1, None) # 总分列不作为未知科目报告
+    assert students(app) == {('张三', '1班'): {'语文': 80, '数学': 90}}
+
+
+def test_job_status(app, client):
+    upload(client, '姓名,班级,语文\n张三,1班,80\n李四,1班,-1\n')
+    with app.app_context():
+        job = app_module.ImportJob.query.one()
+        job_id = job.id
+        assert job.worker == f'{socket.gethostname()}:{os.getpid()}'
+    status = client.get(f'/import/jobs/{job_id}').json
+    assert (status['status'], status['imported'], status['skipped']) == ('done', 1, 1)
+
+    missing = client.get('/import/jobs/no-such-job') # 轮询的页面据此停止，而不是一直等待
+    assert missing.status_code == 404
+    assert missing.json['status'] == 'failed'
+
+
+def test_orphaned_jobs_failed_only_when_their_process_is_gone(app, client):
+    """只有本机上进程已退出的任务被标记为失败：其他 worker、其他主机和本进程的任务不受影响"""
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    host = socket.gethostname()
+    workers = {'dead': f'{host}:{exited.pid}', 'sibling': f'{host}:{os.getppid()}',
+               'self': f'{host}:{os.getpid()}', 'remote': f'other-{host}:{exited.pid}', 'unknown': None}
+    with app.app_context():
+        for job_id, worker in workers.items():
+            app_module.db.session.add(app_module.ImportJob(id=job_id, filename='a.csv', status='running', worker=worker))
+        app_module.db.session.add(app_module.ImportJob(id='dead-queued', filename='a.csv', worker=workers['dead']))
+        app_module.db.session.commit()
+        assert app_module.fail_orphaned_import_jobs() == 2
+        status = dict(app_module.db.session.query(app_module.ImportJob.id, app_module.ImportJob.status))
+    assert status == {'dead': 'failed', 'dead-queued': 'failed', 'sibling': 'running', 'self': 'running',
+                      'remote': 'running', 'unknown': 'running'}
+
+
+def test_status_poll_fails_job_of_exited_process(app, client):
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    with app.app_context():
+        app_module.db.session.add(app_module.ImportJob(id='job', filename='a.csv', status='running',
+                                                       worker=f'{socket.gethostname()}:{exited.pid}'))
+        app_module.db.session.commit()
+    status = client.get('/import/jobs/job').json
+    assert status['status'] == 'failed' and status['finished_at']
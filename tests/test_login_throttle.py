@@ -0,0 +1,65 @@
+"""密码校验限流：超出后返回 429 和 Retry-After，不再校验密码；用户名的计数按客户端 IP 区分；登录时升级过时的哈希"""
+import base64
+
+import app as app_module
+
+
+def login(client, password, ip='10.0.0.1'):
+    return client.post('/login', data={'username': 'admin', 'password': password}, environ_base={'REMOTE_ADDR': ip})
+
+
+def test_username_bucket_returns_429_with_retry_after(app):
+    client = app.test_client()
+    capacity = app.config['LOGIN_RATE_LIMITS']['user'][0]
+    for _ in range(capacity):
+        assert login(client, 'wrong').status_code == 200
+    response = login(client, 'admin') # 桶已空：正确的密码也被拒绝
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+
+
+def test_attacker_does_not_lock_out_user_elsewhere(app):
+    client = app.test_client()
+    for _ in range(app.config['LOGIN_RATE_LIMITS']['user'][0] + 2):
+        login(client, 'wrong', ip='10.6.6.6')
+    assert login(client, 'wrong', ip='10.6.6.6').status_code == 429
+    assert login(app.test_client(), 'admin', ip='10.1.2.3').status_code == 302
+
+
+def test_ip_bucket(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'LOGIN_RATE_LIMITS', {'ip': (3, 60), 'user': (100, 60)})
+    client = app.test_client()
+    for i in range(3):
+        client.post('/login', data={'username': f'user{i}', 'password': 'x'}, environ_base={'REMOTE_ADDR': '10.0.0.9'})
+    response = client.post('/login', data={'username': 'admin', 'password': 'admin'},
+                           environ_base={'REMOTE_ADDR': '10.0.0.9'})
+    assert response.status_code == 429
+    assert 'Retry-After' in response.headers
+
+
+def test_successful_login_resets_username_bucket(app):
+    client = app.test_client()
+    capacity = app.config['LOGIN_RATE_LIMITS']['user'][0]
+    for _ in range(capacity - 1):
+        login(client, 'wrong')
+    assert login(client, 'admin').status_code == 302
+    client.get('/logout')
+    for _ in range(capacity - 1):
+        assert login(client, 'wrong').status_code == 200
+
+
+def test_api_basic_auth_throttled_as_401(app):
+    client = app.test_client()
+    wrong = {'Authorization': 'Basic ' + base64.b64encode(b'admin:wrong').decode()}
+    right = {'Authorization': 'Basic ' + base64.b64encode(b'admin:admin').decode()}
+    for _ in range(app.config['LOGIN_RATE_LIMITS']['user'][0]):
+        assert client.get('/api/v1/subjects', headers=wrong).status_code == 401
+    assert client.get('/api/v1/subjects', headers=right).status_code == 401
+
+
+def test_outdated_hash_upgraded_on_login(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:2000')
+    assert login(app.test_client(), 'admin').status_code == 302
+    with app.app_context():
+        admin = app_module.User.query.filter_by(username='admin').one()
+        assert admin.password.startswith('pbkdf2:sha256:2000$')
@@ -0,0 +1,34 @@
+"""/metrics：Prometheus 文本格式，需要认证；请求和导入的计数随操作增加（计数在进程内累计，按差值比较）"""
+import io
+import re
+
+
+def sample(text, name, **labels):
+    """取出一条样本的值，不存在时为 0"""
+    label_text = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    pattern = '^' + re.escape(name + (f'{{{label_text}}}' if labels else '')) + r' (\S+)$'
+    match = re.search(pattern, text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_requires_authentication(app):
+    assert app.test_client().get('/metrics').status_code == 401
+
+
+def test_counts_requests_and_imports(client):
+    before = client.get('/metrics').get_data(as_text=True)
+    client.get('/students')
+    csv_data = '姓名,班级,语文\n张三,1班,80\n李四,1班,-1\n'.encode('utf-8')
+    client.post('/import', data={'file': (io.BytesIO(csv_data), 'a.csv'), 'mode': 'append'},
+                content_type='multipart/form-data')
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    after = response.get_data(as_text=True)
+
+    labels = {'method': 'GET', 'endpoint': 'student_list', 'status': '200'}
+    assert sample(after, 'http_requests_total', **labels) == sample(before, 'http_requests_total', **labels) + 1
+    for result, count in (('imported', 1), ('skipped', 1)):
+        delta = (sample(after, 'student_import_rows_total', result=result)
+                 - sample(before, 'student_import_rows_total', result=result))
+        assert delta == count
+    assert sample(after, 'db_pool_checkouts_total') > 0
@@ -0,0 +1,87 @@
+"""学生列表与 API 的 keyset 分页：沿“下一页”走完全部学生，再沿“上一页”走回，顺序与预期一致且不重复、不遗漏"""
+import html
+import re
+
+import pytest
+
+import app as app_module
+
+ROW_ID = re.compile(r'<tr class="animate-fadeInUp">.*?<td>(\d+)</td>', re.S)
+PREV_LINK = re.compile(r'<a class="page-link" href="([^"]*)"><i class="bi bi-chevron-left"></i> 上一页')
+NEXT_LINK = re.compile(r'<a class="page-link" href="([^"]*)">下一页')
+
+PER_PAGE = 7
+
+
+def page(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    def link(pattern):
+        match = pattern.search(body)
+        href = html.unescape(match.group(1)) if match else '#'
+        return None if href == '#' else href
+    return [int(sid) for sid in ROW_ID.findall(body)], link(PREV_LINK), link(NEXT_LINK)
+
+
+def expected_order(app, sort):
+    """按列表页的规则排序：排序值降序（按 ID 时升序），再按 ID 升序"""
+    with app.app_context():
+        students = app_module.Student.query.all()
+        if sort == 'id':
+            return sorted(student.id for student in students)
+        if sort == 'total':
+            return [s.id for s in sorted(students, key=lambda s: (-s.total_score, s.id))]
+        scores = app_module.build_score_matrix([s.id for s in students])
+        return [s.id for s in sorted(students, key=lambda s: (-(scores.get(s.id, {}).get(sort) or 0), s.id))]
+
+
+def list_url(sort, subject_id):
+    args = {'id': '', 'total': '&sort_by_total=true', 'subject': f'&sort_by_subject={subject_id}'}[sort]
+    return f'/students?per_page={PER_PAGE}{args}'
+
+
+@pytest.mark.parametrize('sort', ['id', 'total', 'subject'])
+def test_student_list_next_and_prev(app, client, school, subject_ids, sort):
+    school(40)
+    expected = expected_order(app, subject_ids[0] if sort == 'subject' else sort)
+
+    pages, urls, url = [], [], list_url(sort, subject_ids[0])
+    while url:
+        urls.append(url)
+        ids, prev_url, url = page(client, url)
+        assert (prev_url is None) == (not pages)
+        pages.append(ids)
+    assert [sid for ids in pages for sid in ids] == expected
+    assert all(len(ids) == PER_PAGE for ids in pages[:-1])
+
+    # 从最后一页沿“上一页”返回，每一页与前进时看到的相同
+    _, url, _ = page(client, urls[-1])
+    for ids in reversed(pages[:-1]):
+        got, url, next_url = page(client, url)
+        assert got == ids
+        assert next_url is not None
+    assert url is None
+
+
+@pytest.mark.parametrize('sort', ['id', 'total', 'subject'])
+def test_api_cursor_pagination(app, client, school, subject_ids, sort):
+    school(30, seed=1)
+    expected = expected_order(app, subject_ids[0] if sort == 'subject' else sort)
+    api_sort = f'subject:{subject_ids[0]}' if sort == 'subject' else sort
+
+    seen, cursor = [], ''
+    while True:
+        response = client.get('/api/v1/students', query_string={'limit': 4, 'sort': api_sort, 'cursor': cursor,
+                                                                'fields': 'id'})
+        assert response.status_code == 200
+        seen.extend(item['id'] for item in response.json['items'])
+        cursor = response.json['next_cursor']
+        if cursor is None:
+            break
+    assert seen == expected
+
+
+def test_api_rejects_invalid_cursor(client):
+    response = client.get('/api/v1/students?cursor=not-a-cursor')
+    assert response.status_code == 400
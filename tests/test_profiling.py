@@ -0,0 +1,57 @@
+"""请求性能分析：抽中的请求返回 SQL 条数等响应头，并出现在 /debug/perf 中"""
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import app as app_module
+
+
+@pytest.fixture
+def profiling(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'PROFILING_ENABLED', True)
+    monkeypatch.setitem(app.config, 'PROFILING_SAMPLE_RATE', 1.0)
+    app_module.perf_history.clear()
+    yield
+    app_module.perf_history.clear()
+
+
+def test_disabled_by_default(client):
+    assert 'X-Query-Count' not in client.get('/students').headers
+
+
+def test_profiled_request(app, client, school, profiling):
+    school(5)
+    response = client.get('/students')
+    assert int(response.headers['X-Query-Count']) > 0
+    assert 'db;dur=' in response.headers['Server-Timing']
+
+    data = client.get('/debug/perf?format=json').json
+    record = next(record for record in data['requests'] if record['endpoint'] == 'student_list')
+    assert record['queries'] == int(response.headers['X-Query-Count'])
+    assert 0 < len(record['slowest']) <= app.config['PROFILING_SLOW_QUERIES']
+    assert any(item['endpoint'] == 'student_list' for item in data['endpoints'])
+    assert client.get('/debug/perf').status_code == 200
+
+
+def test_admin_usernames_are_configurable(app, client, profiling, monkeypatch):
+    with app.app_context():
+        app_module.db.session.add(app_module.User(username='teacher', password=app_module.hash_password('secret')))
+        app_module.db.session.commit()
+    teacher = app.test_client()
+    assert teacher.post('/login', data={'username': 'teacher', 'password': 'secret'}).status_code == 302
+    assert teacher.get('/debug/perf').status_code == 403
+
+    monkeypatch.setitem(app.config, 'ADMIN_USERNAMES', frozenset({'teacher'}))
+    assert teacher.get('/debug/perf').status_code == 200
+    assert '性能分析' in teacher.get('/students').get_data(as_text=True) # 用户菜单中的入口
+    assert client.get('/debug/perf').status_code == 403
+
+
+def test_failed_statement_does_not_leave_a_timer_behind(app, profiling):
+    with app.test_request_context('/students'), app_module.db.engine.connect() as connection:
+        app_module.g.perf = {'queries': 0, 'db_time': 0.0, 'slowest': []}
+        with pytest.raises(OperationalError):
+            connection.execute(text('SELECT * FROM no_such_table'))
+        assert not connection.info.get('perf_query_start')
+        connection.execute(text('SELECT 1'))
+        assert app_module.g.perf['queries'] == 1
@@ -0,0 +1,106 @@
+"""每条写入路径之后，冗余的总分和物化名次都与 RANK() 全量重算的结果一致"""
+import io
+import random
+
+import pytest
+
+import app as app_module
+from conftest import CLASSES, assert_consistent
+
+
+@pytest.fixture(params=[0, 3, 1000], ids=['rerank', 'default', 'incremental'])
+def rank_mode(request, app, monkeypatch):
+    """RANK_INCREMENTAL_MAX 为 0 时所有写入都按组重算，足够大时都走逐行增量更新"""
+    monkeypatch.setitem(app.config, 'RANK_INCREMENTAL_MAX', request.param)
+    return request.param
+
+
+def check(app):
+    with app.app_context():
+        assert_consistent()
+
+
+def score_form(subject_ids, rng, name='新学生', class_name=None):
+    form = {'name': name, 'class_name': class_name or rng.choice(CLASSES)}
+    for subject_id in subject_ids:
+        form[f'score_{subject_id}'] = rng.choice(('', '60', '70', '80', '90', '95.5'))
+    return form
+
+
+def test_add_edit_delete_student(app, client, school, subject_ids, rank_mode):
+    student_ids = school(30)
+    rng = random.Random(rank_mode)
+    for i in range(5):
+        assert client.post('/student/add', data=score_form(subject_ids, rng, name=f'新增{i}')).status_code == 302
+        check(app)
+    for sid in rng.sample(student_ids, 8):
+        assert client.post(f'/student/edit/{sid}', data=score_form(subject_ids, rng, name=f'改{sid}')).status_code == 302
+        check(app)
+    cleared = {'name': '无成绩', 'class_name': CLASSES[0], **{f'score_{subject_id}': '' for subject_id in subject_ids}}
+    assert client.post(f'/student/edit/{student_ids[0]}', data=cleared).status_code == 302 # 不再参与排名
+    check(app)
+    for sid in rng.sample(student_ids[1:], 3):
+        assert client.post(f'/student/delete/{sid}').status_code == 302
+        check(app)
+
+
+def test_delete_subject(app, client, school, subject_ids):
+    school(20)
+    assert client.post(f'/subject/delete/{subject_ids[1]}').status_code == 302
+    check(app)
+    with app.app_context():
+        assert app_module.Score.query.filter_by(subject_id=subject_ids[1]).count() == 0
+
+
+def test_grade_grid(app, client, school, subject_ids, rank_mode):
+    school(30)
+    rng = random.Random(rank_mode)
+    with app.app_context():
+        rows = app_module.load_grade_grid('1班', subject_ids[1])
+    form = {'class_name': '1班', 'subject_id': subject_ids[1]}
+    for student_id, _, _, score in rows:
+        form[f'orig_{student_id}'] = '' if score is None else f'{score:g}'
+        form[f'score_{student_id}'] = rng.choice(('', '55', '70', '100'))
+    assert client.post('/grades', data=form).status_code == 302
+    check(app)
+
+
+@pytest.mark.parametrize('mode', ['append', 'upsert'])
+def test_import(app, client, school, rank_mode, mode):
+    school(20)
+    lines = ['姓名,班级,语文,数学,英语']
+    lines += [f'学生{i},{CLASSES[i % 3]},{50 + i},,{90 - i}' for i in range(0, 30, 2)] # 与已有学生同名的行
+    csv_data = '\n'.join(lines).encode('utf-8')
+    response = client.post('/import', data={'file': (io.BytesIO(csv_data), 'scores.csv'), 'mode': mode},
+                           content_type='multipart/form-data')
+    assert response.status_code == 302
+    check(app)
+
+
+def test_api_writes(app, client, school, subject_ids, rank_mode):
+    student_ids = school(30)
+    rng = random.Random(rank_mode)
+    created = client.post('/api/v1/students', json={'students': [
+        {'name': f'接口{i}', 'class_name': rng.choice(CLASSES),
+         'scores': {str(subject_id): rng.choice((60, 75, 90)) for subject_id in subject_ids}}
+        for i in range(6)]})
+    assert created.status_code == 201
+    check(app)
+
+    assert client.patch('/api/v1/students', json={'students': [
+        {'id': student_ids[0], 'class_name': '3班'},
+        {'id': student_ids[1], 'scores': {str(subject_ids[0]): None, str(subject_ids[1]): 100}},
+    ]}).status_code == 200
+    check(app)
+
+    assert client.put('/api/v1/scores', json={'scores': [
+        {'student_id': sid, 'subject_id': subject_ids[2], 'score': rng.choice((65, 80, 99))}
+        for sid in student_ids[5:15]]}).status_code == 200
+    check(app)
+
+    assert client.delete('/api/v1/scores', json={'scores': [
+        {'student_id': sid, 'subject_id': subject_ids[0]} for sid in student_ids[10:14]]}).status_code == 200
+    check(app)
+
+    assert client.delete('/api/v1/students', json={'ids': student_ids[20:25] + created.json['created'][:2]}).status_code == 200
+    check(app)
@@ -0,0 +1,54 @@
+"""主从路由：@read_replica 视图的 GET 读从库，写入和 API 走主库，刚写入过的用户继续读主库"""
+import io
+
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.pool import StaticPool
+
+import app as app_module
+
+
+@pytest.fixture
+def replica(app, monkeypatch):
+    """一个内存 SQLite 作为从库，只包含一名主库中没有的学生"""
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    app_module.db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(app_module.Student), [{'name': '从库学生', 'class_name': '1班'}])
+    monkeypatch.setitem(app.config, 'LIST_FRAGMENT_CACHE', False)
+    monkeypatch.setattr(app_module.replica_router, 'keys', ['replica_0'])
+    monkeypatch.setattr(app_module.replica_router, 'choose', lambda: ('replica_0', engine))
+    yield engine
+    engine.dispose()
+
+
+def test_reads_routed_to_replica(client, replica):
+    assert client.post('/student/add', data={'name': '主库学生', 'class_name': '1班'}).status_code == 302
+    assert client.get('/api/v1/students').get_json()['items'][0]['name'] == '主库学生' # API 总是用主库
+
+    with client.session_transaction() as sess:
+        sess.pop('last_write', None)
+    page = client.get('/students').get_data(as_text=True)
+    assert '从库学生' in page and '主库学生' not in page
+
+
+def test_read_your_writes(client, replica, monkeypatch):
+    assert client.post('/student/add', data={'name': '主库学生', 'class_name': '1班'}).status_code == 302
+    page = client.get('/students').get_data(as_text=True)
+    assert '主库学生' in page and '从库学生' not in page
+
+    monkeypatch.setitem(client.application.config, 'REPLICA_READ_YOUR_WRITES_SECONDS', 0)
+    page = client.get('/students').get_data(as_text=True)
+    assert '从库学生' in page
+
+
+def test_sync_import_counts_as_write(client, replica):
+    """同步导入在请求的应用上下文中执行，导入后的读请求同样留在主库"""
+    csv_data = '姓名,班级,语文\n导入学生,1班,80\n'.encode('utf-8')
+    response = client.post('/import', data={'file': (io.BytesIO(csv_data), 'a.csv'), 'mode': 'append'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 302
+    with client.session_transaction() as sess:
+        assert 'last_write' in sess
+    page = client.get('/students').get_data(as_text=True)
+    assert '导入学生' in page and '从库学生' not in page
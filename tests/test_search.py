@@ -0,0 +1,44 @@
+"""姓名搜索：任意连续片段与拼音首字母，改名和删除后索引同步更新"""
+import pytest
+
+import app as app_module
+
+
+def add(client, name, class_name='1班'):
+    assert client.post('/student/add', data={'name': name, 'class_name': class_name}).status_code == 302
+    with client.application.app_context():
+        return app_module.Student.query.filter_by(name=name).one().id
+
+
+def names(client, query):
+    """学生列表中搜索 query 得到的姓名集合"""
+    body = client.get('/students', query_string={'search_name': query}).get_data(as_text=True)
+    return {name for name in ('张三丰', '张三', '李四', '欧阳张三') if f'<td>{name}</td>' in body}
+
+
+def test_substring_search(app, client):
+    for name in ('张三丰', '李四', '欧阳张三'):
+        add(client, name)
+    assert names(client, '张三') == {'张三丰', '欧阳张三'}
+    assert names(client, '三丰') == {'张三丰'}
+    assert names(client, '四') == {'李四'}
+    assert names(client, '王') == set()
+
+
+def test_index_follows_rename_and_delete(app, client):
+    student_id = add(client, '李四')
+    assert client.post(f'/student/edit/{student_id}', data={'name': '张三', 'class_name': '1班'}).status_code == 302
+    assert names(client, '李') == set()
+    assert names(client, '张三') == {'张三'}
+    assert client.post(f'/student/delete/{student_id}').status_code == 302
+    with app.app_context():
+        assert app_module.StudentNameToken.query.count() == 0
+
+
+def test_pinyin_initials(app, client):
+    pytest.importorskip('pypinyin')
+    add(client, '张三丰')
+    add(client, '李四')
+    assert names(client, 'zs') == {'张三丰'}
+    assert names(client, 'ZSF') == {'张三丰'}
+    assert names(client, 'ls') == {'李四'}
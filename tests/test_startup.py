@@ -0,0 +1,50 @@
+"""启动检查：没有管理员时只用配置的初始密码创建，不再生成 admin/admin；预热不影响请求"""
+from werkzeug.security import check_password_hash
+
+import app as app_module
+
+
+def remove_admin(flask_app):
+    with flask_app.app_context():
+        app_module.User.query.filter_by(username='admin').delete()
+        app_module.db.session.commit()
+
+
+def get_admin(flask_app):
+    with flask_app.app_context():
+        return app_module.User.query.filter_by(username='admin').first()
+
+
+def test_no_default_admin_without_initial_password(app, monkeypatch):
+    monkeypatch.delenv('INITIAL_ADMIN_PASSWORD', raising=False)
+    remove_admin(app)
+    app_module.initialize_database(app)
+    assert get_admin(app) is None
+
+
+def test_admin_created_from_initial_password(app, monkeypatch):
+    monkeypatch.setenv('INITIAL_ADMIN_PASSWORD', 's3cret-pw')
+    remove_admin(app)
+    app_module.initialize_database(app)
+    app_module.warm_up(app)
+    admin = get_admin(app)
+    assert admin is not None and check_password_hash(admin.password, 's3cret-pw')
+    assert not check_password_hash(admin.password, 'admin')
+
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'admin', 'password': 's3cret-pw'})
+    assert response.status_code == 302
+    assert client.get('/students').status_code == 200
+
+
+def test_create_app_builds_a_new_app(app, tmp_path, monkeypatch):
+    """每次调用都按当前目录的 config.yaml 新建应用：生成 secret_key、创建上传目录，路由和 CLI 命令注册在新应用上"""
+    (tmp_path / 'config.yaml').write_text("database:\n  url: 'sqlite://'\n", encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+    other = app_module.create_app()
+    assert other is not app
+    assert other.config['SECRET_KEY'] and other.config['SECRET_KEY'] != app.config['SECRET_KEY']
+    assert 'secret_key' in (tmp_path / 'config.yaml').read_text(encoding='utf-8')
+    assert (tmp_path / 'uploads').is_dir()
+    assert set(other.view_functions) == set(app.view_functions)
+    assert {'init-db', 'db-audit', 'db'} <= set(other.cli.list_commands(None))
@@ -0,0 +1,51 @@
+"""/stats/data 的聚合结果与在 Python 中直接计算的结果一致（均值、标准差和百分位数保留两位小数）"""
+import math
+
+import pytest
+
+import app as app_module
+
+
+def percentile(values, q):
+    """线性插值百分位数（与 percentile_cont 相同）"""
+    values = sorted(values)
+    position = (len(values) - 1) * q
+    low = math.floor(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def summary(values):
+    mean = sum(values) / len(values)
+    return {'count': len(values), 'mean': pytest.approx(mean, abs=0.005), 'min': min(values), 'max': max(values),
+            'std': pytest.approx(math.sqrt(sum((v - mean) ** 2 for v in values) / len(values)), abs=0.005)}
+
+
+def test_subject_and_class_statistics(app, client, school, subject_ids):
+    school(60, seed=3)
+    data = client.get('/stats/data').json
+    with app.app_context():
+        scores = app_module.db.session.query(app_module.Score.subject_id, app_module.Score.score).all()
+        totals = app_module.db.session.query(app_module.Student.class_name, app_module.Student.total_score)\
+                                      .filter(app_module.Student.score_count > 0).all()
+
+    for item in data['subjects']:
+        values = [score for subject_id, score in scores if subject_id == item['subject_id']]
+        assert {key: item[key] for key in ('count', 'mean', 'min', 'max', 'std')} == summary(values)
+        for q in data['percentiles']:
+            assert item['percentiles'][f'p{round(q * 100)}'] == pytest.approx(percentile(values, q), abs=0.005)
+        assert sum(item['histogram']['counts']) == len(values)
+
+    for item in data['classes']:
+        values = [total for class_name, total in totals if class_name == item['class_name']]
+        assert {key: item[key] for key in ('count', 'mean', 'min', 'max', 'std')} == summary(values)
+        for q in data['percentiles']:
+            assert item['percentiles'][f'p{round(q * 100)}'] == pytest.approx(percentile(values, q), abs=0.005)
+
+
+def test_histogram_bin_width(client, school):
+    school(20)
+    item = client.get('/stats/data?bin_width=5').json['subjects'][0]
+    edges = item['histogram']['edges']
+    assert all(b - a == 5 for a, b in zip(edges, edges[1:]))
+    assert len(edges) == len(item['histogram']['counts']) + 1
@@ -0,0 +1,12 @@
+"""
+生产环境 WSGI 入口：
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+其他 WSGI 服务器 (uWSGI、waitress 等) 同样加载 wsgi:application。
+"""
+from app import create_app, initialize_database, warm_up
+
+application = create_app()
+initialize_database(application) # 启动检查：数据库连接、管理员和默认科目
+warm_up(application)